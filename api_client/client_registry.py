@@ -0,0 +1,85 @@
+# api_client/client_registry.py
+
+import logging
+import threading
+
+from api_client.xui_api_client import XuiAPIClient
+
+logger = logging.getLogger(__name__)
+
+
+class XuiClientRegistry:
+    """
+    برای هر سرور ثبت شده یک XuiAPIClient احراز هویت‌شده نگه می‌دارد تا هر سفارش
+    هزینه TLS handshake و درخواست /login را دوباره نپردازد.
+    با تغییر مجموعه سرورها (add_server / delete_server) کل رجیستری باطل می‌شود.
+    """
+
+    def __init__(self, db_manager, client_class=XuiAPIClient):
+        self.db_manager = db_manager
+        self.client_class = client_class
+        self._clients = {}  # {server_id: (fingerprint, client)}
+        self._servers_version = db_manager.servers_version
+        self._lock = threading.Lock()
+
+    def _sync_with_db(self):
+        """اگر سروری اضافه یا حذف شده باشد، کلاینت‌های قدیمی کنار گذاشته می‌شوند."""
+        if self.db_manager.servers_version != self._servers_version:
+            logger.info("Server set changed. Invalidating X-UI client registry.")
+            self.invalidate()
+            self._servers_version = self.db_manager.servers_version
+
+    def peek_client(self, server_data):
+        """کلاینت سرور را بدون بررسی لاگین برمی‌گرداند."""
+        with self._lock:
+            self._sync_with_db()
+            server_id = server_data['id']
+            fingerprint = (server_data['panel_url'], server_data['username'], server_data['password'])
+            entry = self._clients.get(server_id)
+            if entry is None or entry[0] != fingerprint:
+                if entry is not None:
+                    entry[1].session.close()
+                client = self.client_class(
+                    panel_url=server_data['panel_url'],
+                    username=server_data['username'],
+                    password=server_data['password']
+                )
+                self._clients[server_id] = (fingerprint, client)
+                return client
+            return entry[1]
+
+    def get_client(self, server_data, force_login=False):
+        """
+        کلاینت لاگین‌شده سرور را برمی‌گرداند یا در صورت عدم موفقیت در لاگین None.
+        با force_login=True، حتی اگر سشن معتبر باشد لاگین مجدد انجام می‌شود (برای تست اتصال).
+        """
+        client = self.peek_client(server_data)
+        is_logged_in = client.relogin() if force_login else client.check_login()
+        if not is_logged_in:
+            logger.error(f"Failed to login to X-UI panel for server {server_data.get('name', server_data['id'])}.")
+            return None
+        return client
+
+    def invalidate(self, server_id=None):
+        """کلاینت یک سرور یا (در صورت None بودن server_id) همه کلاینت‌ها را حذف می‌کند."""
+        if server_id is None:
+            entries = list(self._clients.values())
+            self._clients.clear()
+        else:
+            entry = self._clients.pop(server_id, None)
+            entries = [entry] if entry else []
+        for _, client in entries:
+            client.session.close()
+
+
+_registry: XuiClientRegistry = None
+_registry_lock = threading.Lock()
+
+
+def get_client_registry(db_manager, client_class=XuiAPIClient) -> XuiClientRegistry:
+    """رجیستری سراسری پروسه را برمی‌گرداند (و در اولین فراخوانی می‌سازد)."""
+    global _registry
+    with _registry_lock:
+        if _registry is None or _registry.db_manager is not db_manager:
+            _registry = XuiClientRegistry(db_manager, client_class)
+        return _registry
@@ -0,0 +1,85 @@
+# api_client/inbound_cache.py
+
+import json
+import logging
+import threading
+import time
+
+from config import INBOUND_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class InboundMetadataCache:
+    """
+    کش اطلاعات اینباندهای هر سرور (protocol، port، remark و streamSettings پارس شده).
+    با یک فراخوانی list_inbounds برای کل سرور پر می‌شود و پس از ttl_seconds منقضی می‌شود.
+    """
+
+    def __init__(self, ttl_seconds=INBOUND_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}  # {server_id: (loaded_at, {inbound_id: metadata})}
+        self._lock = threading.Lock()
+        self._server_locks = {}
+
+    @staticmethod
+    def _parse_inbound(panel_inbound: dict) -> dict:
+        stream_settings = panel_inbound.get('streamSettings') or '{}'
+        if isinstance(stream_settings, str):
+            try:
+                stream_settings = json.loads(stream_settings)
+            except json.JSONDecodeError:
+                logger.warning(f"Invalid streamSettings for inbound {panel_inbound.get('id')}.")
+                stream_settings = {}
+        return {
+            'id': panel_inbound.get('id'),
+            'protocol': panel_inbound.get('protocol'),
+            'port': panel_inbound.get('port'),
+            'remark': panel_inbound.get('remark'),
+            'streamSettings': stream_settings,
+        }
+
+    def store(self, server_id, panel_inbounds: list):
+        """خروجی list_inbounds یک سرور را در کش قرار می‌دهد (جایگزین داده قبلی)."""
+        metadata = {inbound['id']: self._parse_inbound(inbound) for inbound in panel_inbounds if 'id' in inbound}
+        with self._lock:
+            self._entries[server_id] = (time.monotonic(), metadata)
+        logger.info(f"Inbound metadata cache refreshed for server {server_id} ({len(metadata)} inbounds).")
+
+    def invalidate(self, server_id=None):
+        with self._lock:
+            if server_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(server_id, None)
+
+    def _get_fresh(self, server_id):
+        with self._lock:
+            entry = self._entries.get(server_id)
+        if entry and time.monotonic() - entry[0] < self.ttl_seconds:
+            return entry[1]
+        return None
+
+    def get_many(self, server_id, inbound_ids: list, xui_client) -> dict:
+        """
+        اطلاعات اینباندهای خواسته شده را برمی‌گرداند: {inbound_id: metadata یا None}.
+        اگر کش منقضی شده باشد یا اینباندی در آن نباشد، با یک فراخوانی list_inbounds پر می‌شود.
+        """
+        metadata = self._get_fresh(server_id)
+        if metadata is None or any(inbound_id not in metadata for inbound_id in inbound_ids):
+            with self._lock:
+                server_lock = self._server_locks.setdefault(server_id, threading.Lock())
+            with server_lock:
+                # ممکن است thread دیگری در همین فاصله کش را پر کرده باشد
+                metadata = self._get_fresh(server_id)
+                if metadata is None or any(inbound_id not in metadata for inbound_id in inbound_ids):
+                    panel_inbounds = xui_client.list_inbounds()
+                    if panel_inbounds:
+                        self.store(server_id, panel_inbounds)
+                        metadata = self._get_fresh(server_id)
+        metadata = metadata or {}
+        return {inbound_id: metadata.get(inbound_id) for inbound_id in inbound_ids}
+
+
+# کش سراسری پروسه
+inbound_cache = InboundMetadataCache()
@@ -5,24 +5,35 @@ import urllib3
 import json 
 import logging 
 import time 
+import threading
+from requests.adapters import HTTPAdapter
 
-from config import MAX_API_RETRIES # این ایمپورت باید از config بیاید
+from config import MAX_API_RETRIES, XUI_POOL_MAXSIZE, XUI_SESSION_TTL_SECONDS # این ایمپورت باید از config بیاید
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 logger = logging.getLogger(__name__) 
 
 class XuiAPIClient: 
-    def __init__(self, panel_url, username, password, two_factor=None): 
+    def __init__(self, panel_url, username, password, two_factor=None, session_ttl=XUI_SESSION_TTL_SECONDS): 
         self.panel_url = panel_url.rstrip('/') 
         self.username = username
         self.password = password
         self.two_factor = two_factor
         self.session = requests.Session() # استفاده از requests.Session
+        # یک pool ثابت از اتصال‌های keep-alive تا هر درخواست هزینه TLS handshake جدید نپردازد
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=XUI_POOL_MAXSIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         # session_token_value دیگر لازم نیست اگر کوکی 3x-ui به درستی مدیریت شود.
+        self.session_ttl = session_ttl
+        self._logged_in_at = None
+        self._login_lock = threading.Lock()
+        # نوع آخرین خطای لاگین (مثلاً ConnectTimeout یا LoginRejected)؛ None یعنی لاگین موفق
+        self.last_error = None
         logger.info(f"XuiAPIClient initialized for {self.panel_url}") 
 
-    def _make_request(self, method, endpoint, data=None, retries=0):
+    def _make_request(self, method, endpoint, data=None, retries=0, reauthenticated=False):
         url = f"{self.panel_url}{endpoint}"
         headers = {"Content-Type": "application/json"} 
         # requests.Session() به طور خودکار کوکی‌ها را مدیریت می‌کند.
@@ -62,6 +73,15 @@ class XuiAPIClient:
                 logger.info(f"Retrying {endpoint} ({retries + 1}/{MAX_API_RETRIES})...")
                 return self._make_request(method, endpoint, data, retries + 1)
             return None
+        except requests.exceptions.HTTPError as e:
+            status_code = e.response.status_code if e.response is not None else None
+            # سشن ذخیره شده ممکن است در سمت پنل منقضی شده باشد؛ یک بار لاگین مجدد انجام می‌شود
+            if status_code in [401, 403, 404] and not reauthenticated:
+                logger.warning(f"API request to {endpoint} returned {status_code}. Re-login and retry once.")
+                if self.relogin():
+                    return self._make_request(method, endpoint, data, retries, reauthenticated=True)
+            logger.error(f"API request to {endpoint} failed with HTTP error: {e}")
+            return None
         except requests.exceptions.RequestException as e:
             logger.error(f"An unexpected API request error occurred for {endpoint}: {e}")
             if hasattr(response, 'text'):
@@ -96,30 +116,55 @@ class XuiAPIClient:
                 # این مهم است: به دنبال کوکی '3x-ui' می‌گردیم
                 if '3x-ui' in self.session.cookies: 
                     logger.info("Successfully logged in to X-UI panel. '3x-ui' cookie found.")
+                    self._logged_in_at = time.monotonic()
+                    self.last_error = None
                     return True
                 else:
                     logger.warning("Login successful (API returned success) but no '3x-ui' cookie found in response.")
                     # در این حالت، اگرچه API موفقیت را اعلام کرده، اما کوکی مورد نیاز برای احراز هویت را دریافت نکردیم.
                     # ممکن است نیاز به بررسی دستی نام کوکی‌های دیگر در headers.
+                    self.last_error = "NoSessionCookie"
                     return False
             else:
                 logger.error(f"Failed to login to X-UI panel: API returned unsuccessful. Message: {response_json.get('msg', 'No message')}. Status Code: {res.status_code}")
+                self.last_error = "LoginRejected"
                 return False
         except requests.exceptions.RequestException as e:
             logger.error(f"Login request error: {e}")
+            self.last_error = type(e).__name__
             return False
         except json.JSONDecodeError:
             logger.error(f"Failed to decode JSON response from login. Response text: {res.text}")
+            self.last_error = "InvalidResponse"
+            return False
+
+    def _has_valid_session(self):
+        """کوکی '3x-ui' موجود و منقضی نشده باشد و عمر سشن از session_ttl بیشتر نشده باشد."""
+        self.session.cookies.clear_expired_cookies()
+        if '3x-ui' not in self.session.cookies or self._logged_in_at is None:
+            return False
+        if self.session_ttl and time.monotonic() - self._logged_in_at >= self.session_ttl:
             return False
+        return True
 
     def check_login(self):
         """
         بررسی می‌کند که آیا لاگین معتبر است یا خیر.
-        اگر کوکی '3x-ui' در session موجود باشد، True برمی‌گرداند.
+        اگر کوکی '3x-ui' در session موجود و معتبر باشد، True برمی‌گرداند؛ در غیر این صورت یک بار لاگین می‌کند.
         """
-        if '3x-ui' in self.session.cookies: # <--- اینجا هم به روز شد
-            return True 
-        else:
+        if self._has_valid_session():
+            return True
+        with self._login_lock:
+            # ممکن است thread دیگری در همین فاصله لاگین کرده باشد
+            if self._has_valid_session():
+                return True
+            return self.login()
+
+    def relogin(self):
+        """سشن فعلی را دور ریخته و لاگین مجدد انجام می‌دهد."""
+        with self._login_lock:
+            self.session.cookies.clear()
+            self._logged_in_at = None
             return self.login()
 
     def list_inbounds(self):
@@ -212,6 +257,20 @@ class XuiAPIClient:
             logger.warning(f"Failed to add client to inbound {data.get('id', 'N/A')}: {response}")
             return False
 
+    def add_clients(self, inbound_id, clients: list):
+        """
+        چند کلاینت را با یک درخواست addClient به یک اینباند اضافه می‌کند.
+        پنل درخواست را به صورت یکجا می‌پذیرد یا رد می‌کند.
+        """
+        payload = {
+            "id": inbound_id,
+            "settings": json.dumps({"clients": clients})
+        }
+        if not self.add_client(payload):
+            return False
+        logger.info(f"{len(clients)} clients added to inbound {inbound_id} in one request.")
+        return True
+
     def delete_client(self, inbound_id, client_id):
         if not self.check_login():
             logger.error("Not logged in to X-UI. Cannot delete client.")
@@ -0,0 +1,232 @@
+# api_client/zarinpal_client.py
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (
+    ZARINPAL_API_BASE_URL, ZARINPAL_STARTPAY_URL, ZARINPAL_TIMEOUT_SECONDS, ZARINPAL_MAX_RETRIES,
+    ZARINPAL_MAX_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ZarinpalClient:
+    """
+    کلاینت API زرین‌پال (نسخه ۴) با سشن keep-alive مشترک، تلاش مجدد با تاخیر تصادفی (jitter)
+    و مسیر غیرهمزمان تا درخواست کند به درگاه، thread هندلرهای ربات را معطل نکند.
+    آدرس پایه قابل تنظیم است تا بتوان آن را روی یک سرور جعلی محلی اجرا کرد.
+    """
+
+    def __init__(self, base_url=ZARINPAL_API_BASE_URL, startpay_url=ZARINPAL_STARTPAY_URL,
+                 timeout=ZARINPAL_TIMEOUT_SECONDS, max_retries=ZARINPAL_MAX_RETRIES, max_workers=ZARINPAL_MAX_WORKERS):
+        self.base_url = base_url.rstrip('/')
+        self.startpay_url = startpay_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        self.session.headers.update({'Accept': 'application/json', 'Content-Type': 'application/json'})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="zarinpal")
+
+    def _post(self, path, payload):
+        """
+        درخواست POST با تلاش مجدد روی خطاهای اتصال، timeout و پاسخ‌های 5xx.
+        تاخیر بین تلاش‌ها به صورت نمایی با jitter کامل است تا درخواست‌های همزمان پشت هم نرسند.
+        """
+        url = f"{self.base_url}/{path}"
+        for attempt in range(1, self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout)
+                if response.status_code < 500 or attempt == self.max_retries:
+                    response.raise_for_status()
+                    logger.info(f"Zarinpal {path} answered in {time.perf_counter() - start:.2f}s (attempt {attempt}).")
+                    return response.json()
+                logger.warning(f"Zarinpal {path} returned {response.status_code} (attempt {attempt}/{self.max_retries}).")
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Zarinpal {path} failed: {e} (attempt {attempt}/{self.max_retries}).")
+            time.sleep(random.uniform(0, 0.5 * 2 ** (attempt - 1)))
+
+    def request_payment(self, merchant_id, amount_rial, callback_url, description, metadata=None):
+        """درخواست ساخت تراکنش؛ پاسخ JSON زرین‌پال را برمی‌گرداند یا RequestException ایجاد می‌کند."""
+        payload = {
+            "merchant_id": merchant_id,
+            "amount": amount_rial,
+            "callback_url": callback_url,
+            "description": description,
+            "metadata": metadata or {},
+        }
+        return self._post("request.json", payload)
+
+    def verify_payment(self, merchant_id, amount_rial, authority):
+        """تایید تراکنش پس از بازگشت کاربر از درگاه (کد 100 = موفق، 101 = قبلاً تایید شده)."""
+        payload = {"merchant_id": merchant_id, "amount": amount_rial, "authority": authority}
+        return self._post("verify.json", payload)
+
+    def get_payment_url(self, authority):
+        return f"{self.startpay_url}{authority}"
+
+    def _submit(self, func, args, on_success, on_error):
+        def _done(future):
+            try:
+                error = future.exception()
+                if error is None:
+                    on_success(future.result())
+                elif on_error:
+                    on_error(error)
+                else:
+                    logger.error(f"Zarinpal call {func.__name__} failed: {error}")
+            except Exception as e:
+                logger.error(f"Error in Zarinpal callback for {func.__name__}: {e}", exc_info=True)
+
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(_done)
+        return future
+
+    def request_payment_async(self, merchant_id, amount_rial, callback_url, description, metadata=None,
+                              on_success=None, on_error=None):
+        """مانند request_payment ولی بلافاصله برمی‌گردد؛ نتیجه به on_success(result) یا on_error(exception) داده می‌شود."""
+        return self._submit(self.request_payment, (merchant_id, amount_rial, callback_url, description, metadata),
+                            on_success or (lambda result: None), on_error)
+
+    def verify_payment_async(self, merchant_id, amount_rial, authority, on_success=None, on_error=None):
+        return self._submit(self.verify_payment, (merchant_id, amount_rial, authority),
+                            on_success or (lambda result: None), on_error)
+
+
+_client: ZarinpalClient = None
+_client_lock = threading.Lock()
+
+
+def get_zarinpal_client() -> ZarinpalClient:
+    """کلاینت سراسری پروسه (سشن و thread pool مشترک) را برمی‌گرداند."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ZarinpalClient()
+        return _client
+
+
+if __name__ == "__main__":
+    # اجرای کلاینت روی یک سرور جعلی محلی زرین‌پال: تلاش مجدد با jitter روی 503 و timeout،
+    # مسیر غیرهمزمان (درخواست‌های همزمان روی pool) و تایید تراکنش (100 و سپس 101 برای تایید تکراری)
+    import json
+    import sys
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    concurrent_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    latency = 0.2
+
+    class FakeZarinpal:
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.calls = {}
+            self.verified = set()
+            self.fail_next = {}  # {path: [پاسخ‌های خطای بعدی: 503 یا 'timeout']}
+
+        def plan_failures(self, path, failures):
+            with self.lock:
+                self.fail_next[path] = list(failures)
+
+        def next_failure(self, path):
+            with self.lock:
+                self.calls[path] = self.calls.get(path, 0) + 1
+                failures = self.fail_next.get(path)
+                return failures.pop(0) if failures else None
+
+    fake = FakeZarinpal()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            path = self.path.rsplit('/', 1)[-1]
+            failure = fake.next_failure(path)
+            time.sleep(latency)
+            if failure == 'timeout':
+                # پاسخی داده نمی‌شود؛ کلاینت پس از timeout دوباره تلاش می‌کند
+                time.sleep(2)
+                self.close_connection = True
+                return
+            if failure == 503:
+                return self._reply(503, {'errors': {'message': 'Service Unavailable'}})
+            if path == 'request.json':
+                authority = f"A{random.randrange(10 ** 12):036d}"
+                return self._reply(200, {'data': {'code': 100, 'authority': authority}, 'errors': []})
+            if path == 'verify.json':
+                with fake.lock:
+                    code = 101 if payload['authority'] in fake.verified else 100
+                    fake.verified.add(payload['authority'])
+                return self._reply(200, {'data': {'code': code, 'ref_id': 12345}, 'errors': []})
+            self._reply(404, {'errors': {'message': 'not found'}})
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = ZarinpalClient(base_url=f"http://127.0.0.1:{server.server_port}", timeout=1, max_retries=3,
+                            max_workers=concurrent_requests)
+    merchant = "00000000-0000-0000-0000-000000000000"
+
+    # ۱. تلاش مجدد: دو پاسخ 503 و یک timeout، سپس موفقیت
+    fake.plan_failures('request.json', [503, 503])
+    start = time.perf_counter()
+    result = client.request_payment(merchant, 10000, "http://127.0.0.1/callback", "retry test")
+    assert result['data']['code'] == 100, result
+    print(f"request with 2x 503: ok after {fake.calls['request.json']} attempts in {time.perf_counter() - start:.2f}s")
+    fake.plan_failures('verify.json', ['timeout'])
+    start = time.perf_counter()
+    authority = result['data']['authority']
+    assert client.verify_payment(merchant, 10000, authority)['data']['code'] == 100
+    print(f"verify after a timeout: ok after {fake.calls['verify.json']} attempts in {time.perf_counter() - start:.2f}s")
+    # تایید دوباره همان تراکنش کد 101 می‌گیرد
+    assert client.verify_payment(merchant, 10000, authority)['data']['code'] == 101
+    print("verify again: code 101 (already verified)")
+
+    # ۲. تمام شدن تلاش‌ها: خطا به فراخواننده می‌رسد
+    fake.plan_failures('request.json', [503, 503, 503])
+    try:
+        client.request_payment(merchant, 10000, "http://127.0.0.1/callback", "exhausted")
+        raise AssertionError("expected HTTPError after exhausting retries")
+    except requests.exceptions.HTTPError as e:
+        print(f"request with 3x 503: raised {type(e).__name__} as expected")
+
+    # ۳. مسیر غیرهمزمان: درخواست‌ها بلافاصله برمی‌گردند و روی pool موازی اجرا می‌شوند
+    results, errors = [], []
+    done = threading.Semaphore(0)
+    start = time.perf_counter()
+    for i in range(concurrent_requests):
+        client.request_payment_async(
+            merchant, 10000, "http://127.0.0.1/callback", f"async {i}",
+            on_success=lambda r: (results.append(r), done.release()),
+            on_error=lambda e: (errors.append(e), done.release()),
+        )
+    submit_elapsed = time.perf_counter() - start
+    for _ in range(concurrent_requests):
+        done.acquire()
+    elapsed = time.perf_counter() - start
+    assert len(results) == concurrent_requests and not errors, errors
+    print(f"{concurrent_requests} async requests: submitted in {submit_elapsed * 1000:.1f}ms, all done in {elapsed:.2f}s "
+          f"(serial would take {concurrent_requests * latency:.1f}s)")
+
+    server.shutdown()
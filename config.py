@@ -98,4 +98,173 @@ ZARINPAL_MERCHANT_ID = os.getenv("ZARINPAL_MERCHANT_ID")
 BOT_USERNAME_ALAMOR = os.getenv("BOT_USERNAME_ALAMOR", "YourBotUsername")
 
 
+# --- تنظیمات اتصال به پنل‌های X-UI ---
+# حداکثر تعداد اتصال‌های باز (keep-alive) به ازای هر پنل
+XUI_POOL_MAXSIZE = int(os.getenv("XUI_POOL_MAXSIZE", "10"))
+# مدت اعتبار سشن لاگین پنل (ثانیه) قبل از لاگین مجدد
+XUI_SESSION_TTL_SECONDS = int(os.getenv("XUI_SESSION_TTL_SECONDS", "3000"))
+# تعداد درخواست همزمان به پنل هنگام ساخت کلاینت روی چند اینباند (1 = ترتیبی)
+PROVISIONING_MAX_WORKERS = int(os.getenv("PROVISIONING_MAX_WORKERS", "8"))
+# مدت اعتبار کش اطلاعات اینباندهای پنل (ثانیه)
+INBOUND_CACHE_TTL_SECONDS = int(os.getenv("INBOUND_CACHE_TTL_SECONDS", "600"))
+# حداکثر تعداد اکانت در هر درخواست ساخت گروهی اکانت توسط ادمین
+BULK_ACCOUNTS_MAX_COUNT = int(os.getenv("BULK_ACCOUNTS_MAX_COUNT", "200"))
 
+# --- تنظیمات کارایی SQLite ---
+# اندازه کش صفحات هر اتصال (کیلوبایت)
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "20000"))
+# اندازه حافظه memory-mapped برای خواندن فایل دیتابیس (بایت)
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# حداکثر عمر کش اطلاعات رمزگشایی شده سرورها (ثانیه)
+SERVER_CACHE_TTL_SECONDS = int(os.getenv("SERVER_CACHE_TTL_SECONDS", "30"))
+
+# --- تنظیمات موتور دیتابیس ---
+# sqlite (پیش‌فرض) یا postgres؛ برای postgres مقادیر DB_* توسط install.sh در .env نوشته می‌شوند
+DB_ENGINE = os.getenv("DB_ENGINE", "sqlite").strip().lower()
+DB_NAME = os.getenv("DB_NAME", "alamor_db")
+DB_USER = os.getenv("DB_USER", "alamor_user")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = int(os.getenv("DB_PORT", "5432"))
+# حداقل و حداکثر اتصال‌های pool پستگرس (ربات و وب‌هوک هر کدام pool جداگانه دارند)
+PG_POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "2"))
+PG_POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "10"))
+# حداکثر زمان انتظار برای گرفتن اتصال آزاد از pool (ثانیه)
+PG_POOL_TIMEOUT_SECONDS = int(os.getenv("PG_POOL_TIMEOUT_SECONDS", "10"))
+# بعد از چند بار اجرای یک کوئری، prepared statement سمت سرور ساخته شود (0 = از اولین اجرا)
+PG_PREPARE_THRESHOLD = int(os.getenv("PG_PREPARE_THRESHOLD", "2"))
+
+# --- دریافت آپدیت‌های تلگرام از طریق وب‌هوک (به جای polling) ---
+TELEGRAM_WEBHOOK_ENABLED = os.getenv("TELEGRAM_WEBHOOK_ENABLED", "False").lower() in ['true', '1', 't']
+# توکن مخفی که تلگرام در هدر X-Telegram-Bot-Api-Secret-Token ارسال می‌کند
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+# پورت محلی که nginx مسیر /telegram/ را به آن ارسال می‌کند
+TELEGRAM_WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", "8081"))
+# حداکثر آپدیت‌های در انتظار پردازش و تعداد threadهای پردازشگر
+UPDATE_QUEUE_MAX_SIZE = int(os.getenv("UPDATE_QUEUE_MAX_SIZE", "1000"))
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+
+# --- پردازش موازی آپدیت‌ها (ترتیب آپدیت‌های هر کاربر حفظ می‌شود) ---
+DISPATCHER_FAST_WORKERS = int(os.getenv("DISPATCHER_FAST_WORKERS", "8"))
+# threadهای مخصوص عملیات کند روی پنل (تایید پرداخت، تست رایگان، تست سرورها و ...)
+DISPATCHER_SLOW_WORKERS = int(os.getenv("DISPATCHER_SLOW_WORKERS", "4"))
+# پیشوند callback_dataهایی که در lane کند اجرا می‌شوند (جدا شده با کاما)
+DISPATCHER_SLOW_CALLBACKS = [p.strip() for p in os.getenv(
+    "DISPATCHER_SLOW_CALLBACKS",
+    "admin_approve_payment_,admin_test_all_servers,admin_manage_inbounds,admin_create_backup,inbound_,user_free_test,select_gateway_"
+).split(",") if p.strip()]
+# فاصله ثبت آمار صف‌ها در لاگ (ثانیه، 0 = غیرفعال)
+DISPATCHER_METRICS_INTERVAL_SECONDS = int(os.getenv("DISPATCHER_METRICS_INTERVAL_SECONDS", "300"))
+# حداکثر آپدیت در انتظار در dispatcher؛ پس از آن دریافت آپدیت جدید متوقف می‌شود تا صف وب‌هوک پر شود و 503 بدهد
+DISPATCHER_MAX_PENDING = int(os.getenv("DISPATCHER_MAX_PENDING", "500"))
+
+# --- ذخیره‌ساز وضعیت کاربران (مراحل خرید و فرم‌های ادمین) ---
+# memory (فقط همین پروسه) یا database (ماندگار و مشترک بین چند پروسه ربات)
+STATE_STORE_BACKEND = os.getenv("STATE_STORE_BACKEND", "memory").strip().lower()
+# وضعیت‌هایی که این مدت (ثانیه) بدون تغییر بمانند، رها شده تلقی و حذف می‌شوند
+STATE_TTL_SECONDS = int(os.getenv("STATE_TTL_SECONDS", "3600"))
+# حداکثر تعداد وضعیت‌های نگه داشته شده در حالت memory
+STATE_MAX_ENTRIES = int(os.getenv("STATE_MAX_ENTRIES", "10000"))
+
+# --- تنظیمات کلاینت زرین‌پال ---
+# آدرس پایه API (برای تست می‌توان آن را به یک سرور جعلی محلی تغییر داد)
+ZARINPAL_API_BASE_URL = os.getenv("ZARINPAL_API_BASE_URL", "https://api.zarinpal.com/pg/v4/payment")
+ZARINPAL_STARTPAY_URL = os.getenv("ZARINPAL_STARTPAY_URL", "https://www.zarinpal.com/pg/StartPay/")
+ZARINPAL_TIMEOUT_SECONDS = int(os.getenv("ZARINPAL_TIMEOUT_SECONDS", "20"))
+# تعداد کل تلاش‌ها برای هر درخواست (خطای اتصال، timeout یا 5xx)
+ZARINPAL_MAX_RETRIES = int(os.getenv("ZARINPAL_MAX_RETRIES", "3"))
+# تعداد درخواست‌های همزمان غیرهمزمان (async) به درگاه
+ZARINPAL_MAX_WORKERS = int(os.getenv("ZARINPAL_MAX_WORKERS", "4"))
+
+# --- صف کارهای پس‌زمینه (مثل فعال‌سازی سرویس پس از پرداخت آنلاین) ---
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# فاصله بررسی کارهای جدید یا زمان‌بندی شده برای تلاش مجدد (ثانیه)
+JOB_POLL_INTERVAL_SECONDS = int(os.getenv("JOB_POLL_INTERVAL_SECONDS", "5"))
+# اگر worker در این مدت کار را تمام نکند، کار دوباره قابل رزرو می‌شود (ثانیه)
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# فاصله ثبت آمار صف کارها در لاگ (ثانیه، 0 = غیرفعال)
+JOB_METRICS_INTERVAL_SECONDS = int(os.getenv("JOB_METRICS_INTERVAL_SECONDS", "300"))
+
+# مدت رزرو یک پرداخت برای ساخت سرویس؛ پس از آن در صورت تکمیل نشدن، دوباره قابل رزرو است (ثانیه)
+PAYMENT_CLAIM_LEASE_SECONDS = int(os.getenv("PAYMENT_CLAIM_LEASE_SECONDS", "300"))
+
+# --- کش QR کد لینک‌های اشتراک ---
+# حداکثر تعداد QR کدهای نگه داشته شده در حافظه
+QR_CACHE_MAX_ENTRIES = int(os.getenv("QR_CACHE_MAX_ENTRIES", "512"))
+# پوشه کش PNG روی دیسک (خالی = غیرفعال)
+QR_CACHE_DIR = os.getenv("QR_CACHE_DIR", "")
+# اندازه هر خانه QR بر حسب پیکسل
+QR_BOX_SIZE = int(os.getenv("QR_BOX_SIZE", "6"))
+
+# --- کش file_id فایل‌های آپلود شده در تلگرام (QR کد، بکاپ) ---
+# تعداد file_idهای نگه داشته شده در حافظه؛ همه آنها در جدول media_file_ids هم ذخیره می‌شوند
+MEDIA_CACHE_MAX_ENTRIES = int(os.getenv("MEDIA_CACHE_MAX_ENTRIES", "1024"))
+
+# --- تست سلامت سرورها ---
+# فاصله تست خودکار همه سرورها در پس‌زمینه (ثانیه، 0 = فقط با دکمه ادمین)
+HEALTH_CHECK_INTERVAL_SECONDS = int(os.getenv("HEALTH_CHECK_INTERVAL_SECONDS", "300"))
+# حداکثر تعداد سرورهایی که همزمان تست می‌شوند
+HEALTH_CHECK_WORKERS = int(os.getenv("HEALTH_CHECK_WORKERS", "8"))
+# مدت نگهداری تاریخچه تست‌ها (روز)
+HEALTH_HISTORY_RETENTION_DAYS = int(os.getenv("HEALTH_HISTORY_RETENTION_DAYS", "14"))
+
+# --- همگام‌سازی مصرف ترافیک از پنل‌ها ---
+# فاصله خواندن مصرف کلاینت‌ها از همه سرورها (ثانیه، 0 = غیرفعال)
+USAGE_SYNC_INTERVAL_SECONDS = int(os.getenv("USAGE_SYNC_INTERVAL_SECONDS", "600"))
+# حداکثر تعداد سرورهایی که همزمان خوانده می‌شوند
+USAGE_SYNC_WORKERS = int(os.getenv("USAGE_SYNC_WORKERS", "4"))
+
+# --- ارسال پیام‌های انبوه به کاربران (اعلان‌ها) ---
+# سقف پیام در ثانیه (محدودیت تلگرام حدود ۳۰ پیام در ثانیه است)
+TELEGRAM_SEND_RATE_PER_SECOND = float(os.getenv("TELEGRAM_SEND_RATE_PER_SECOND", "25"))
+# تعداد تلاش برای هر پیام در صورت خطای 429
+TELEGRAM_SEND_MAX_RETRIES = int(os.getenv("TELEGRAM_SEND_MAX_RETRIES", "3"))
+
+# --- زمان‌بند انقضا و اتمام حجم سرویس‌ها ---
+# فاصله بررسی خریدهای منقضی یا تمام شده (ثانیه، 0 = غیرفعال)
+EXPIRY_CHECK_INTERVAL_SECONDS = int(os.getenv("EXPIRY_CHECK_INTERVAL_SECONDS", "900"))
+# چند ساعت قبل از انقضا به کاربر هشدار داده شود
+EXPIRY_WARNING_HOURS = int(os.getenv("EXPIRY_WARNING_HOURS", "24"))
+# حداکثر تعداد سرورهایی که همزمان پردازش می‌شوند
+EXPIRY_SCHEDULER_WORKERS = int(os.getenv("EXPIRY_SCHEDULER_WORKERS", "4"))
+
+# --- پیام همگانی ---
+# تعداد کاربرانی که در هر صفحه از دیتابیس خوانده و پس از ارسال، پیشرفت آن ثبت می‌شود
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "200"))
+# تعداد ارسال‌های همزمان (سقف کلی همچنان TELEGRAM_SEND_RATE_PER_SECOND است)
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+
+# --- لیست و جستجوی کاربران در پنل ادمین ---
+# تعداد کاربران هر صفحه (هر صفحه باید در سقف ۴۰۹۶ کاراکتری پیام تلگرام جا شود)
+ADMIN_USERS_PAGE_SIZE = int(os.getenv("ADMIN_USERS_PAGE_SIZE", "20"))
+
+# --- داشبورد ادمین ---
+# تعداد روزهای اخیر که آمار روزانه آن‌ها نمایش داده می‌شود
+DASHBOARD_DAYS = int(os.getenv("DASHBOARD_DAYS", "7"))
+
+# --- نسخه پشتیبان (بکاپ) ---
+# پوشه بکاپ‌های زمان‌بندی شده و فاصله آن‌ها (ثانیه، 0 = غیرفعال)
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL_SECONDS = int(os.getenv("BACKUP_INTERVAL_SECONDS", "86400"))
+# تعداد بکاپ‌های اخیر که نگه داشته می‌شوند
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+# تعداد صفحاتی که در هر گام backup API کپی می‌شود (بین گام‌ها نوشتن ربات آزاد است)
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+# بکاپ فشرده تا این حجم (مگابایت) در حافظه ساخته می‌شود و بزرگ‌تر از آن به فایل موقت منتقل می‌شود
+BACKUP_SPOOL_MAX_MB = int(os.getenv("BACKUP_SPOOL_MAX_MB", "32"))
+
+# --- کش عضویت کاربران در کانال اجباری ---
+# مدت اعتبار نتیجه «عضو است» (ثانیه)
+MEMBERSHIP_CACHE_TTL_SECONDS = int(os.getenv("MEMBERSHIP_CACHE_TTL_SECONDS", "3600"))
+# مدت اعتبار نتیجه «عضو نیست» یا خطای بررسی (کوتاه، تا پس از عضویت زود دوباره بررسی شود)
+MEMBERSHIP_NEGATIVE_TTL_SECONDS = int(os.getenv("MEMBERSHIP_NEGATIVE_TTL_SECONDS", "60"))
+MEMBERSHIP_CACHE_MAX_ENTRIES = int(os.getenv("MEMBERSHIP_CACHE_MAX_ENTRIES", "50000"))
+# دریافت آپدیت‌های chat_member برای به‌روزرسانی فوری کش (ربات باید ادمین کانال باشد)
+MEMBERSHIP_TRACK_UPDATES = os.getenv("MEMBERSHIP_TRACK_UPDATES", "True").lower() in ['true', '1', 't']
+
+# --- ثبت دسته‌ای فعالیت کاربران (last_activity) ---
+# فاصله نوشتن فعالیت‌های جمع شده در دیتابیس (ثانیه)
+ACTIVITY_FLUSH_INTERVAL_SECONDS = int(os.getenv("ACTIVITY_FLUSH_INTERVAL_SECONDS", "10"))
+# با رسیدن تعداد کاربران در انتظار به این عدد، زودتر نوشته می‌شود
+ACTIVITY_FLUSH_MAX_PENDING = int(os.getenv("ACTIVITY_FLUSH_MAX_PENDING", "500"))
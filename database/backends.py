@@ -0,0 +1,358 @@
+# database/backends.py
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import weakref
+
+from config import (
+    DB_ENGINE, DATABASE_NAME, DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT,
+    PG_POOL_MIN_SIZE, PG_POOL_MAX_SIZE, PG_POOL_TIMEOUT_SECONDS, PG_PREPARE_THRESHOLD,
+    SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# هر backend اتصالی با رابط sqlite3 برمی‌گرداند (cursor/execute/commit/rollback/close،
+# ردیف‌های قابل تبدیل به dict و lastrowid) تا DatabaseManager بدون تغییر روی هر دو کار کند.
+# خطاهای backendهای دیگر به sqlite3.Error و sqlite3.IntegrityError تبدیل می‌شوند.
+# =============================================================================
+
+
+class _PooledConnection(sqlite3.Connection):
+    """
+    اتصالی که به ازای هر thread یک بار ساخته شده و بین فراخوانی‌ها دوباره استفاده می‌شود.
+    close() آن اتصال را نمی‌بندد، فقط تراکنش نیمه‌کاره را rollback می‌کند.
+    """
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def close_for_real(self):
+        super().close()
+
+
+class SQLiteBackend:
+    name = "sqlite"
+
+    def __init__(self, db_path=DATABASE_NAME):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        # یک اتصال برای هر thread؛ با پایان thread، اتصال آن هم آزاد می‌شود
+        self._local = threading.local()
+        self._connections = weakref.WeakSet()
+        self._connections_lock = threading.Lock()
+
+    def __str__(self):
+        return f"sqlite:{self.db_path}"
+
+    def connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, factory=_PooledConnection)
+            conn.row_factory = sqlite3.Row
+            # WAL اجازه می‌دهد خواندن‌ها (ربات و وب‌هوک) همزمان با نوشتن انجام شوند
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+            conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.add(conn)
+        return conn
+
+    def close_all(self):
+        """تمام اتصال‌های باز (همه threadها) را می‌بندد؛ برای خاموش شدن برنامه."""
+        with self._connections_lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for conn in connections:
+            try:
+                conn.close_for_real()
+            except sqlite3.ProgrammingError:
+                # اتصال متعلق به thread دیگری است و توسط همان thread آزاد می‌شود
+                pass
+        self._local = threading.local()
+
+
+# --- PostgreSQL ---
+
+_PLACEHOLDER_RE = re.compile(r"'[^']*'|\?|%")
+_INSERT_TABLE_RE = re.compile(r"^\s*INSERT\s+INTO\s+(\w+)", re.IGNORECASE)
+_DDL_REPLACEMENTS = [
+    (re.compile(r"\bINTEGER\s+PRIMARY\s+KEY\s+AUTOINCREMENT\b", re.IGNORECASE), "BIGSERIAL PRIMARY KEY"),
+    # شناسه‌های تلگرام از محدوده INTEGER (۳۲ بیتی) پستگرس بزرگ‌ترند
+    (re.compile(r"\bINTEGER\b", re.IGNORECASE), "BIGINT"),
+    (re.compile(r"\bREAL\b", re.IGNORECASE), "DOUBLE PRECISION"),
+    (re.compile(r"\bBLOB\b", re.IGNORECASE), "BYTEA"),
+]
+
+
+def translate_sql(sql: str) -> str:
+    """placeholderهای ? را به %s تبدیل می‌کند (و % واقعی را escape می‌کند)، بدون دست زدن به رشته‌های داخل کوئری."""
+    def _replace(match):
+        token = match.group(0)
+        if token == "?":
+            return "%s"
+        if token == "%":
+            return "%%"
+        return token.replace("%", "%%")
+    sql = _PLACEHOLDER_RE.sub(_replace, sql)
+    if re.match(r"^\s*(CREATE|ALTER)\s+TABLE", sql, re.IGNORECASE):
+        for pattern, replacement in _DDL_REPLACEMENTS:
+            sql = pattern.sub(replacement, sql)
+    return sql
+
+
+class _PgRow(tuple):
+    """ردیفی مانند sqlite3.Row: هم با اندیس و هم با نام ستون قابل دسترسی است و dict(row) کار می‌کند."""
+    def __new__(cls, values, columns, index):
+        row = super().__new__(cls, values)
+        row._columns = columns
+        row._index = index
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return list(self._columns)
+
+
+def _pg_row_factory(cursor):
+    columns = [column.name for column in cursor.description] if cursor.description else []
+    index = {name: i for i, name in enumerate(columns)}
+
+    def make_row(values):
+        return _PgRow(values, columns, index)
+    return make_row
+
+
+def _translate_error(error):
+    import psycopg
+    if isinstance(error, psycopg.IntegrityError):
+        return sqlite3.IntegrityError(str(error))
+    if isinstance(error, psycopg.OperationalError):
+        return sqlite3.OperationalError(str(error))
+    return sqlite3.DatabaseError(str(error))
+
+
+class _PgCursor:
+    def __init__(self, connection, raw_cursor):
+        self._connection = connection
+        self._cursor = raw_cursor
+        self.lastrowid = None
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, sql, params=()):
+        import psycopg
+        if sql.strip().upper() == "BEGIN":
+            # psycopg تراکنش را به طور خودکار با اولین دستور باز می‌کند
+            return self
+        sql = translate_sql(sql)
+        insert_match = _INSERT_TABLE_RE.match(sql)
+        wants_id = (insert_match and "RETURNING" not in sql.upper()
+                    and self._connection.backend.table_has_id(self._connection._raw, insert_match.group(1).lower()))
+        if wants_id:
+            sql = f"{sql.rstrip().rstrip(';')} RETURNING id"
+        try:
+            self._cursor.execute(sql, tuple(params) if params else None)
+            self.lastrowid = None
+            if wants_id:
+                row = self._cursor.fetchone()
+                self.lastrowid = row[0] if row else None
+        except psycopg.Error as e:
+            raise _translate_error(e) from e
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        import psycopg
+        try:
+            self._cursor.executemany(translate_sql(sql), [tuple(params) for params in seq_of_params])
+        except psycopg.Error as e:
+            raise _translate_error(e) from e
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class _PgConnection:
+    """اتصال قرض گرفته شده از pool؛ close() آن را به pool برمی‌گرداند."""
+
+    def __init__(self, backend, raw_connection):
+        self.backend = backend
+        self._raw = raw_connection
+
+    @property
+    def in_transaction(self):
+        import psycopg
+        return self._raw is not None and self._raw.info.transaction_status != psycopg.pq.TransactionStatus.IDLE
+
+    def cursor(self):
+        return _PgCursor(self, self._raw.cursor())
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def commit(self):
+        import psycopg
+        try:
+            self._raw.commit()
+        except psycopg.Error as e:
+            raise _translate_error(e) from e
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        if self._raw is None:
+            return
+        if self.in_transaction:
+            self._raw.rollback()
+        raw, self._raw = self._raw, None
+        self.backend.pool.putconn(raw)
+
+
+class PostgresBackend:
+    name = "postgres"
+
+    def __init__(self, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT,
+                 min_size=PG_POOL_MIN_SIZE, max_size=PG_POOL_MAX_SIZE, prepare_threshold=PG_PREPARE_THRESHOLD):
+        # وابستگی اختیاری: فقط وقتی DB_ENGINE=postgres باشد لازم است
+        from psycopg.types.string import TextLoader
+        from psycopg_pool import ConnectionPool
+
+        self.dbname = dbname
+        self.host = host
+        self.port = port
+        self._id_columns = {}  # {table: آیا ستون id دارد}؛ برای افزودن RETURNING id به INSERT
+
+        def _configure(conn):
+            # تاریخ‌ها مانند sqlite به صورت رشته برگردانده می‌شوند تا رفتار متدها یکسان بماند
+            conn.adapters.register_loader("timestamp", TextLoader)
+            conn.adapters.register_loader("timestamptz", TextLoader)
+
+        self.pool = ConnectionPool(
+            conninfo=f"dbname={dbname} user={user} password={password} host={host} port={port}",
+            min_size=min_size,
+            max_size=max_size,
+            timeout=PG_POOL_TIMEOUT_SECONDS,
+            configure=_configure,
+            # کوئری‌هایی که بیش از prepare_threshold بار اجرا شوند، سمت سرور prepare می‌شوند
+            kwargs={"row_factory": _pg_row_factory, "prepare_threshold": prepare_threshold},
+            open=True,
+        )
+
+    def __str__(self):
+        return f"postgres:{self.dbname}@{self.host}:{self.port}"
+
+    def table_has_id(self, raw_connection, table):
+        """
+        آیا جدول ستون id دارد (تا فقط برای آن‌ها RETURNING id به INSERT اضافه شود)؛ از information_schema
+        خوانده و برای هر جدول یک بار نگه داشته می‌شود، پس جدول‌های جدید نیازی به ثبت دستی ندارند.
+        """
+        has_id = self._id_columns.get(table)
+        if has_id is None:
+            with raw_connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = %s",
+                    (table,)
+                )
+                columns = {row[0] for row in cursor.fetchall()}
+            has_id = 'id' in columns
+            if columns:
+                # جدولی که هنوز ساخته نشده نگه داشته نمی‌شود
+                self._id_columns[table] = has_id
+        return has_id
+
+    def connect(self):
+        from psycopg_pool import PoolTimeout
+        try:
+            return _PgConnection(self, self.pool.getconn())
+        except PoolTimeout as e:
+            raise sqlite3.OperationalError(f"PostgreSQL pool exhausted: {e}") from e
+
+    def close_all(self):
+        self.pool.close()
+
+
+def create_backend(db_path=DATABASE_NAME):
+    """backend را بر اساس DB_ENGINE در فایل .env می‌سازد."""
+    if DB_ENGINE == "postgres":
+        return PostgresBackend()
+    if DB_ENGINE != "sqlite":
+        logger.warning(f"Unknown DB_ENGINE '{DB_ENGINE}'. Falling back to sqlite.")
+    return SQLiteBackend(db_path)
+
+
+if __name__ == "__main__":
+    # بررسی سازگاری: رفتار متدهای اصلی DatabaseManager روی sqlite و (در صورت در دسترس بودن) postgres یکسان باشد
+    import tempfile
+    import uuid
+
+    from database.db_manager import DatabaseManager
+
+    def run_conformance_checks(manager):
+        manager.create_tables()
+        tag = uuid.uuid4().hex[:8]
+        telegram_id = int(uuid.uuid4().int % 10**12) + 10**10
+        manager.add_or_update_user(telegram_id, "conformance", username=f"u_{tag}")
+        user = manager.get_user_by_telegram_id(telegram_id)
+        assert user and user['first_name'] == "conformance", user
+        server_id = manager.add_server(f"srv_{tag}", "https://panel:1", "u", "p", "https://sub", "sub")
+        assert server_id and manager.add_server(f"srv_{tag}", "x", "x", "x", "x", "x") is None
+        assert manager.get_server_by_id(server_id)['panel_url'] == "https://panel:1"
+        assert manager.update_server_inbounds(server_id, [{'id': 1, 'remark': '100% vless'}])
+        assert manager.get_server_inbounds(server_id)[0]['remark'] == '100% vless'
+        payment_id = manager.add_payment(user['id'], 1000, 1, '{"a": "b"}')
+        assert manager.set_payment_authority(payment_id, f"A{tag}")
+        assert manager.get_payment_by_authority(f"A{tag}")['id'] == payment_id
+        assert manager.confirm_online_payment(payment_id, "ref")
+        assert manager.get_payment_by_id(payment_id)['is_confirmed']
+        purchase_id = manager.add_purchase(user['id'], server_id, None, "2030-01-01 00:00:00", 10, "uuid", "email", "sub", ["vless://x"])
+        assert manager.get_purchase_by_id(purchase_id)['single_configs_json'] == ["vless://x"]
+        assert manager.get_user_purchases(user['id'])[0]['expire_date'].startswith("2030-01-01")
+        assert not manager.check_free_test_usage(user['id'])
+        assert manager.record_free_test_usage(user['id']) and manager.check_free_test_usage(user['id'])
+        assert manager.reset_free_test_usage(user['id'])
+
+    sqlite_path = os.path.join(tempfile.mkdtemp(), "conformance.db")
+    run_conformance_checks(DatabaseManager(sqlite_path, backend=SQLiteBackend(sqlite_path)))
+    print("sqlite: OK")
+    pg_backend = None
+    try:
+        pg_backend = PostgresBackend()
+        pg_backend.pool.wait(timeout=5)
+    except Exception as e:
+        if pg_backend:
+            pg_backend.close_all()
+        print(f"postgres: skipped ({e.__class__.__name__}: {e})")
+    else:
+        run_conformance_checks(DatabaseManager(backend=pg_backend))
+        print("postgres: OK")
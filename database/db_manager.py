@@ -5,22 +5,68 @@ import logging
 from cryptography.fernet import Fernet
 import os
 import json
+import threading
+import time
+import datetime
 
-from config import ENCRYPTION_KEY, DATABASE_NAME
+from database.backends import SQLiteBackend, create_backend
+from database.migrations import run_migrations, find_full_table_scans, DAILY_STATS_COLUMNS
+from config import ENCRYPTION_KEY, DATABASE_NAME, SERVER_CACHE_TTL_SECONDS
 
 logger = logging.getLogger(__name__)
 
+
+# ستون‌های مورد نیاز زمان‌بند انقضا (purchases p JOIN users u)
+_EXPIRY_PURCHASE_COLUMNS = """
+    p.id, p.server_id, p.expire_date, p.initial_volume_gb, p.xui_client_uuid, p.xui_client_email,
+    p.subscription_id, u.telegram_id
+"""
+
+
+def _utc_day():
+    # روز جاری به UTC، مانند مقادیر CURRENT_TIMESTAMP
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+def _bump_daily_stats(cursor, day, **deltas):
+    """شمارنده‌های daily_stats یک روز را (در تراکنش جاری) افزایش یا کاهش می‌دهد."""
+    columns = [c for c in deltas if c in DAILY_STATS_COLUMNS]
+    cursor.execute(f"""
+        INSERT INTO daily_stats (day, {', '.join(columns)}) VALUES (?, {', '.join('?' for _ in columns)})
+        ON CONFLICT(day) DO UPDATE SET {', '.join(f'{c} = daily_stats.{c} + excluded.{c}' for c in columns)}
+    """, (day, *(deltas[c] for c in columns)))
+
+
+def _payment_state(payment):
+    """pending، confirmed یا rejected (رد شده: تایید نشده ولی confirmation_date دارد)."""
+    if payment['is_confirmed']:
+        return 'confirmed'
+    return 'rejected' if payment['confirmation_date'] else 'pending'
+
+
 class DatabaseManager:
-    def __init__(self, db_path=DATABASE_NAME):
+    def __init__(self, db_path=DATABASE_NAME, backend=None):
         self.db_path = db_path
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        # موتور ذخیره‌سازی (sqlite یا postgres) بر اساس DB_ENGINE در .env
+        self.backend = backend or create_backend(db_path)
         self.fernet = Fernet(ENCRYPTION_KEY)
-        logger.info(f"DatabaseManager initialized with DB: {self.db_path}")
+        # با هر تغییر در مجموعه سرورها افزایش می‌یابد تا کش‌های وابسته (مثل رجیستری کلاینت‌های X-UI) باطل شوند
+        self.servers_version = 0
+        # کش سرورهای رمزگشایی شده (فقط در حافظه همین پروسه). با هر تغییر، _server_cache_version افزایش می‌یابد
+        # و TTL، تغییراتی که پروسه‌های دیگر (مثل وب‌هوک) ایجاد کرده‌اند را محدود به چند ثانیه می‌کند.
+        self._server_cache = None  # (version, loaded_at, {server_id: server_dict})
+        self._server_cache_version = 0
+        self._server_cache_lock = threading.Lock()
+        self.server_cache_hits = 0
+        self.server_cache_misses = 0
+        logger.info(f"DatabaseManager initialized with DB: {self.backend}")
 
     def _get_connection(self):
-        conn = sqlite3.connect(self.db_path, timeout=10)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return self.backend.connect()
+
+    def close_all_connections(self):
+        """تمام اتصال‌های باز را می‌بندد؛ برای خاموش شدن برنامه."""
+        self.backend.close_all()
 
     def create_tables(self):
         """
@@ -152,6 +198,12 @@ class DatabaseManager:
 
             conn.commit()
             logger.info("Database tables created or already exist.")
+
+            # اعمال مایگریشن‌های نسخه‌دار (ایندکس‌ها و ستون‌های جدید)
+            run_migrations(conn)
+            if self.backend.name == "sqlite":
+                for query_name, plan_detail in find_full_table_scans(conn):
+                    logger.warning(f"Hot query '{query_name}' falls back to a full table scan: {plan_detail}")
         except sqlite3.Error as e:
             logger.error(f"Error creating tables: {e}")
             raise e
@@ -177,34 +229,135 @@ class DatabaseManager:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
+            # درج و به‌روزرسانی جدا انجام می‌شوند تا کاربر جدید (فقط یک بار، حتی با درخواست‌های همزمان) شمرده شود
             cursor.execute("""
                 INSERT INTO users (telegram_id, first_name, last_name, username, last_activity)
                 VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-                ON CONFLICT(telegram_id) DO UPDATE SET
-                    first_name = excluded.first_name,
-                    last_name = excluded.last_name,
-                    username = excluded.username,
-                    last_activity = CURRENT_TIMESTAMP
+                ON CONFLICT(telegram_id) DO NOTHING
             """, (telegram_id, first_name, last_name, username))
+            if cursor.rowcount == 1:
+                user_id = cursor.lastrowid
+                _bump_daily_stats(cursor, _utc_day(), new_users=1)
+            else:
+                cursor.execute("""
+                    UPDATE users SET first_name = ?, last_name = ?, username = ?, last_activity = CURRENT_TIMESTAMP
+                    WHERE telegram_id = ?
+                """, (first_name, last_name, username, telegram_id))
+                cursor.execute("SELECT id FROM users WHERE telegram_id = ?", (telegram_id,))
+                user_id = cursor.fetchone()['id']
             conn.commit()
             logger.info(f"User {telegram_id} added or updated.")
-            return cursor.lastrowid
+            return user_id
         except sqlite3.Error as e:
             logger.error(f"Error adding/updating user {telegram_id}: {e}")
             return None
         finally:
             if conn: conn.close()
             
-    def get_all_users(self):
+    def touch_users(self, rows: list):
+        """
+        به‌روزرسانی دسته‌ای نام و last_activity کاربران موجود در یک تراکنش.
+        rows: لیست (first_name, last_name, username, last_activity, telegram_id).
+        """
+        if not rows:
+            return True
         conn = None
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
-            cursor.execute("SELECT id, telegram_id, first_name, username, join_date FROM users ORDER BY id DESC")
-            users = cursor.fetchall()
-            return [dict(user) for user in users]
+            cursor.executemany("""
+                UPDATE users SET first_name = ?, last_name = ?, username = ?, last_activity = ?
+                WHERE telegram_id = ?
+            """, rows)
+            conn.commit()
+            return True
         except sqlite3.Error as e:
-            logger.error(f"Error getting all users: {e}")
+            logger.error(f"Error updating activity of {len(rows)} users: {e}")
+            return False
+        finally:
+            if conn: conn.close()
+
+    def get_users_list_page(self, before_id: int = None, after_id: int = None, limit: int = 20):
+        """
+        صفحه‌ای از کاربران برای پنل ادمین، جدیدترین اول (keyset روی id).
+        before_id: کاربران قدیمی‌تر از این id (صفحه بعد)، after_id: کاربران جدیدتر (صفحه قبل).
+        (لیست کاربران، آیا در همان جهت کاربر دیگری هست) برمی‌گرداند.
+        """
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            columns = "id, telegram_id, first_name, username, join_date"
+            if after_id is not None:
+                cursor.execute(f"SELECT {columns} FROM users WHERE id > ? ORDER BY id ASC LIMIT ?", (after_id, limit + 1))
+                users = [dict(row) for row in cursor.fetchall()]
+                has_more = len(users) > limit
+                return list(reversed(users[:limit])), has_more
+            if before_id is not None:
+                cursor.execute(f"SELECT {columns} FROM users WHERE id < ? ORDER BY id DESC LIMIT ?", (before_id, limit + 1))
+            else:
+                cursor.execute(f"SELECT {columns} FROM users ORDER BY id DESC LIMIT ?", (limit + 1,))
+            users = [dict(row) for row in cursor.fetchall()]
+            return users[:limit], len(users) > limit
+        except sqlite3.Error as e:
+            logger.error(f"Error getting users page (before={before_id}, after={after_id}): {e}")
+            return [], False
+        finally:
+            if conn: conn.close()
+
+    def search_users(self, query: str, limit: int = 20):
+        """
+        جستجوی کاربر برای ادمین: عدد = telegram_id یا ID داخلی، شروع با @ = پیشوند نام کاربری،
+        در غیر این صورت نام (با FTS5 در sqlite و LIKE پیشوندی در غیر این صورت).
+        """
+        query = (query or "").strip()
+        if not query:
+            return []
+        columns = "u.id, u.telegram_id, u.first_name, u.username, u.join_date"
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            if query.isdigit():
+                cursor.execute(f"SELECT {columns} FROM users u WHERE u.telegram_id = ? OR u.id = ? ORDER BY u.id DESC",
+                               (int(query), int(query)))
+                return [dict(row) for row in cursor.fetchall()]
+            if query.startswith("@"):
+                prefix = query[1:].lower()
+                if not prefix:
+                    return []
+                # بازه [prefix, prefix + \uffff) معادل LIKE 'prefix%' است ولی از ایندکس استفاده می‌کند
+                cursor.execute(f"""
+                    SELECT {columns} FROM users u
+                    WHERE LOWER(u.username) >= ? AND LOWER(u.username) < ?
+                    ORDER BY LOWER(u.username) LIMIT ?
+                """, (prefix, prefix + "\uffff", limit))
+                return [dict(row) for row in cursor.fetchall()]
+
+            if self.backend.name == "sqlite":
+                terms = [term.replace('"', '') for term in query.split()]
+                match = " ".join(f'"{term}"*' for term in terms if term)
+                if not match:
+                    return []
+                try:
+                    cursor.execute(f"""
+                        SELECT {columns} FROM users_fts
+                        JOIN users u ON u.id = users_fts.rowid
+                        WHERE users_fts MATCH ? ORDER BY rank LIMIT ?
+                    """, (match, limit))
+                    return [dict(row) for row in cursor.fetchall()]
+                except sqlite3.OperationalError as e:
+                    # sqlite بدون FTS5؛ به جستجوی LIKE برمی‌گردیم
+                    logger.debug(f"FTS user search unavailable: {e}")
+            pattern = query.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            cursor.execute(f"""
+                SELECT {columns} FROM users u
+                WHERE LOWER(u.first_name) LIKE ? ESCAPE '\\' OR LOWER(u.last_name) LIKE ? ESCAPE '\\'
+                ORDER BY u.id DESC LIMIT ?
+            """, (pattern, pattern, limit))
+            return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Error searching users for '{query}': {e}")
             return []
         finally:
             if conn: conn.close()
@@ -248,6 +401,8 @@ class DatabaseManager:
                 VALUES (?, ?, ?, ?, ?, ?)
             """, (name, self._encrypt(panel_url), self._encrypt(username), self._encrypt(password), self._encrypt(sub_base_url), self._encrypt(sub_path_prefix)))
             conn.commit()
+            self.servers_version += 1
+            self._invalidate_server_cache()
             logger.info(f"Server '{name}' added successfully.")
             return cursor.lastrowid
         except sqlite3.IntegrityError:
@@ -259,31 +414,65 @@ class DatabaseManager:
         finally:
             if conn: conn.close()
 
-    def get_all_servers(self):
-        conn = None
+    def _decrypt_server_row(self, server):
+        server_dict = dict(server)
+        server_dict['panel_url'] = self._decrypt(server_dict['panel_url'])
+        server_dict['username'] = self._decrypt(server_dict['username'])
+        server_dict['password'] = self._decrypt(server_dict['password'])
+        server_dict['subscription_base_url'] = self._decrypt(server_dict['subscription_base_url'])
+        server_dict['subscription_path_prefix'] = self._decrypt(server_dict['subscription_path_prefix'])
+        return server_dict
+
+    def _invalidate_server_cache(self):
+        with self._server_cache_lock:
+            self._server_cache_version += 1
+            self._server_cache = None
+
+    def _get_cached_servers(self):
+        """سرورهای رمزگشایی شده را از کش برمی‌گرداند و در صورت نامعتبر بودن کش، آن را از دیتابیس پر می‌کند."""
+        with self._server_cache_lock:
+            cache = self._server_cache
+            version = self._server_cache_version
+            if cache and cache[0] == version and time.monotonic() - cache[1] < SERVER_CACHE_TTL_SECONDS:
+                self.server_cache_hits += 1
+                return cache[2]
+            self.server_cache_misses += 1
+
+        conn = self._get_connection()
         try:
-            conn = self._get_connection()
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM servers ORDER BY id")
-            servers_data = cursor.fetchall()
-            
-            decrypted_servers = []
-            for server in servers_data:
-                server_dict = dict(server)
-                server_dict['panel_url'] = self._decrypt(server_dict['panel_url'])
-                server_dict['username'] = self._decrypt(server_dict['username'])
-                server_dict['password'] = self._decrypt(server_dict['password'])
-                server_dict['subscription_base_url'] = self._decrypt(server_dict['subscription_base_url'])
-                server_dict['subscription_path_prefix'] = self._decrypt(server_dict['subscription_path_prefix'])
-                decrypted_servers.append(server_dict)
-            return decrypted_servers
+            servers = {server['id']: self._decrypt_server_row(server) for server in cursor.fetchall()}
+        finally:
+            conn.close()
+
+        with self._server_cache_lock:
+            # اگر در حین خواندن، کش باطل شده باشد، نتیجه قدیمی ذخیره نمی‌شود
+            if version == self._server_cache_version:
+                self._server_cache = (version, time.monotonic(), servers)
+        return servers
+
+    def get_server_cache_stats(self):
+        return {'hits': self.server_cache_hits, 'misses': self.server_cache_misses}
+
+    def get_all_servers(self):
+        try:
+            # کپی برگردانده می‌شود تا تغییر توسط فراخواننده، کش را خراب نکند
+            return [dict(server) for server in self._get_cached_servers().values()]
         except sqlite3.Error as e:
             logger.error(f"Error getting all servers: {e}")
             return []
-        finally:
-            if conn: conn.close()
             
     def get_server_by_id(self, server_id):
+        try:
+            server = self._get_cached_servers().get(server_id)
+            if server:
+                return dict(server)
+        except sqlite3.Error as e:
+            logger.error(f"Error getting server by ID {server_id}: {e}")
+            return None
+
+        # ممکن است سرور توسط پروسه دیگری اضافه شده باشد و هنوز در کش نباشد
         conn = None
         try:
             conn = self._get_connection()
@@ -291,13 +480,8 @@ class DatabaseManager:
             cursor.execute("SELECT * FROM servers WHERE id = ?", (server_id,))
             server = cursor.fetchone()
             if server:
-                server_dict = dict(server)
-                server_dict['panel_url'] = self._decrypt(server_dict['panel_url'])
-                server_dict['username'] = self._decrypt(server_dict['username'])
-                server_dict['password'] = self._decrypt(server_dict['password'])
-                server_dict['subscription_base_url'] = self._decrypt(server_dict['subscription_base_url'])
-                server_dict['subscription_path_prefix'] = self._decrypt(server_dict['subscription_path_prefix'])
-                return server_dict
+                self._invalidate_server_cache()
+                return self._decrypt_server_row(server)
             return None
         except sqlite3.Error as e:
             logger.error(f"Error getting server by ID {server_id}: {e}")
@@ -312,9 +496,14 @@ class DatabaseManager:
             cursor = conn.cursor()
             # Deleting a server will cascade and delete related inbounds
             cursor.execute("DELETE FROM servers WHERE id = ?", (server_id,))
+            deleted = cursor.rowcount
+            cursor.execute("DELETE FROM server_stats WHERE server_id = ?", (server_id,))
             conn.commit()
+            if deleted > 0:
+                self.servers_version += 1
+            self._invalidate_server_cache()
             logger.info(f"Server with ID {server_id} has been deleted.")
-            return cursor.rowcount > 0
+            return deleted > 0
         except sqlite3.Error as e:
             logger.error(f"Error deleting server with ID {server_id}: {e}")
             return False
@@ -330,6 +519,7 @@ class DatabaseManager:
                 UPDATE servers SET is_online = ?, last_checked = ? WHERE id = ?
             """, (is_online, last_checked, server_id))
             conn.commit()
+            self._invalidate_server_cache()
             return True
         except sqlite3.Error as e:
             logger.error(f"Error updating server status for ID {server_id}: {e}")
@@ -337,6 +527,57 @@ class DatabaseManager:
         finally:
             if conn: conn.close()
 
+    def record_server_health(self, results: list, retention_seconds: float = None):
+        """
+        نتایج یک دور تست سلامت سرورها را در تاریخچه ثبت و وضعیت is_online سرورها را به‌روز می‌کند.
+        results: لیست دیکشنری با کلیدهای server_id، checked_at، is_online، latency_ms، inbound_count و error_class.
+        """
+        if not results:
+            return True
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO server_health_history (server_id, checked_at, is_online, latency_ms, inbound_count, error_class)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [(r['server_id'], r['checked_at'], r['is_online'], r['latency_ms'], r['inbound_count'], r['error_class'])
+                  for r in results])
+            cursor.executemany("UPDATE servers SET is_online = ?, last_checked = ? WHERE id = ?", [
+                (r['is_online'], datetime.datetime.fromtimestamp(r['checked_at']).strftime("%Y-%m-%d %H:%M:%S"), r['server_id'])
+                for r in results
+            ])
+            if retention_seconds:
+                cursor.execute("DELETE FROM server_health_history WHERE checked_at < ?", (time.time() - retention_seconds,))
+            conn.commit()
+            self._invalidate_server_cache()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error recording server health results: {e}")
+            return False
+        finally:
+            if conn: conn.close()
+
+    def get_latest_server_health(self):
+        """آخرین نتیجه تست سلامت هر سرور: {server_id: row}"""
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT h.* FROM server_health_history h
+                JOIN (
+                    SELECT server_id, MAX(checked_at) AS last_checked_at
+                    FROM server_health_history GROUP BY server_id
+                ) latest ON latest.server_id = h.server_id AND latest.last_checked_at = h.checked_at
+            """)
+            return {row['server_id']: dict(row) for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            logger.error(f"Error getting latest server health: {e}")
+            return {}
+        finally:
+            if conn: conn.close()
+
     # --- توابع Inboundهای سرور ---
     def get_server_inbounds(self, server_id, only_active=True):
         conn = None
@@ -566,8 +807,10 @@ class DatabaseManager:
                 INSERT INTO payments (user_id, amount, receipt_message_id, order_details_json, is_confirmed)
                 VALUES (?, ?, ?, ?, FALSE)
             """, (user_id, amount, receipt_message_id, order_details_json))
+            payment_id = cursor.lastrowid
+            _bump_daily_stats(cursor, _utc_day(), payments_created=1)
             conn.commit()
-            return cursor.lastrowid
+            return payment_id
         except sqlite3.Error as e:
             logger.error(f"Error adding payment request for user {user_id}: {e}")
             return None
@@ -593,19 +836,74 @@ class DatabaseManager:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE payments 
-                SET is_confirmed = ?, admin_confirmed_by = ?, confirmation_date = CURRENT_TIMESTAMP
-                WHERE id = ?
-            """, (is_confirmed, admin_id, payment_id))
+            updated = self._transition_payment(
+                cursor, payment_id, 'confirmed' if is_confirmed else 'rejected',
+                "is_confirmed = ?, admin_confirmed_by = ?, confirmation_date = CURRENT_TIMESTAMP", (is_confirmed, admin_id)
+            )
             conn.commit()
-            return True
+            return updated
         except sqlite3.Error as e:
             logger.error(f"Error updating payment status for ID {payment_id}: {e}")
             return False
         finally:
             if conn: conn.close()
             
+    def _transition_payment(self, cursor, payment_id, new_state, assignments, params, attempts=3):
+        """
+        وضعیت پرداخت را با UPDATE شرطی روی وضعیت خوانده شده تغییر می‌دهد و فقط اگر همین UPDATE ردیف را
+        تغییر داده باشد شمارنده‌های داشبورد را اصلاح می‌کند؛ اگر تراکنش دیگری زودتر وضعیت را عوض کرده باشد،
+        وضعیت دوباره خوانده و تلاش تکرار می‌شود. True اگر پرداخت به‌روزرسانی شد.
+        """
+        for _ in range(attempts):
+            cursor.execute("SELECT user_id, amount, is_confirmed, confirmation_date FROM payments WHERE id = ?", (payment_id,))
+            payment = cursor.fetchone()
+            if not payment:
+                return False
+            # شرط NULL در خود SQL ساخته می‌شود؛ postgres نوع پارامتر "? IS NULL" را تشخیص نمی‌دهد
+            where_params = (payment_id, payment['is_confirmed'])
+            if payment['confirmation_date'] is None:
+                date_condition = "confirmation_date IS NULL"
+            else:
+                date_condition = "confirmation_date = ?"
+                where_params += (payment['confirmation_date'],)
+            cursor.execute(f"""
+                UPDATE payments SET {assignments}
+                WHERE id = ? AND is_confirmed = ? AND {date_condition}
+            """, (*params, *where_params))
+            if cursor.rowcount == 1:
+                self._record_payment_transition(cursor, payment_id, payment, new_state)
+                return True
+        logger.warning(f"Payment {payment_id} kept changing concurrently; status not updated.")
+        return False
+
+    def _record_payment_transition(self, cursor, payment_id, payment, new_state):
+        """
+        شمارنده‌های داشبورد را برای تغییر وضعیت پرداخت (payment ردیف پیش از UPDATE) در همان تراکنش اصلاح می‌کند.
+        شمارش وضعیت قبلی از روزی که در آن ثبت شده بود کم می‌شود تا تایید دوباره دو بار شمرده نشود.
+        """
+        old_state = _payment_state(payment)
+        if old_state == new_state:
+            return
+        amount = payment['amount'] or 0
+        old_day = str(payment['confirmation_date'])[:10] if payment['confirmation_date'] else _utc_day()
+        if old_state == 'confirmed':
+            _bump_daily_stats(cursor, old_day, payments_confirmed=-1, revenue=-amount)
+        elif old_state == 'rejected':
+            _bump_daily_stats(cursor, old_day, payments_rejected=-1)
+
+        if new_state == 'rejected':
+            _bump_daily_stats(cursor, _utc_day(), payments_rejected=1)
+            return
+        # اولین پرداخت تایید شده کاربری که قبلاً تست رایگان گرفته، تبدیل تست به خرید حساب می‌شود
+        cursor.execute("""
+            SELECT
+                EXISTS (SELECT 1 FROM free_test_usage WHERE user_id = ?) AS had_free_test,
+                EXISTS (SELECT 1 FROM payments WHERE user_id = ? AND is_confirmed = TRUE AND id <> ?) AS paid_before
+        """, (payment['user_id'], payment['user_id'], payment_id))
+        row = cursor.fetchone()
+        converted = 1 if row['had_free_test'] and not row['paid_before'] else 0
+        _bump_daily_stats(cursor, _utc_day(), payments_confirmed=1, revenue=amount, free_test_conversions=converted)
+
     def update_payment_admin_notification_id(self, payment_id, message_id):
         conn = None
         try:
@@ -630,8 +928,16 @@ class DatabaseManager:
                 INSERT INTO purchases (user_id, server_id, plan_id, expire_date, initial_volume_gb, xui_client_uuid, xui_client_email, subscription_id, single_configs_json, is_active)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, TRUE)
             """, (user_id, server_id, plan_id, expire_date, initial_volume_gb, client_uuid, client_email, sub_id, json.dumps(single_configs)))
+            purchase_id = cursor.lastrowid
+            _bump_daily_stats(cursor, _utc_day(), purchases=1)
+            cursor.execute("""
+                INSERT INTO server_stats (server_id, active_purchases, total_purchases) VALUES (?, 1, 1)
+                ON CONFLICT(server_id) DO UPDATE SET
+                    active_purchases = server_stats.active_purchases + 1,
+                    total_purchases = server_stats.total_purchases + 1
+            """, (server_id,))
             conn.commit()
-            return cursor.lastrowid
+            return purchase_id
         except sqlite3.Error as e:
             logger.error(f"Error adding purchase for user {user_id}: {e}")
             return None
@@ -677,6 +983,335 @@ class DatabaseManager:
             if conn: conn.close()
             
             
+    def upsert_purchase_usage(self, rows: list, synced_server_ids=None, synced_at: float = None):
+        """
+        مصرف کلاینت‌ها (خوانده شده از پنل‌ها) را در یک تراکنش ذخیره می‌کند.
+        rows: لیست (server_id, client_email, subscription_id, up_bytes, down_bytes, total_bytes, expiry_time, enabled).
+        برای سرورهای synced_server_ids، ردیف کلاینت‌هایی که دیگر در پنل نیستند حذف می‌شوند.
+        """
+        synced_at = synced_at or time.time()
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO purchase_usage (server_id, client_email, subscription_id, up_bytes, down_bytes,
+                                            total_bytes, expiry_time, enabled, synced_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(server_id, client_email) DO UPDATE SET
+                    subscription_id = excluded.subscription_id,
+                    up_bytes = excluded.up_bytes,
+                    down_bytes = excluded.down_bytes,
+                    total_bytes = excluded.total_bytes,
+                    expiry_time = excluded.expiry_time,
+                    enabled = excluded.enabled,
+                    synced_at = excluded.synced_at
+            """, [row + (synced_at,) for row in rows])
+            if synced_server_ids:
+                cursor.executemany("DELETE FROM purchase_usage WHERE server_id = ? AND synced_at < ?",
+                                   [(server_id, synced_at) for server_id in synced_server_ids])
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error saving purchase usage: {e}")
+            return False
+        finally:
+            if conn: conn.close()
+
+    def get_purchase_usage(self, purchase: dict):
+        """
+        مصرف یک خرید (جمع همه کلاینت‌های اشتراک روی اینباندهای مختلف) از جدول محلی.
+        دیکشنری up_bytes، down_bytes و synced_at یا None اگر هنوز همگام‌سازی نشده باشد.
+        """
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            if purchase.get('subscription_id'):
+                where, key = "subscription_id = ?", purchase['subscription_id']
+            else:
+                where, key = "client_email = ?", purchase['xui_client_email']
+            cursor.execute(f"""
+                SELECT SUM(up_bytes) AS up_bytes, SUM(down_bytes) AS down_bytes, MAX(synced_at) AS synced_at
+                FROM purchase_usage WHERE server_id = ? AND {where}
+            """, (purchase['server_id'], key))
+            row = cursor.fetchone()
+            return dict(row) if row and row['synced_at'] is not None else None
+        except sqlite3.Error as e:
+            logger.error(f"Error getting usage for purchase {purchase.get('id')}: {e}")
+            return None
+        finally:
+            if conn: conn.close()
+
+    # --- توابع زمان‌بند انقضا ---
+    def get_expired_active_purchases(self, now: str, limit: int = 1000):
+        """خریدهای فعالی که تاریخ انقضای آنها گذشته است (با استفاده از ایندکس is_active, expire_date)."""
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT {_EXPIRY_PURCHASE_COLUMNS}
+                FROM purchases p JOIN users u ON u.id = p.user_id
+                WHERE p.is_active = TRUE AND p.expire_date IS NOT NULL AND p.expire_date <= ?
+                ORDER BY p.expire_date
+                LIMIT ?
+            """, (now, limit))
+            return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Error getting expired purchases: {e}")
+            return []
+        finally:
+            if conn: conn.close()
+
+    def get_depleted_active_purchases(self, limit: int = 1000):
+        """خریدهای فعالی که بر اساس جدول purchase_usage حجمشان تمام شده است."""
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT {_EXPIRY_PURCHASE_COLUMNS}
+                FROM purchases p
+                JOIN users u ON u.id = p.user_id
+                JOIN (
+                    SELECT server_id, subscription_id, SUM(up_bytes + down_bytes) AS used_bytes
+                    FROM purchase_usage WHERE subscription_id IS NOT NULL
+                    GROUP BY server_id, subscription_id
+                ) pu ON pu.server_id = p.server_id AND pu.subscription_id = p.subscription_id
+                WHERE p.is_active = TRUE AND p.initial_volume_gb > 0
+                  AND pu.used_bytes >= p.initial_volume_gb * 1073741824
+                LIMIT ?
+            """, (limit,))
+            return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Error getting depleted purchases: {e}")
+            return []
+        finally:
+            if conn: conn.close()
+
+    def get_purchases_to_warn(self, now: str, warn_until: str, limit: int = 1000):
+        """خریدهای فعالی که تا warn_until منقضی می‌شوند و هنوز هشدار نگرفته‌اند."""
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT {_EXPIRY_PURCHASE_COLUMNS}
+                FROM purchases p JOIN users u ON u.id = p.user_id
+                WHERE p.is_active = TRUE AND p.expire_date > ? AND p.expire_date <= ?
+                  AND p.expiry_warned_at IS NULL
+                ORDER BY p.expire_date
+                LIMIT ?
+            """, (now, warn_until, limit))
+            return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Error getting purchases to warn: {e}")
+            return []
+        finally:
+            if conn: conn.close()
+
+    def deactivate_purchases(self, purchase_ids: list):
+        if not purchase_ids:
+            return True
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            placeholders = ", ".join("?" for _ in purchase_ids)
+            cursor.execute(f"""
+                SELECT server_id, COUNT(*) AS deactivated FROM purchases
+                WHERE id IN ({placeholders}) AND is_active = TRUE GROUP BY server_id
+            """, tuple(purchase_ids))
+            per_server = [(row['deactivated'], row['server_id']) for row in cursor.fetchall()]
+            cursor.executemany("UPDATE purchases SET is_active = FALSE WHERE id = ?", [(pid,) for pid in purchase_ids])
+            cursor.executemany("UPDATE server_stats SET active_purchases = active_purchases - ? WHERE server_id = ?", per_server)
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error deactivating purchases {purchase_ids}: {e}")
+            return False
+        finally:
+            if conn: conn.close()
+
+    def mark_expiry_warned(self, purchase_ids: list):
+        if not purchase_ids:
+            return True
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            now = time.time()
+            cursor.executemany("UPDATE purchases SET expiry_warned_at = ? WHERE id = ?", [(now, pid) for pid in purchase_ids])
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error marking expiry warnings for {purchase_ids}: {e}")
+            return False
+        finally:
+            if conn: conn.close()
+
+    # --- توابع پیام همگانی ---
+    def get_users_page(self, after_user_id: int = 0, limit: int = 200):
+        """صفحه‌ای از کاربران به ترتیب id (keyset)؛ صفحه بعد با after_user_id = id آخرین کاربر."""
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, telegram_id FROM users WHERE id > ? ORDER BY id LIMIT ?", (after_user_id, limit))
+            return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Error getting users page after {after_user_id}: {e}")
+            return []
+        finally:
+            if conn: conn.close()
+
+    def count_users(self):
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) AS total FROM users")
+            return cursor.fetchone()['total']
+        except sqlite3.Error as e:
+            logger.error(f"Error counting users: {e}")
+            return 0
+        finally:
+            if conn: conn.close()
+
+    def create_broadcast(self, created_by: int, text: str, total_users: int):
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO broadcasts (created_by, text, status, total_users, created_at)
+                VALUES (?, ?, 'running', ?, ?)
+            """, (created_by, text, total_users, time.time()))
+            conn.commit()
+            return cursor.lastrowid
+        except sqlite3.Error as e:
+            logger.error(f"Error creating broadcast: {e}")
+            return None
+        finally:
+            if conn: conn.close()
+
+    def get_broadcast(self, broadcast_id: int):
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+        except sqlite3.Error as e:
+            logger.error(f"Error getting broadcast {broadcast_id}: {e}")
+            return None
+        finally:
+            if conn: conn.close()
+
+    def get_running_broadcasts(self):
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id")
+            return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Error getting running broadcasts: {e}")
+            return []
+        finally:
+            if conn: conn.close()
+
+    def save_broadcast_progress(self, broadcast_id: int, last_user_id: int, sent: int, failures: list):
+        """
+        نتیجه یک صفحه ارسال را در یک تراکنش ثبت می‌کند تا پس از ری‌استارت از همان‌جا ادامه یابد.
+        failures: لیست (user_id, telegram_id, error).
+        """
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE broadcasts SET last_user_id = ?, sent_count = sent_count + ?, failed_count = failed_count + ?
+                WHERE id = ?
+            """, (last_user_id, sent, len(failures), broadcast_id))
+            if failures:
+                now = time.time()
+                cursor.executemany("""
+                    INSERT INTO broadcast_failures (broadcast_id, user_id, telegram_id, error, failed_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(broadcast_id, user_id) DO UPDATE SET error = excluded.error, failed_at = excluded.failed_at
+                """, [(broadcast_id, user_id, telegram_id, error, now) for user_id, telegram_id, error in failures])
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error saving progress of broadcast {broadcast_id}: {e}")
+            return False
+        finally:
+            if conn: conn.close()
+
+    def finish_broadcast(self, broadcast_id: int, status: str = 'done'):
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ?", (status, time.time(), broadcast_id))
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error finishing broadcast {broadcast_id}: {e}")
+            return False
+        finally:
+            if conn: conn.close()
+
+    def count_users_from_stats(self):
+        """
+        تعداد کاربران از جمع new_users در daily_stats (یک ردیف برای هر روز) به جای COUNT(*) روی users؛
+        کاربران حذف نمی‌شوند و شمارنده با هر کاربر جدید (و backfill مایگریشن) به‌روز است.
+        """
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(SUM(new_users), 0) AS total FROM daily_stats")
+            return int(cursor.fetchone()['total'])
+        except sqlite3.Error as e:
+            logger.error(f"Error counting users from daily stats: {e}")
+            return 0
+        finally:
+            if conn: conn.close()
+
+    def get_dashboard_stats(self, days: int = 7):
+        """
+        آمار داشبورد ادمین فقط از جداول خلاصه (daily_stats و server_stats)، بدون پیمایش payments و purchases.
+        {'days': آمار روزهای اخیر، 'totals': جمع کل، 'servers': خریدهای فعال هر سرور} برمی‌گرداند.
+        """
+        since = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        sums = ", ".join(f"COALESCE(SUM({c}), 0) AS {c}" for c in DAILY_STATS_COLUMNS)
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM daily_stats WHERE day >= ? ORDER BY day DESC", (since,))
+            recent_days = [dict(row) for row in cursor.fetchall()]
+            cursor.execute(f"SELECT {sums} FROM daily_stats")
+            totals = dict(cursor.fetchone())
+            cursor.execute("""
+                SELECT s.id, s.name, COALESCE(st.active_purchases, 0) AS active_purchases,
+                       COALESCE(st.total_purchases, 0) AS total_purchases
+                FROM servers s LEFT JOIN server_stats st ON st.server_id = s.id
+                ORDER BY active_purchases DESC
+            """)
+            servers = [dict(row) for row in cursor.fetchall()]
+            totals['payments_pending'] = totals['payments_created'] - totals['payments_confirmed'] - totals['payments_rejected']
+            return {'days': recent_days, 'totals': totals, 'servers': servers}
+        except sqlite3.Error as e:
+            logger.error(f"Error getting dashboard stats: {e}")
+            return None
+        finally:
+            if conn: conn.close()
+
     def check_free_test_usage(self, user_db_id: int) -> bool:
         """بررسی می‌کند آیا کاربر قبلاً از تست رایگان استفاده کرده است."""
         conn = None
@@ -698,11 +1333,14 @@ class DatabaseManager:
             conn = self._get_connection()
             cursor = conn.cursor()
             cursor.execute("INSERT INTO free_test_usage (user_id) VALUES (?)", (user_db_id,))
+            _bump_daily_stats(cursor, _utc_day(), free_tests=1)
             conn.commit()
             return True
         except sqlite3.Error as e:
             logger.error(f"Error recording free test usage for user {user_db_id}: {e}")
             return False
+        finally:
+            if conn: conn.close()
 
     def reset_free_test_usage(self, user_db_id: int):
         """به ادمین اجازه می‌دهد دسترسی کاربر به تست رایگان را ریست کند."""
@@ -716,6 +1354,8 @@ class DatabaseManager:
         except sqlite3.Error as e:
             logger.error(f"Error resetting free test usage for user {user_db_id}: {e}")
             return False
+        finally:
+            if conn: conn.close()
         
         
         
@@ -742,13 +1382,12 @@ class DatabaseManager:
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE payments 
-                SET is_confirmed = TRUE, ref_id = ?, confirmation_date = CURRENT_TIMESTAMP
-                WHERE id = ?
-            """, (ref_id, payment_id))
+            updated = self._transition_payment(
+                cursor, payment_id, 'confirmed',
+                "is_confirmed = TRUE, ref_id = ?, confirmation_date = CURRENT_TIMESTAMP", (ref_id,)
+            )
             conn.commit()
-            return True
+            return updated
         except sqlite3.Error as e:
             logger.error(f"Error confirming online payment for ID {payment_id}: {e}")
             return False
@@ -770,4 +1409,316 @@ class DatabaseManager:
             logger.error(f"Error setting authority for payment ID {payment_id}: {e}")
             return False
         finally:
-            if conn: conn.close()
\ No newline at end of file
+            if conn: conn.close()
+
+
+    def claim_payment_provisioning(self, payment_id: int, lease_seconds: int) -> bool:
+        """
+        حق ساخت سرویس یک پرداخت را به صورت اتمیک رزرو می‌کند. فقط یک فراخواننده True می‌گیرد؛
+        اگر رزرو قبلی تا پایان lease کامل نشده باشد (مثلاً پروسه از کار افتاده)، دوباره قابل رزرو است.
+        """
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            now = time.time()
+            cursor.execute("""
+                UPDATE payments SET provision_state = 'processing', provision_lease_until = ?
+                WHERE id = ? AND (provision_state IS NULL OR (provision_state = 'processing' AND provision_lease_until < ?))
+            """, (now + lease_seconds, payment_id, now))
+            conn.commit()
+            return cursor.rowcount == 1
+        except sqlite3.Error as e:
+            logger.error(f"Error claiming payment {payment_id} for provisioning: {e}")
+            return False
+        finally:
+            if conn: conn.close()
+
+    def claim_payment_rejection(self, payment_id: int) -> bool:
+        """
+        پرداخت را به صورت اتمیک برای رد کردن رزرو می‌کند (provision_state = rejected). اگر ساخت سرویس
+        شروع شده یا پرداخت قبلاً رد شده باشد False برمی‌گرداند؛ پرداخت رد شده دیگر قابل رزرو برای ساخت نیست.
+        """
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE payments SET provision_state = 'rejected', provision_lease_until = NULL
+                WHERE id = ? AND provision_state IS NULL AND is_confirmed = FALSE
+            """, (payment_id,))
+            conn.commit()
+            return cursor.rowcount == 1
+        except sqlite3.Error as e:
+            logger.error(f"Error claiming payment {payment_id} for rejection: {e}")
+            return False
+        finally:
+            if conn: conn.close()
+
+    def complete_payment_provisioning(self, payment_id: int):
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE payments SET provision_state = 'done', provision_lease_until = NULL WHERE id = ?
+            """, (payment_id,))
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error completing provisioning for payment {payment_id}: {e}")
+            return False
+        finally:
+            if conn: conn.close()
+
+    def release_payment_claim(self, payment_id: int):
+        """رزرو ناموفق را آزاد می‌کند تا ساخت سرویس دوباره قابل تلاش باشد."""
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE payments SET provision_state = NULL, provision_lease_until = NULL
+                WHERE id = ? AND provision_state = 'processing'
+            """, (payment_id,))
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error releasing provisioning claim for payment {payment_id}: {e}")
+            return False
+        finally:
+            if conn: conn.close()
+
+    # --- توابع کش file_id فایل‌های آپلود شده در تلگرام ---
+    def get_media_file_id(self, content_hash: str):
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT file_id FROM media_file_ids WHERE content_hash = ?", (content_hash,))
+            row = cursor.fetchone()
+            return row['file_id'] if row else None
+        except sqlite3.Error as e:
+            logger.error(f"Error getting cached file_id for {content_hash}: {e}")
+            return None
+        finally:
+            if conn: conn.close()
+
+    def save_media_file_id(self, content_hash: str, media_type: str, file_id: str, size_bytes: int = None):
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            now = time.time()
+            cursor.execute("""
+                INSERT INTO media_file_ids (content_hash, media_type, file_id, size_bytes, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(content_hash) DO UPDATE SET
+                    file_id = excluded.file_id,
+                    updated_at = excluded.updated_at
+            """, (content_hash, media_type, file_id, size_bytes, now, now))
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error saving file_id for {content_hash}: {e}")
+            return False
+        finally:
+            if conn: conn.close()
+
+    def delete_media_file_id(self, content_hash: str):
+        """file_id نامعتبر (مثلاً پس از تغییر توکن ربات) را حذف می‌کند."""
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM media_file_ids WHERE content_hash = ?", (content_hash,))
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error deleting file_id for {content_hash}: {e}")
+            return False
+        finally:
+            if conn: conn.close()
+
+    # --- توابع صف کارهای پس‌زمینه (Jobs) ---
+    def enqueue_job(self, job_type: str, payload: dict, idempotency_key: str = None, max_attempts: int = 5):
+        """
+        یک کار جدید ثبت می‌کند. اگر کاری با همان idempotency_key قبلاً ثبت شده باشد، شناسه همان کار
+        برگردانده می‌شود و کار تکراری ساخته نمی‌شود؛ اگر آن کار با تمام شدن تلاش‌ها failed شده باشد،
+        دوباره با تلاش‌های کامل در صف قرار می‌گیرد (درخواست دوباره یعنی کار هنوز لازم است).
+        """
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            now = time.time()
+            cursor.execute("""
+                INSERT INTO jobs (job_type, payload_json, idempotency_key, status, max_attempts, run_after, created_at)
+                VALUES (?, ?, ?, 'pending', ?, ?, ?)
+                ON CONFLICT(idempotency_key) DO NOTHING
+            """, (job_type, json.dumps(payload), idempotency_key, max_attempts, now, now))
+            if cursor.rowcount:
+                job_id = cursor.lastrowid
+                conn.commit()
+                return job_id
+            cursor.execute("""
+                UPDATE jobs SET status = 'pending', attempts = 0, run_after = ?, locked_until = NULL,
+                    last_error = NULL, finished_at = NULL
+                WHERE idempotency_key = ? AND status = 'failed'
+            """, (now, idempotency_key))
+            revived = cursor.rowcount == 1
+            cursor.execute("SELECT id FROM jobs WHERE idempotency_key = ?", (idempotency_key,))
+            existing = cursor.fetchone()
+            conn.commit()
+            if revived:
+                logger.info(f"Failed job with idempotency key '{idempotency_key}' was queued again.")
+            else:
+                logger.info(f"Job with idempotency key '{idempotency_key}' already exists.")
+            return existing['id'] if existing else None
+        except sqlite3.Error as e:
+            logger.error(f"Error enqueuing job '{job_type}': {e}")
+            return None
+        finally:
+            if conn: conn.close()
+
+    def claim_next_job(self, job_types: list, lease_seconds: int):
+        """
+        اولین کار آماده را به صورت اتمیک برای این worker رزرو می‌کند (status = running تا پایان lease).
+        کارهایی که lease آن‌ها تمام شده (worker از کار افتاده) دوباره قابل رزرو هستند.
+        """
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            now = time.time()
+            placeholders = ", ".join("?" for _ in job_types)
+            ready_condition = "((status = 'pending' AND run_after <= ?) OR (status = 'running' AND locked_until < ?))"
+            cursor.execute(f"""
+                SELECT id FROM jobs
+                WHERE job_type IN ({placeholders}) AND {ready_condition}
+                ORDER BY run_after, id LIMIT 1
+            """, (*job_types, now, now))
+            candidate = cursor.fetchone()
+            if not candidate:
+                return None
+            # شرط دوباره در UPDATE بررسی می‌شود تا اگر worker دیگری زودتر رزرو کرد، این رزرو انجام نشود
+            cursor.execute(f"""
+                UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_until = ?, started_at = ?
+                WHERE id = ? AND {ready_condition}
+            """, (now + lease_seconds, now, candidate['id'], now, now))
+            conn.commit()
+            if cursor.rowcount != 1:
+                return None
+            cursor.execute("SELECT * FROM jobs WHERE id = ?", (candidate['id'],))
+            job = dict(cursor.fetchone())
+            job['payload'] = json.loads(job.pop('payload_json'))
+            return job
+        except sqlite3.Error as e:
+            logger.error(f"Error claiming job: {e}")
+            return None
+        finally:
+            if conn: conn.close()
+
+    def complete_job(self, job_id: int):
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE jobs SET status = 'done', locked_until = NULL, last_error = NULL, finished_at = ? WHERE id = ?
+            """, (time.time(), job_id))
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error completing job {job_id}: {e}")
+            return False
+        finally:
+            if conn: conn.close()
+
+    def fail_job(self, job_id: int, error: str, retry_delay_seconds: float):
+        """
+        شکست یک اجرا را ثبت می‌کند. اگر تلاش‌ها تمام نشده باشد کار پس از retry_delay_seconds دوباره اجرا می‌شود؛
+        در غیر این صورت وضعیت failed می‌گیرد. True یعنی کار دیگر تلاش نخواهد شد.
+        """
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            now = time.time()
+            cursor.execute("""
+                UPDATE jobs SET
+                    status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END,
+                    finished_at = CASE WHEN attempts >= max_attempts THEN ? ELSE NULL END,
+                    run_after = ?, locked_until = NULL, last_error = ?
+                WHERE id = ?
+            """, (now, now + retry_delay_seconds, error, job_id))
+            cursor.execute("SELECT status FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            conn.commit()
+            return row is not None and row['status'] == 'failed'
+        except sqlite3.Error as e:
+            logger.error(f"Error recording failure for job {job_id}: {e}")
+            return False
+        finally:
+            if conn: conn.close()
+
+    def get_job_stats(self, recent_limit: int = 200):
+        """تعداد کارها به تفکیک وضعیت و زمان‌های آخرین کارهای انجام شده (ثبت تا شروع، ثبت تا پایان)."""
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT status, COUNT(*) AS total FROM jobs GROUP BY status")
+            counts = {row['status']: row['total'] for row in cursor.fetchall()}
+            cursor.execute("""
+                SELECT started_at - created_at AS wait_seconds, finished_at - created_at AS total_seconds
+                FROM jobs WHERE status = 'done' ORDER BY finished_at DESC LIMIT ?
+            """, (recent_limit,))
+            latencies = [dict(row) for row in cursor.fetchall()]
+            return {'counts': counts, 'recent_latencies': latencies}
+        except sqlite3.Error as e:
+            logger.error(f"Error getting job stats: {e}")
+            return {'counts': {}, 'recent_latencies': []}
+        finally:
+            if conn: conn.close()
+
+
+if __name__ == "__main__":
+    # بنچمارک ساده: زمان هر فراخوانی با اتصال جدید در مقابل اتصال pool شده
+    import tempfile
+
+    bench_dir = tempfile.mkdtemp()
+    bench_path = os.path.join(bench_dir, "bench.db")
+    manager = DatabaseManager(bench_path, backend=SQLiteBackend(bench_path))
+    manager.create_tables()
+    manager.add_or_update_user(1000, "bench")
+    iterations = 2000
+
+    def _fresh_connection():
+        conn = sqlite3.connect(manager.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    pooled_get_connection = manager._get_connection
+    for label, factory in (("fresh connection", _fresh_connection), ("pooled connection", pooled_get_connection)):
+        manager._get_connection = factory
+        start = time.perf_counter()
+        for _ in range(iterations):
+            manager.get_user_by_telegram_id(1000)
+        elapsed = time.perf_counter() - start
+        print(f"{label}: {elapsed / iterations * 1_000_000:.1f} µs per call")
+
+    # بررسی همزمانی: چند thread همزمان یک پرداخت را رزرو می‌کنند؛ فقط یکی باید موفق شود
+    from concurrent.futures import ThreadPoolExecutor
+
+    payment_id = manager.add_payment(manager.get_user_by_telegram_id(1000)['id'], 1000, 1, "{}")
+    barrier = threading.Barrier(32)
+
+    def _claim(_):
+        barrier.wait()
+        return manager.claim_payment_provisioning(payment_id, lease_seconds=60)
+
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        claims = list(executor.map(_claim, range(32)))
+    print(f"payment claim: {claims.count(True)} of {len(claims)} concurrent claims succeeded")
+    assert claims.count(True) == 1
@@ -0,0 +1,370 @@
+# database/migrations.py
+
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# شناسه قفل advisory پستگرس برای اجرای انحصاری مایگریشن‌ها
+_MIGRATION_LOCK_ID = 7_210_042
+
+# ستون‌های شمارنده جدول daily_stats (به جز day)
+DAILY_STATS_COLUMNS = (
+    'new_users', 'payments_created', 'payments_confirmed', 'payments_rejected', 'revenue',
+    'purchases', 'free_tests', 'free_test_conversions',
+)
+
+def _create_users_fts(cursor):
+    """
+    جدول FTS5 برای جستجوی نام کاربران (فقط sqlite) که با triggerها همگام می‌ماند.
+    اگر sqlite بدون FTS5 کامپایل شده باشد، جستجو به LIKE پیشوندی برمی‌گردد.
+    """
+    if not isinstance(cursor, sqlite3.Cursor):
+        return
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS users_fts
+            USING fts5(first_name, last_name, username, content='users', content_rowid='id')
+        """)
+    except sqlite3.OperationalError as e:
+        logger.warning(f"FTS5 is not available, user name search falls back to LIKE: {e}")
+        return
+    # فقط تغییر ستون‌های نام trigger را فعال می‌کند، نه به‌روزرسانی last_activity
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+            INSERT INTO users_fts (rowid, first_name, last_name, username)
+            VALUES (new.id, new.first_name, new.last_name, new.username);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, first_name, last_name, username)
+            VALUES ('delete', old.id, old.first_name, old.last_name, old.username);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF first_name, last_name, username ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, first_name, last_name, username)
+            VALUES ('delete', old.id, old.first_name, old.last_name, old.username);
+            INSERT INTO users_fts (rowid, first_name, last_name, username)
+            VALUES (new.id, new.first_name, new.last_name, new.username);
+        END
+    """)
+    cursor.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+
+def _day(value):
+    """'YYYY-MM-DD' یک TIMESTAMP (رشته در sqlite، رشته یا datetime در postgres)."""
+    return str(value)[:10] if value else None
+
+
+def _backfill_dashboard_stats(cursor):
+    """
+    جداول خلاصه داشبورد را یک بار از داده‌های موجود پر می‌کند؛ پس از آن DatabaseManager
+    آن‌ها را در همان تراکنش هر ثبت و تغییر وضعیت به‌روز نگه می‌دارد.
+    """
+    daily = {}
+
+    def bump(day, column, amount=1):
+        if day:
+            row = daily.setdefault(day, dict.fromkeys(DAILY_STATS_COLUMNS, 0))
+            row[column] += amount
+
+    cursor.execute("SELECT join_date FROM users")
+    for row in cursor.fetchall():
+        bump(_day(row[0]), 'new_users')
+    cursor.execute("SELECT payment_date, confirmation_date, is_confirmed, amount FROM payments")
+    for payment_date, confirmation_date, is_confirmed, amount in cursor.fetchall():
+        bump(_day(payment_date), 'payments_created')
+        if is_confirmed:
+            bump(_day(confirmation_date) or _day(payment_date), 'payments_confirmed')
+            bump(_day(confirmation_date) or _day(payment_date), 'revenue', amount or 0)
+        elif confirmation_date:
+            bump(_day(confirmation_date), 'payments_rejected')
+    cursor.execute("SELECT purchase_date FROM purchases")
+    for row in cursor.fetchall():
+        bump(_day(row[0]), 'purchases')
+    cursor.execute("SELECT usage_timestamp FROM free_test_usage")
+    for row in cursor.fetchall():
+        bump(_day(row[0]), 'free_tests')
+    # تبدیل = اولین پرداخت تایید شده کاربر پس از استفاده از تست رایگان
+    cursor.execute("""
+        SELECT f.usage_timestamp, MIN(p.confirmation_date)
+        FROM free_test_usage f JOIN payments p ON p.user_id = f.user_id AND p.is_confirmed = TRUE
+        GROUP BY f.user_id, f.usage_timestamp
+    """)
+    for used_at, first_paid_at in cursor.fetchall():
+        if first_paid_at and str(first_paid_at) >= str(used_at):
+            bump(_day(first_paid_at), 'free_test_conversions')
+
+    if daily:
+        columns = ", ".join(DAILY_STATS_COLUMNS)
+        placeholders = ", ".join("?" for _ in DAILY_STATS_COLUMNS)
+        cursor.executemany(f"INSERT INTO daily_stats (day, {columns}) VALUES (?, {placeholders})",
+                           [(day, *(row[c] for c in DAILY_STATS_COLUMNS)) for day, row in daily.items()])
+    cursor.execute("""
+        INSERT INTO server_stats (server_id, active_purchases, total_purchases)
+        SELECT server_id, SUM(CASE WHEN is_active THEN 1 ELSE 0 END), COUNT(*) FROM purchases GROUP BY server_id
+    """)
+
+
+# =============================================================================
+# مایگریشن‌های دیتابیس به ترتیب نسخه.
+# هر مرحله: (نسخه، توضیح، لیست دستورات SQL). نسخه‌ها فقط افزایش می‌یابند و
+# مرحله‌ای که اجرا شده هرگز تغییر داده نمی‌شود؛ تغییر جدید = مرحله جدید.
+# =============================================================================
+MIGRATIONS = [
+    (1, "Indexes for hot lookups", [
+        "CREATE INDEX IF NOT EXISTS idx_payments_authority ON payments (authority)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_is_confirmed ON payments (is_confirmed)",
+        "CREATE INDEX IF NOT EXISTS idx_purchases_user_id ON purchases (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_purchases_server_id ON purchases (server_id)",
+        "CREATE INDEX IF NOT EXISTS idx_server_inbounds_server_active ON server_inbounds (server_id, is_active)",
+    ]),
+    (2, "Persistent user states", [
+        """CREATE TABLE IF NOT EXISTS user_states (
+            namespace TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            state_json TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (namespace, user_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_user_states_updated_at ON user_states (updated_at)",
+    ]),
+    (3, "Durable background jobs", [
+        """CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_type TEXT NOT NULL,
+            payload_json TEXT NOT NULL,
+            idempotency_key TEXT UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_after REAL NOT NULL,
+            locked_until REAL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs (status, run_after)",
+    ]),
+    (4, "Payment provisioning claim", [
+        # provision_state: NULL (آزاد)، processing (در حال ساخت سرویس تا provision_lease_until)، done یا rejected (رد شده توسط ادمین)
+        "ALTER TABLE payments ADD COLUMN provision_state TEXT",
+        "ALTER TABLE payments ADD COLUMN provision_lease_until REAL",
+    ]),
+    (5, "Telegram file_id cache for uploaded media", [
+        """CREATE TABLE IF NOT EXISTS media_file_ids (
+            content_hash TEXT PRIMARY KEY,
+            media_type TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            size_bytes INTEGER,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )""",
+    ]),
+    (6, "Server health check history", [
+        """CREATE TABLE IF NOT EXISTS server_health_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            server_id INTEGER NOT NULL,
+            checked_at REAL NOT NULL,
+            is_online BOOLEAN NOT NULL,
+            latency_ms REAL,
+            inbound_count INTEGER,
+            error_class TEXT
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_server_health_server_checked ON server_health_history (server_id, checked_at)",
+        "CREATE INDEX IF NOT EXISTS idx_server_health_checked_at ON server_health_history (checked_at)",
+    ]),
+    (7, "Traffic usage synced from panels", [
+        """CREATE TABLE IF NOT EXISTS purchase_usage (
+            server_id INTEGER NOT NULL,
+            client_email TEXT NOT NULL,
+            subscription_id TEXT,
+            up_bytes INTEGER NOT NULL DEFAULT 0,
+            down_bytes INTEGER NOT NULL DEFAULT 0,
+            total_bytes INTEGER,
+            expiry_time INTEGER,
+            enabled BOOLEAN,
+            synced_at REAL NOT NULL,
+            PRIMARY KEY (server_id, client_email)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_purchase_usage_subscription ON purchase_usage (server_id, subscription_id)",
+    ]),
+    (8, "Expiry scheduler", [
+        "CREATE INDEX IF NOT EXISTS idx_purchases_active_expire ON purchases (is_active, expire_date)",
+        # زمان ارسال هشدار نزدیک شدن انقضا (NULL = هنوز ارسال نشده)
+        "ALTER TABLE purchases ADD COLUMN expiry_warned_at REAL",
+    ]),
+    (9, "Broadcast messages", [
+        """CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_by INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            total_users INTEGER NOT NULL DEFAULT 0,
+            sent_count INTEGER NOT NULL DEFAULT 0,
+            failed_count INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            finished_at REAL
+        )""",
+        """CREATE TABLE IF NOT EXISTS broadcast_failures (
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            telegram_id INTEGER NOT NULL,
+            error TEXT,
+            failed_at REAL NOT NULL,
+            PRIMARY KEY (broadcast_id, user_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status)",
+    ]),
+    (10, "Admin user search", [
+        # جستجوی پیشوندی نام کاربری بدون حساسیت به حروف بزرگ و کوچک
+        "CREATE INDEX IF NOT EXISTS idx_users_username_lower ON users (LOWER(username))",
+        _create_users_fts,
+    ]),
+    (11, "Admin dashboard summary tables", [
+        # روز بر اساس UTC است، مانند CURRENT_TIMESTAMP
+        """CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT PRIMARY KEY,
+            new_users INTEGER NOT NULL DEFAULT 0,
+            payments_created INTEGER NOT NULL DEFAULT 0,
+            payments_confirmed INTEGER NOT NULL DEFAULT 0,
+            payments_rejected INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            purchases INTEGER NOT NULL DEFAULT 0,
+            free_tests INTEGER NOT NULL DEFAULT 0,
+            free_test_conversions INTEGER NOT NULL DEFAULT 0
+        )""",
+        """CREATE TABLE IF NOT EXISTS server_stats (
+            server_id INTEGER PRIMARY KEY,
+            active_purchases INTEGER NOT NULL DEFAULT 0,
+            total_purchases INTEGER NOT NULL DEFAULT 0
+        )""",
+        # بررسی «اولین پرداخت تایید شده کاربر» هنگام تایید پرداخت
+        "CREATE INDEX IF NOT EXISTS idx_payments_user_confirmed ON payments (user_id, is_confirmed)",
+        _backfill_dashboard_stats,
+    ]),
+]
+
+# کوئری‌های پرتکرار که نباید به full table scan برسند: (نام، SQL، پارامترها)
+HOT_QUERIES = [
+    ("get_payment_by_authority", "SELECT * FROM payments WHERE authority = ?", ("x",)),
+    ("get_user_purchases", """
+        SELECT p.id, p.purchase_date, p.expire_date, p.initial_volume_gb, p.is_active, s.name as server_name
+        FROM purchases p
+        JOIN servers s ON p.server_id = s.id
+        WHERE p.user_id = ?
+        ORDER BY p.id DESC
+    """, (1,)),
+    ("purchases_by_server", "SELECT id FROM purchases WHERE server_id = ?", (1,)),
+    ("get_server_inbounds", "SELECT * FROM server_inbounds WHERE server_id = ? AND is_active = TRUE", (1,)),
+    ("pending_payments", "SELECT id FROM payments WHERE is_confirmed = FALSE", ()),
+    ("get_user_by_telegram_id", "SELECT * FROM users WHERE telegram_id = ?", (1,)),
+    ("expired_active_purchases", """
+        SELECT id FROM purchases WHERE is_active = TRUE AND expire_date IS NOT NULL AND expire_date <= ?
+    """, ("2030-01-01 00:00:00",)),
+    ("users_page", "SELECT id FROM users WHERE id < ? ORDER BY id DESC LIMIT ?", (100, 20)),
+    ("search_users_by_username", """
+        SELECT id FROM users WHERE LOWER(username) >= ? AND LOWER(username) < ? ORDER BY LOWER(username) LIMIT ?
+    """, ("ali", "ali\uffff", 20)),
+    ("get_purchase_usage", """
+        SELECT SUM(up_bytes), SUM(down_bytes), MAX(synced_at)
+        FROM purchase_usage WHERE server_id = ? AND subscription_id = ?
+    """, (1, "x")),
+]
+
+
+def get_schema_version(cursor) -> int:
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    row = cursor.fetchone()
+    return row[0] or 0
+
+
+def run_migrations(conn) -> int:
+    """
+    مایگریشن‌های اجرا نشده را به ترتیب و همگی در یک تراکنش اجرا می‌کند.
+    تعداد مراحل اجرا شده را برمی‌گرداند؛ در صورت خطا همه چیز rollback می‌شود.
+    """
+    cursor = conn.cursor()
+    current_version = get_schema_version(cursor)
+    conn.commit()
+    if current_version >= MIGRATIONS[-1][0]:
+        logger.info(f"Database schema is up to date (version {current_version}).")
+        return 0
+
+    try:
+        # ربات و وب‌هوک ممکن است همزمان بالا بیایند: قفل نوشتن از ابتدای تراکنش گرفته و نسخه
+        # دوباره خوانده می‌شود تا پروسه دوم مایگریشن‌هایی را که اولی اجرا کرده تکرار نکند
+        if isinstance(conn, sqlite3.Connection):
+            cursor.execute("BEGIN IMMEDIATE")
+        else:
+            cursor.execute("SELECT pg_advisory_xact_lock(?)", (_MIGRATION_LOCK_ID,))
+        current_version = get_schema_version(cursor)
+        pending = [m for m in MIGRATIONS if m[0] > current_version]
+        if not pending:
+            conn.commit()
+            logger.info(f"Database schema was migrated by another process (version {current_version}).")
+            return 0
+        for version, description, statements in pending:
+            logger.info(f"Applying migration {version}: {description}")
+            for statement in statements:
+                if callable(statement):
+                    statement(cursor)
+                else:
+                    cursor.execute(statement)
+            cursor.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (version, description))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Migration failed, schema left at version {current_version}: {e}")
+        raise
+    logger.info(f"Database schema migrated from version {current_version} to {pending[-1][0]}.")
+    return len(pending)
+
+
+def find_full_table_scans(conn) -> list:
+    """
+    با EXPLAIN QUERY PLAN بررسی می‌کند کدام کوئری‌های پرتکرار بدون ایندکس کل جدول را پیمایش می‌کنند.
+    لیستی از (نام کوئری، جزئیات plan) برمی‌گرداند.
+    """
+    offenders = []
+    cursor = conn.cursor()
+    for name, sql, params in HOT_QUERIES:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        for row in cursor.fetchall():
+            detail = row[-1]
+            if detail.startswith("SCAN") and "USING" not in detail:
+                offenders.append((name, detail))
+    return offenders
+
+
+if __name__ == "__main__":
+    # بررسی EXPLAIN کوئری‌های پرتکرار؛ در صورت full table scan با کد خطا خارج می‌شود (برای CI یا پیش از استقرار)
+    # استفاده: python -m database.migrations [مسیر دیتابیس sqlite]  (بدون مسیر: یک دیتابیس تازه موقت)
+    import os
+    import sys
+    import tempfile
+
+    from database.db_manager import DatabaseManager
+
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(tmp, "explain_check.db")
+        manager = DatabaseManager(db_path=db_path)
+        manager.create_tables()
+        offenders = find_full_table_scans(manager._get_connection())
+        manager.close_all_connections()
+    for query_name, plan_detail in offenders:
+        print(f"FULL SCAN: {query_name}: {plan_detail}")
+    print(f"{len(HOT_QUERIES)} hot queries checked, {len(offenders)} full table scans.")
+    sys.exit(1 if offenders else 0)
@@ -5,15 +5,19 @@ from telebot import types
 import logging
 import datetime
 import json
-import os
-import zipfile
-from config import ADMIN_IDS, SUPPORT_CHANNEL_LINK
+from config import ADMIN_IDS, SUPPORT_CHANNEL_LINK, PAYMENT_CLAIM_LEASE_SECONDS, ADMIN_USERS_PAGE_SIZE, DASHBOARD_DAYS, BULK_ACCOUNTS_MAX_COUNT
 from database.db_manager import DatabaseManager
 from api_client.xui_api_client import XuiAPIClient
 from utils import messages, helpers
 from keyboards import inline_keyboards
 from utils.config_generator import ConfigGenerator
 from utils.bot_helpers import send_subscription_info # این ایمپورت جدید است
+from api_client.inbound_cache import inbound_cache
+from utils.state_store import create_state_store
+from utils.media_cache import media_cache
+from utils.health_checker import get_health_checker
+from utils.broadcast import get_broadcast_engine
+from utils.backup import create_backup_archive, backup_filename
 
 logger = logging.getLogger(__name__)
 
@@ -25,9 +29,10 @@ _config_generator: ConfigGenerator = None
 _admin_states = {}
 
 def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance):
-    global _bot, _db_manager, _xui_api, _config_generator
+    global _bot, _db_manager, _xui_api, _config_generator, _admin_states
     _bot = bot_instance
     _db_manager = db_manager_instance
+    _admin_states = create_state_store('admin', db_manager_instance)
     _xui_api = xui_api_instance
     _config_generator = ConfigGenerator(xui_api_instance, db_manager_instance)
 
@@ -36,9 +41,8 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
     # =============================================================================
 
     def _clear_admin_state(admin_id):
-        """وضعیت ادمین را فقط از دیکشنری پاک می‌کند."""
-        if admin_id in _admin_states:
-            del _admin_states[admin_id]
+        """وضعیت ادمین را فقط از ذخیره‌ساز وضعیت پاک می‌کند."""
+        _admin_states.pop(admin_id, None)
 
     def _show_menu(user_id, text, markup, message=None):
         try:
@@ -107,33 +111,80 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         _bot.edit_message_text(text, admin_id, message.message_id, parse_mode='Markdown', reply_markup=inline_keyboards.get_back_button("admin_payment_management"))
 
 
-    def list_all_users(admin_id, message):
-        users = _db_manager.get_all_users()
+    def _format_user_line(user):
+        # نام کاربری نیز escape می‌شود تا از خطا جلوگیری شود
+        username = helpers.escape_markdown_v1(user.get('username') or 'N/A')
+        first_name = helpers.escape_markdown_v1(user.get('first_name') or '')
+        return f"👤 `ID: {user['id']}` - **{first_name}** (@{username}) - `{user['telegram_id']}`\n"
+
+    def list_all_users(admin_id, message, before_id=None, after_id=None):
+        # فقط یک صفحه (keyset روی id) خوانده می‌شود تا پیام از سقف طول تلگرام بیشتر نشود
+        users, has_more = _db_manager.get_users_list_page(before_id=before_id, after_id=after_id, limit=ADMIN_USERS_PAGE_SIZE)
         if not users:
-            text = messages.NO_USERS_FOUND
+            if before_id is not None or after_id is not None:
+                # کاربران این صفحه دیگر وجود ندارند؛ بازگشت به صفحه اول
+                return list_all_users(admin_id, message)
+            _show_menu(admin_id, messages.NO_USERS_FOUND, inline_keyboards.get_back_button("admin_user_management"), message)
+            return
+
+        text = messages.LIST_USERS_HEADER + "".join(_format_user_line(user) for user in users)
+        # تعداد کل از جدول خلاصه daily_stats خوانده می‌شود تا هر صفحه COUNT(*) روی users اجرا نکند
+        text += messages.LIST_USERS_PAGE_FOOTER.format(total=_db_manager.count_users_from_stats())
+        if after_id is not None:
+            newer_cursor = users[0]['id'] if has_more else None
+            older_cursor = users[-1]['id']
         else:
-            text = messages.LIST_USERS_HEADER
-            for user in users:
-                # --- بخش اصلاح شده ---
-                # نام کاربری نیز escape می‌شود تا از خطا جلوگیری شود
-                username = helpers.escape_markdown_v1(user.get('username', 'N/A'))
-                first_name = helpers.escape_markdown_v1(user.get('first_name', ''))
-                text += f"👤 `ID: {user['id']}` - **{first_name}** (@{username})\n"
-                # --- پایان بخش اصلاح شده ---
-        
-        _show_menu(admin_id, text, inline_keyboards.get_back_button("admin_user_management"), message)
+            newer_cursor = users[0]['id'] if before_id is not None else None
+            older_cursor = users[-1]['id'] if has_more else None
+        _show_menu(admin_id, text, inline_keyboards.get_users_page_menu(newer_cursor, older_cursor), message)
+
+    def show_dashboard(admin_id, message):
+        # فقط جداول خلاصه خوانده می‌شوند؛ هزینه نمایش به تعداد پرداخت‌ها و خریدها بستگی ندارد
+        stats = _db_manager.get_dashboard_stats(days=DASHBOARD_DAYS)
+        if stats is None:
+            _show_menu(admin_id, messages.OPERATION_FAILED, inline_keyboards.get_back_button("admin_main_menu"), message)
+            return
+        totals = stats['totals']
+        free_tests = totals['free_tests']
+        text = messages.DASHBOARD_HEADER + messages.DASHBOARD_TOTALS.format(
+            users=int(totals['new_users']), revenue=totals['revenue'],
+            confirmed=int(totals['payments_confirmed']), pending=int(totals['payments_pending']),
+            rejected=int(totals['payments_rejected']), free_tests=int(free_tests),
+            conversions=int(totals['free_test_conversions']),
+            conversion_rate=(100 * totals['free_test_conversions'] / free_tests) if free_tests else 0,
+        )
+        text += messages.DASHBOARD_DAYS_HEADER.format(days=DASHBOARD_DAYS)
+        if not stats['days']:
+            text += messages.DASHBOARD_NO_ACTIVITY
+        for day in stats['days']:
+            text += messages.DASHBOARD_DAY_LINE.format(
+                day=day['day'], revenue=day['revenue'], confirmed=day['payments_confirmed'],
+                purchases=day['purchases'], new_users=day['new_users'])
+        if stats['servers']:
+            text += messages.DASHBOARD_SERVERS_HEADER
+            for server in stats['servers']:
+                text += messages.DASHBOARD_SERVER_LINE.format(
+                    name=helpers.escape_markdown_v1(server['name']),
+                    active=server['active_purchases'], total=server['total_purchases'])
+        _show_menu(admin_id, text, inline_keyboards.get_back_button("admin_main_menu"), message)
 
     def test_all_servers(admin_id, message):
         _bot.edit_message_text(messages.TESTING_ALL_SERVERS, admin_id, message.message_id, reply_markup=None)
         servers = _db_manager.get_all_servers()
         if not servers:
             _bot.send_message(admin_id, messages.NO_SERVERS_FOUND); _show_server_management_menu(admin_id); return
+        # همه سرورها همزمان تست می‌شوند؛ زمان کل برابر کندترین سرور است نه مجموع آنها
+        health_results = {r['server_id']: r for r in get_health_checker(_db_manager).check_all()}
         results = []
         for s in servers:
-            temp_xui_client = _xui_api(panel_url=s['panel_url'], username=s['username'], password=s['password'])
-            is_online = temp_xui_client.login()
-            _db_manager.update_server_status(s['id'], is_online, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-            results.append(f"{'✅' if is_online else '❌'} {helpers.escape_markdown_v1(s['name'])}")
+            r = health_results.get(s['id'])
+            if r is None:
+                continue
+            if r['is_online']:
+                details = f"{r['latency_ms']:.0f}ms، {r['inbound_count']} اینباند"
+            else:
+                details = r['error_class'] or "خطای نامشخص"
+            results.append(f"{'✅' if r['is_online'] else '❌'} {helpers.escape_markdown_v1(s['name'])} ({helpers.escape_markdown_v1(details)})")
         _bot.send_message(admin_id, messages.TEST_RESULTS_HEADER + "\n".join(results), parse_mode='Markdown')
         _show_server_management_menu(admin_id)
 
@@ -231,6 +282,18 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         elif state == 'waiting_for_server_id_for_inbounds':
             process_manage_inbounds_flow(admin_id, message)
 
+        # --- Broadcast Flow ---
+        elif state == 'waiting_for_broadcast_text':
+            confirm_broadcast_text(admin_id, message)
+
+        # --- Bulk Accounts Flow ---
+        elif state == 'waiting_for_bulk_accounts_spec':
+            process_bulk_accounts(admin_id, message)
+
+        # --- User Search Flow ---
+        elif state == 'waiting_for_user_search_query':
+            process_user_search(admin_id, message)
+
         
     # =============================================================================
     # SECTION: Process Starters and Callback Handlers
@@ -249,6 +312,94 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         prompt_text = f"{list_text}\n\n{messages.DELETE_SERVER_PROMPT}"
         _bot.edit_message_text(prompt_text, admin_id, message.message_id, parse_mode='Markdown')
 
+    def start_broadcast_flow(admin_id, message):
+        _clear_admin_state(admin_id)
+        _admin_states[admin_id] = {'state': 'waiting_for_broadcast_text', 'data': {}, 'prompt_message_id': message.message_id}
+        _bot.edit_message_text(messages.BROADCAST_PROMPT_TEXT, admin_id, message.message_id,
+                               reply_markup=inline_keyboards.get_back_button("admin_main_menu"))
+
+    def confirm_broadcast_text(admin_id, message):
+        state_info = _admin_states[admin_id]
+        if not message.text:
+            return
+        state_info['data']['text'] = message.text
+        state_info['state'] = 'waiting_for_broadcast_confirmation'
+        # پیش‌نمایش دقیقاً همان چیزی است که کاربران دریافت می‌کنند (متن ساده)
+        _bot.send_message(admin_id, message.text)
+        _bot.send_message(admin_id, messages.BROADCAST_CONFIRM.format(total=_db_manager.count_users()), parse_mode='Markdown',
+                          reply_markup=inline_keyboards.get_confirmation_menu("admin_confirm_broadcast", "admin_main_menu"))
+
+    def execute_broadcast(admin_id, message):
+        state_info = _admin_states.get(admin_id)
+        if not state_info or state_info.get('state') != 'waiting_for_broadcast_confirmation':
+            _show_admin_main_menu(admin_id, message); return
+        broadcast_id = get_broadcast_engine(_bot, _db_manager).start(admin_id, state_info['data']['text'])
+        _clear_admin_state(admin_id)
+        if not broadcast_id:
+            _bot.edit_message_text(messages.OPERATION_FAILED, admin_id, message.message_id); return
+        _bot.edit_message_text(messages.BROADCAST_STARTED.format(broadcast_id=broadcast_id), admin_id, message.message_id, parse_mode='Markdown')
+        _show_admin_main_menu(admin_id)
+
+    def start_bulk_accounts_flow(admin_id, message):
+        _clear_admin_state(admin_id)
+        list_text = _generate_server_list_text()
+        if list_text == messages.NO_SERVERS_FOUND:
+            _bot.edit_message_text(list_text, admin_id, message.message_id, reply_markup=inline_keyboards.get_back_button("admin_server_management")); return
+        _admin_states[admin_id] = {'state': 'waiting_for_bulk_accounts_spec', 'prompt_message_id': message.message_id}
+        prompt_text = f"{list_text}\n\n{messages.BULK_ACCOUNTS_PROMPT.format(max_count=BULK_ACCOUNTS_MAX_COUNT)}"
+        _bot.edit_message_text(prompt_text, admin_id, message.message_id, parse_mode='Markdown',
+                               reply_markup=inline_keyboards.get_back_button("admin_server_management"))
+
+    def process_bulk_accounts(admin_id, message):
+        parts = (message.text or '').split()
+        if (len(parts) != 4 or not parts[0].isdigit() or not parts[1].isdigit() or not parts[3].isdigit()
+                or not helpers.is_float_or_int(parts[2]) or not 0 < int(parts[1]) <= BULK_ACCOUNTS_MAX_COUNT):
+            _bot.send_message(admin_id, f"{messages.BULK_ACCOUNTS_INVALID}\n\n{messages.BULK_ACCOUNTS_PROMPT.format(max_count=BULK_ACCOUNTS_MAX_COUNT)}", parse_mode='Markdown'); return
+        server = _db_manager.get_server_by_id(int(parts[0]))
+        if not server:
+            _bot.send_message(admin_id, messages.SERVER_NOT_FOUND); return
+        _clear_admin_state(admin_id)
+        count, volume_gb, duration_days = int(parts[1]), float(parts[2]), int(parts[3])
+        _bot.send_message(admin_id, messages.BULK_ACCOUNTS_IN_PROGRESS.format(count=count, server_name=server['name']))
+        # برای هر اینباند فقط یک درخواست addClient با همه اکانت‌ها ارسال می‌شود
+        results = _config_generator.create_bulk_clients(server['id'], count, volume_gb, duration_days or None, user_telegram_id=admin_id)
+        links = [r['subscription_link'] for r in results if r['success']]
+        if not links:
+            _bot.send_message(admin_id, messages.OPERATION_FAILED)
+        else:
+            content = ("\n".join(links) + "\n").encode('utf-8')
+            filename = f"bulk_accounts_s{server['id']}_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.txt"
+            media_cache.send_document(_bot, admin_id, content, filename,
+                                      caption=messages.BULK_ACCOUNTS_RESULT.format(succeeded=len(links), count=count))
+        _show_server_management_menu(admin_id)
+
+    def start_search_user_flow(admin_id, message):
+        _clear_admin_state(admin_id)
+        _admin_states[admin_id] = {'state': 'waiting_for_user_search_query', 'prompt_message_id': message.message_id}
+        _bot.edit_message_text(messages.SEARCH_USER_PROMPT, admin_id, message.message_id, parse_mode='Markdown',
+                               reply_markup=inline_keyboards.get_back_button("admin_user_management"))
+
+    def process_user_search(admin_id, message):
+        state_info = _admin_states.get(admin_id, {})
+        query = (message.text or '').strip()
+        prompt_id = state_info.get('prompt_message_id')
+        try: _bot.delete_message(admin_id, message.message_id)
+        except Exception: pass
+        if not query:
+            return
+        users = _db_manager.search_users(query, limit=ADMIN_USERS_PAGE_SIZE)
+        text = messages.SEARCH_USER_RESULTS_HEADER.format(query=helpers.escape_markdown_v1(query))
+        text += "".join(_format_user_line(user) for user in users) if users else messages.SEARCH_USER_NO_RESULTS
+        # وضعیت حفظ می‌شود تا ادمین بتواند بلافاصله عبارت دیگری جستجو کند
+        text += f"\n\n{messages.SEARCH_USER_PROMPT}"
+        try:
+            _bot.edit_message_text(text, admin_id, prompt_id, parse_mode='Markdown',
+                                   reply_markup=inline_keyboards.get_back_button("admin_user_management"))
+        except telebot.apihelper.ApiTelegramException as e:
+            # جستجوی دوباره همان عبارت، متن پیام را تغییر نمی‌دهد
+            if 'message is not modified' not in e.description:
+                logger.warning(f"Error showing user search results for {admin_id}: {e}")
+
     def start_add_plan_flow(admin_id, message):
         _clear_admin_state(admin_id)
         _admin_states[admin_id] = {'state': 'waiting_for_plan_name', 'data': {}, 'prompt_message_id': message.message_id}
@@ -330,6 +481,7 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
             "admin_user_management": _show_user_management_menu,
             "admin_add_server": start_add_server_flow,
             "admin_delete_server": start_delete_server_flow,
+            "admin_bulk_accounts": start_bulk_accounts_flow,
             "admin_add_plan": start_add_plan_flow,
             "admin_toggle_plan_status": start_toggle_plan_status_flow,
             "admin_add_gateway": start_add_gateway_flow,
@@ -339,7 +491,10 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
             "admin_list_plans": list_plans_action,
             "admin_list_gateways": list_gateways_action,
             "admin_list_users": list_all_users,
+            "admin_search_user": start_search_user_flow,
             "admin_manage_inbounds": start_manage_inbounds_flow,
+            "admin_broadcast": start_broadcast_flow,
+            "admin_dashboard": show_dashboard,
         }
         
         if data in actions:
@@ -360,6 +515,12 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
             process_payment_approval(admin_id, int(data.split('_')[-1]), message)
         elif data.startswith("admin_reject_payment_"):
             process_payment_rejection(admin_id, int(data.split('_')[-1]), message)
+        elif data == "admin_confirm_broadcast":
+            execute_broadcast(admin_id, message)
+        elif data.startswith("admin_users_older_"):
+            list_all_users(admin_id, message, before_id=int(data.split('_')[-1]))
+        elif data.startswith("admin_users_newer_"):
+            list_all_users(admin_id, message, after_id=int(data.split('_')[-1]))
         else:
             _bot.edit_message_text(messages.UNDER_CONSTRUCTION, admin_id, message.message_id, reply_markup=inline_keyboards.get_back_button("admin_main_menu"))
     @_bot.message_handler(func=lambda msg: helpers.is_admin(msg.from_user.id) and _admin_states.get(msg.from_user.id))
@@ -478,8 +639,8 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
             _bot.edit_message_text(f"{messages.SERVER_NOT_FOUND}\n\n{messages.SELECT_SERVER_FOR_INBOUNDS_PROMPT}", admin_id, prompt_id, parse_mode='Markdown'); return
         server_id = int(server_id_str)
         _bot.edit_message_text(messages.FETCHING_INBOUNDS, admin_id, prompt_id)
-        temp_xui_client = _xui_api(panel_url=server_data['panel_url'], username=server_data['username'], password=server_data['password'])
-        panel_inbounds = temp_xui_client.list_inbounds()
+        temp_xui_client = _config_generator.client_registry.get_client(server_data)
+        panel_inbounds = temp_xui_client.list_inbounds() if temp_xui_client else []
         if not panel_inbounds:
             _bot.edit_message_text(messages.NO_INBOUNDS_FOUND_ON_PANEL, admin_id, prompt_id, reply_markup=inline_keyboards.get_back_button("admin_server_management"))
             _clear_admin_state(admin_id); return
@@ -547,10 +708,11 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
                 logger.warning(f"Error updating inbound selection keyboard: {e}")
 
     def process_payment_approval(admin_id, payment_id, message):
-            _bot.edit_message_caption("⏳ در حال ساخت سرویس...", message.chat.id, message.message_id)
             payment = _db_manager.get_payment_by_id(payment_id)
-            if not payment or payment['is_confirmed']:
+            # فقط یک تایید (حتی با چند بار زدن دکمه یا چند ادمین همزمان) اجازه ساخت سرویس را می‌گیرد
+            if not payment or payment['is_confirmed'] or not _db_manager.claim_payment_provisioning(payment_id, PAYMENT_CLAIM_LEASE_SECONDS):
                 _bot.answer_callback_query(message.id, "این پرداخت قبلاً پردازش شده است.", show_alert=True); return
+            _bot.edit_message_caption("⏳ در حال ساخت سرویس...", message.chat.id, message.message_id)
             order_details = json.loads(payment['order_details_json'])
             user_telegram_id = order_details['user_telegram_id']
             user_db_id = order_details['user_db_id']
@@ -568,6 +730,7 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
                 
             client_details, sub_link, single_configs = _config_generator.create_client_and_configs(user_telegram_id, order_details['server_id'], total_gb, duration_days)
             if not client_details:
+                _db_manager.release_payment_claim(payment_id)
                 _bot.edit_message_caption("❌ خطا در ساخت سرویس در پنل X-UI.", message.chat.id, message.message_id); return
             
             expire_date = (datetime.datetime.now() + datetime.timedelta(days=duration_days)) if duration_days and duration_days > 0 else None
@@ -578,9 +741,13 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
                 client_details['subscription_id'], single_configs
             )
             if not purchase_id:
+                # کلاینت ساخته شده حذف می‌شود تا تایید بعدی سرویس دوم نسازد
+                _config_generator.delete_created_clients(order_details['server_id'], client_details)
+                _db_manager.release_payment_claim(payment_id)
                 _bot.edit_message_caption("❌ خطا در ذخیره خرید در دیتابیس.", message.chat.id, message.message_id); return
                 
             _db_manager.update_payment_status(payment_id, True, admin_id)
+            _db_manager.complete_payment_provisioning(payment_id)
             admin_user = _bot.get_chat_member(admin_id, admin_id).user
             new_caption = message.caption + "\n\n" + messages.ADMIN_PAYMENT_CONFIRMED_DISPLAY.format(admin_username=f"@{admin_user.username}" if admin_user.username else admin_user.first_name)
             _bot.edit_message_caption(new_caption, message.chat.id, message.message_id, parse_mode='Markdown')
@@ -595,7 +762,8 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
 
     def process_payment_rejection(admin_id, payment_id, message):
         payment = _db_manager.get_payment_by_id(payment_id)
-        if not payment or payment['is_confirmed']:
+        # رد کردن از همان رزرو اتمیک تایید استفاده می‌کند تا با تایید همزمان ادمین دیگر تداخل نکند
+        if not payment or payment['is_confirmed'] or not _db_manager.claim_payment_rejection(payment_id):
             _bot.answer_callback_query(message.id, "این پرداخت قبلاً پردازش شده است.", show_alert=True); return
         _db_manager.update_payment_status(payment_id, False, admin_id)
         admin_user = _bot.get_chat_member(admin_id, admin_id).user
@@ -617,6 +785,8 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         
         # ابتدا اطلاعات در دیتابیس ذخیره می‌شود
         if _db_manager.update_server_inbounds(server_id, inbounds_to_save):
+            # کش اینباندها با آخرین اطلاعات دریافتی از پنل به‌روز می‌شود
+            inbound_cache.store(server_id, panel_inbounds)
             msg = messages.INBOUND_CONFIG_SUCCESS
         else:
             msg = messages.INBOUND_CONFIG_FAILED
@@ -663,8 +833,8 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         server_id = int(server_id_str)
         _bot.edit_message_text(messages.FETCHING_INBOUNDS, admin_id, prompt_id)
         
-        temp_xui_client = _xui_api(panel_url=server_data['panel_url'], username=server_data['username'], password=server_data['password'])
-        panel_inbounds = temp_xui_client.list_inbounds()
+        temp_xui_client = _config_generator.client_registry.get_client(server_data)
+        panel_inbounds = temp_xui_client.list_inbounds() if temp_xui_client else []
 
         if not panel_inbounds:
             _bot.edit_message_text(messages.NO_INBOUNDS_FOUND_ON_PANEL, admin_id, prompt_id, reply_markup=inline_keyboards.get_back_button("admin_server_management"))
@@ -686,7 +856,12 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         panel_inbounds = _admin_states.get(admin_id, {}).get('data', {}).get('panel_inbounds', [])
         inbounds_to_save = [{'id': p_in['id'], 'remark': p_in.get('remark', '')} for p_in in panel_inbounds if p_in['id'] in selected_ids]
         
-        msg = messages.INBOUND_CONFIG_SUCCESS if _db_manager.update_server_inbounds(server_id, inbounds_to_save) else messages.INBOUND_CONFIG_FAILED
+        if _db_manager.update_server_inbounds(server_id, inbounds_to_save):
+            # کش اینباندها با آخرین اطلاعات دریافتی از پنل به‌روز می‌شود
+            inbound_cache.store(server_id, panel_inbounds)
+            msg = messages.INBOUND_CONFIG_SUCCESS
+        else:
+            msg = messages.INBOUND_CONFIG_FAILED
         _bot.edit_message_text(msg.format(server_name=server_data['name']), admin_id, message.message_id, reply_markup=inline_keyboards.get_back_button("admin_server_management"))
             
         _clear_admin_state(admin_id)
@@ -739,24 +914,14 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
     def create_backup(admin_id, message):
         """از فایل‌های حیاتی ربات (دیتابیس و .env) بکاپ گرفته و برای ادمین ارسال می‌کند."""
         _bot.edit_message_text("⏳ در حال ساخت فایل پشتیبان...", admin_id, message.message_id)
-        
-        backup_filename = f"alamor_backup_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip"
-        
-        files_to_backup = [
-            os.path.join(os.getcwd(), '.env'),
-            _db_manager.db_path
-        ]
-        
         try:
-            with zipfile.ZipFile(backup_filename, 'w') as zipf:
-                for file_path in files_to_backup:
-                    if os.path.exists(file_path):
-                        zipf.write(file_path, os.path.basename(file_path))
-                    else:
-                        logger.warning(f"فایل بکاپ یافت نشد: {file_path}")
-
-            with open(backup_filename, 'rb') as backup_file:
-                _bot.send_document(admin_id, backup_file, caption="✅ فایل پشتیبان شما آماده است.")
+            # کپی سازگار دیتابیس با backup API و فشرده‌سازی در حافظه؛ فایلی در پوشه کاری ساخته نمی‌شود
+            archive, _ = create_backup_archive(db_path=_db_manager.db_path)
+            with archive:
+                backup_content = archive.read()
+            # اگر محتوا از آخرین بکاپ تغییر نکرده باشد، فایل آپلود نمی‌شود و همان file_id ارسال می‌شود
+            media_cache.send_document(_bot, admin_id, backup_content, backup_filename(),
+                                      caption="✅ فایل پشتیبان شما آماده است.")
             
             _bot.delete_message(admin_id, message.message_id)
             _show_admin_main_menu(admin_id)
@@ -764,10 +929,6 @@ def register_admin_handlers(bot_instance, db_manager_instance, xui_api_instance)
         except Exception as e:
             logger.error(f"خطا در ساخت بکاپ: {e}")
             _bot.edit_message_text("❌ در ساخت فایل پشتیبان خطایی رخ داد.", admin_id, message.message_id)
-        finally:
-            # پاک کردن فایل زیپ پس از ارسال
-            if os.path.exists(backup_filename):
-                os.remove(backup_filename)
                 
                 
     def handle_gateway_type_selection(admin_id, message, gateway_type):
@@ -2,8 +2,7 @@ import telebot
 from telebot import types
 import logging
 import json
-import qrcode
-from io import BytesIO
+import datetime
 import requests
 from config import SUPPORT_CHANNEL_LINK, ADMIN_IDS
 from database.db_manager import DatabaseManager
@@ -14,6 +13,10 @@ from utils.config_generator import ConfigGenerator
 from utils.helpers import is_float_or_int , escape_markdown_v1
 from utils.bot_helpers import send_subscription_info # این ایمپورت جدید است
 from config import ZARINPAL_MERCHANT_ID, WEBHOOK_DOMAIN , ZARINPAL_SANDBOX
+from utils.state_store import create_state_store
+from api_client.zarinpal_client import get_zarinpal_client
+from utils.qr_renderer import qr_renderer
+from utils.health_checker import get_health_checker
 
 logger = logging.getLogger(__name__)
 
@@ -29,13 +32,14 @@ _user_states = {} # {user_id: {'state': '...', 'data': {...}}}
 
 
 
-ZARINPAL_API_URL = "https://api.zarinpal.com/pg/v4/payment/request.json"
-ZARINPAL_STARTPAY_URL = "https://www.zarinpal.com/pg/StartPay/"
 
 def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
-    global _bot, _db_manager, _xui_api, _config_generator
+    global _bot, _db_manager, _xui_api, _config_generator, _user_states, _user_menu_message_ids
     _bot = bot_instance
     _db_manager = db_manager_instance
+    # وضعیت‌ها در ذخیره‌ساز مشترک نگه داشته می‌شوند (حافظه یا دیتابیس، بر اساس STATE_STORE_BACKEND)
+    _user_states = create_state_store('user', db_manager_instance)
+    _user_menu_message_ids = create_state_store('user_menu', db_manager_instance)
     _xui_api = xui_api_instance
     _config_generator = ConfigGenerator(_xui_api, _db_manager)
 
@@ -122,8 +126,7 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
 
     # --- توابع کمکی و اصلی ---
     def _clear_user_state(user_id):
-        if user_id in _user_states:
-            del _user_states[user_id]
+        _user_states.pop(user_id, None)
         _bot.clear_step_handler_by_chat_id(chat_id=user_id)
 
     def _show_user_main_menu(user_id, message_to_edit=None):
@@ -140,7 +143,9 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
 
     # --- فرآیند خرید ---
     def start_purchase(user_id, message):
-        active_servers = [s for s in _db_manager.get_all_servers() if s['is_active'] and s['is_online']]
+        # وضعیت سرورها از آخرین تست سلامت (دوره‌ای در پس‌زمینه) خوانده می‌شود
+        health_checker = get_health_checker(_db_manager)
+        active_servers = [s for s in _db_manager.get_all_servers() if s['is_active'] and health_checker.is_online(s)]
         if not active_servers:
             _bot.edit_message_text(messages.NO_ACTIVE_SERVERS_FOR_BUY, user_id, message.message_id, reply_markup=inline_keyboards.get_back_button("user_main_menu"))
             return
@@ -268,23 +273,12 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
                 return
 
             callback_url = f"https://{WEBHOOK_DOMAIN}/zarinpal/verify"
-            
-            payload = {
-                "merchant_id": gateway['merchant_id'],
-                "amount": amount_toman * 10, # FIX: تبدیل تومان به ریال
-                "callback_url": callback_url,
-                "description": f"خرید سرویس از ربات - سفارش شماره {payment_id}",
-                "metadata": {"user_id": str(user_id), "payment_id": str(payment_id)}
-            }
-            
-            try:
-                response = requests.post(ZARINPAL_API_URL, json=payload, timeout=20)
-                response.raise_for_status()
-                result = response.json()
+            zarinpal = get_zarinpal_client()
 
+            def on_payment_requested(result):
                 if result.get("data") and result.get("data", {}).get("code") == 100:
                     authority = result['data']['authority']
-                    payment_url = f"{ZARINPAL_STARTPAY_URL}{authority}"
+                    payment_url = zarinpal.get_payment_url(authority)
                     _db_manager.set_payment_authority(payment_id, authority)
                     
                     # FIX: ساخت صحیح کیبورد با دو دکمه مجزا
@@ -301,12 +295,24 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
                     error_message = result.get("errors", {}).get("message", "خطای نامشخص از درگاه پرداخت")
                     _bot.edit_message_text(f"❌ خطا در ساخت لینک پرداخت: {error_message} (کد: {error_code})", user_id, message.message_id)
 
-            except requests.exceptions.HTTPError as http_err:
-                logger.error(f"HTTP error occurred: {http_err} - Response: {http_err.response.text}")
-                _bot.edit_message_text("❌ درگاه پرداخت با خطای داخلی مواجه شد. لطفاً بعداً تلاش کنید.", user_id, message.message_id)
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Error connecting to Zarinpal: {e}")
-                _bot.edit_message_text("❌ امکان اتصال به درگاه پرداخت در حال حاضر وجود ندارد.", user_id, message.message_id)
+            def on_payment_request_failed(error):
+                if isinstance(error, requests.exceptions.HTTPError):
+                    logger.error(f"HTTP error occurred: {error} - Response: {error.response.text}")
+                    _bot.edit_message_text("❌ درگاه پرداخت با خطای داخلی مواجه شد. لطفاً بعداً تلاش کنید.", user_id, message.message_id)
+                else:
+                    logger.error(f"Error connecting to Zarinpal: {error}")
+                    _bot.edit_message_text("❌ امکان اتصال به درگاه پرداخت در حال حاضر وجود ندارد.", user_id, message.message_id)
+
+            # درخواست به صورت غیرهمزمان ارسال می‌شود تا thread هندلر منتظر پاسخ درگاه نماند
+            zarinpal.request_payment_async(
+                merchant_id=gateway['merchant_id'],
+                amount_rial=amount_toman * 10, # FIX: تبدیل تومان به ریال
+                callback_url=callback_url,
+                description=f"خرید سرویس از ربات - سفارش شماره {payment_id}",
+                metadata={"user_id": str(user_id), "payment_id": str(payment_id)},
+                on_success=on_payment_requested,
+                on_error=on_payment_request_failed,
+            )
 
         # --- منطق برای کارت به کارت ---
         elif gateway['type'] == 'card_to_card':
@@ -428,6 +434,16 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
             # فراخوانی escape_markdown_v1 از اینجا نیز حذف شد
             text = messages.CONFIG_DELIVERY_HEADER + \
                 messages.CONFIG_DELIVERY_SUB_LINK.format(sub_link=sub_link)
+
+            # مصرف از جدول محلی خوانده می‌شود (همگام‌سازی دوره‌ای usage_sync)، بدون تماس با پنل
+            usage = _db_manager.get_purchase_usage(purchase)
+            if usage:
+                used_gb = (usage['up_bytes'] + usage['down_bytes']) / (1024 ** 3)
+                synced_at = datetime.datetime.fromtimestamp(usage['synced_at']).strftime("%Y-%m-%d %H:%M")
+                if purchase['initial_volume_gb']:
+                    text += messages.SERVICE_USAGE_DETAILS.format(used_gb=used_gb, total_gb=purchase['initial_volume_gb'], synced_at=synced_at)
+                else:
+                    text += messages.SERVICE_USAGE_UNLIMITED.format(used_gb=used_gb, synced_at=synced_at)
             
             # ساخت کیبورد با دکمه‌های بازگشت و دریافت کانفیگ تکی
             markup = types.InlineKeyboardMarkup()
@@ -440,14 +456,7 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
             
             # ارسال QR کد به صورت یک پیام جدید
             try:
-                import qrcode
-                from io import BytesIO
-                qr_image = qrcode.make(sub_link)
-                bio = BytesIO()
-                bio.name = 'qrcode.jpeg'
-                qr_image.save(bio, 'JPEG')
-                bio.seek(0)
-                _bot.send_photo(user_id, bio, caption=messages.QR_CODE_CAPTION)
+                qr_renderer.send_qr(_bot, user_id, sub_link, caption=messages.QR_CODE_CAPTION)
             except Exception as e:
                 logger.error(f"Failed to generate or send QR code in service details: {e}")
         else:
@@ -526,7 +535,9 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
         if _db_manager.check_free_test_usage(user_db_info['id']):
             _bot.edit_message_text(messages.FREE_TEST_ALREADY_USED, user_id, message.message_id, reply_markup=inline_keyboards.get_back_button("user_main_menu")); return
 
-        active_servers = [s for s in _db_manager.get_all_servers() if s['is_active'] and s['is_online']]
+        # وضعیت سرورها از آخرین تست سلامت (دوره‌ای در پس‌زمینه) خوانده می‌شود
+        health_checker = get_health_checker(_db_manager)
+        active_servers = [s for s in _db_manager.get_all_servers() if s['is_active'] and health_checker.is_online(s)]
         if not active_servers:
             _bot.edit_message_text(messages.NO_ACTIVE_SERVERS_FOR_BUY, user_id, message.message_id); return
         
@@ -544,27 +555,10 @@ def register_user_handlers(bot_instance, db_manager_instance, xui_api_instance):
             _db_manager.record_free_test_usage(user_db_info['id'])
             _bot.delete_message(user_id, message.message_id)
             _bot.send_message(user_id, messages.GET_FREE_TEST_SUCCESS)
-            send_subscription_info(user_id, sub_link)
+            send_subscription_info(_bot, user_id, sub_link)
         else:
             _bot.edit_message_text(messages.OPERATION_FAILED, user_id, message.message_id)
 
-    # تابع جدید برای ارسال لینک و QR کد
-    def send_subscription_info(user_id, sub_link):
-        _bot.send_message(user_id, messages.CONFIG_DELIVERY_HEADER, parse_mode='Markdown')
-        
-        # Create QR Code in memory
-        qr_image = qrcode.make(sub_link)
-        bio = BytesIO()
-        bio.name = 'qrcode.jpeg'
-        qr_image.save(bio, 'JPEG')
-        bio.seek(0)
-
-        # Send QR Code
-        _bot.send_photo(user_id, bio, caption=messages.QR_CODE_CAPTION)
-        
-        # Send Subscription Link
-        _bot.send_message(user_id, messages.CONFIG_DELIVERY_SUB_LINK.format(sub_link=sub_link), parse_mode='Markdown')
-
     def show_my_services_list(user_id, message):
         user_db_info = _db_manager.get_user_by_telegram_id(user_id)
         if not user_db_info:
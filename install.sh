@@ -33,6 +33,13 @@ check_root() {
 
 # --- Main Logic Functions ---
 setup_database() {
+    # SQLite is the default engine; PostgreSQL is an opt-in (DB_ENGINE="postgres" in .env)
+    read -p "$(echo -e ${YELLOW}"Use PostgreSQL instead of the default SQLite database? (y/N): "${NC})" use_postgres
+    if [[ "$use_postgres" != "y" ]]; then
+        print_success "Using the default SQLite database. To switch later, create a PostgreSQL database and set DB_ENGINE=\"postgres\" and the DB_* values in .env."
+        return
+    fi
+
     print_info "--- Starting PostgreSQL Database Setup ---"
     read -p "$(echo -e ${YELLOW}"Please enter a name for the new database (e.g., alamor_db): "${NC})" db_name
     read -p "$(echo -e ${YELLOW}"Please enter a username for the database (e.g., alamor_user): "${NC})" db_user
@@ -42,9 +49,12 @@ setup_database() {
     sudo -u postgres psql -c "CREATE DATABASE $db_name;"
     sudo -u postgres psql -c "CREATE USER $db_user WITH PASSWORD '$db_password';"
     sudo -u postgres psql -c "GRANT ALL PRIVILEGES ON DATABASE $db_name TO $db_user;"
+    # From PostgreSQL 15 on, CREATE on the public schema requires owning the database
+    sudo -u postgres psql -c "ALTER DATABASE $db_name OWNER TO $db_user;"
     
     # Save credentials to the .env file
     echo -e "\n# --- PostgreSQL Database Settings ---" >> .env
+    echo "DB_ENGINE=\"postgres\"" >> .env
     echo "DB_NAME=\"$db_name\"" >> .env
     echo "DB_USER=\"$db_user\"" >> .env
     echo "DB_PASSWORD=\"$db_password\"" >> .env
@@ -89,7 +99,7 @@ install_bot() {
     print_info "Step 4: Configuring main bot variables..."
     setup_env_file
     
-    print_info "Step 5: Configuring PostgreSQL Database..."
+    print_info "Step 5: Configuring the database..."
     setup_database
 
     print_info "Step 6: Configuring domain and payment gateway..."
@@ -176,6 +186,11 @@ server {
     ssl_certificate_key /etc/letsencrypt/live/$payment_domain/privkey.pem;
     include /etc/letsencrypt/options-ssl-nginx.conf;
     ssl_dhparam /etc/letsencrypt/ssl-dhparams.pem;
+    location /telegram/ {
+        proxy_pass http://127.0.0.1:8081;
+        proxy_set_header Host \$host;
+        proxy_set_header X-Real-IP \$remote_addr;
+    }
     location / {
         proxy_pass http://127.0.0.1:8080;
         proxy_set_header Host \$host;
@@ -188,6 +203,9 @@ EOL
     
     echo -e "\n# Webhook Settings" >> .env
     echo "WEBHOOK_DOMAIN=\"$payment_domain\"" >> .env
+    # Secret for optional Telegram webhook mode (enable with TELEGRAM_WEBHOOK_ENABLED="True")
+    echo "TELEGRAM_WEBHOOK_ENABLED=\"False\"" >> .env
+    echo "TELEGRAM_WEBHOOK_SECRET=\"$(openssl rand -hex 32)\"" >> .env
     print_success "Payment domain saved to .env file."
 }
 setup_services() {
@@ -282,13 +300,13 @@ remove_bot() {
 
 create_backup() {
     print_info "Creating backup file..."
-    BACKUP_NAME="alamor_backup_$(date +%Y-%m-%d_%H-%M).zip"
-    DB_PATH=$(grep "DATABASE_NAME_ALAMOR" .env | cut -d '=' -f2 | tr -d '"')
-    if [ -f ".env" ] && [ -f "$DB_PATH" ]; then
-        zip "$BACKUP_NAME" .env "$DB_PATH"
-        print_success "Backup file created as $BACKUP_NAME in the current directory."
+    # Consistent online copy of the live database (same code as the bot's backup button)
+    PYTHON_EXEC="python3"
+    if [ -x ".venv/bin/python3" ]; then PYTHON_EXEC=".venv/bin/python3"; fi
+    if "$PYTHON_EXEC" -m utils.backup "$(pwd)"; then
+        print_success "Backup file created in the current directory."
     else
-        print_error "Could not find .env or database file to backup."
+        print_error "Could not create the backup."
     fi
 }
 
@@ -15,6 +15,7 @@ def get_admin_main_inline_menu():
         types.InlineKeyboardButton("💳 مدیریت درگاه‌ها", callback_data="admin_payment_management"),
         types.InlineKeyboardButton("👥 مدیریت کاربران", callback_data="admin_user_management"),
         types.InlineKeyboardButton("📊 داشبورد", callback_data="admin_dashboard"),
+        types.InlineKeyboardButton("📢 پیام همگانی", callback_data="admin_broadcast"),
         types.InlineKeyboardButton("🗄 تهیه نسخه پشتیبان", callback_data="admin_create_backup")
     )
     return markup
@@ -27,6 +28,7 @@ def get_server_management_inline_menu():
         types.InlineKeyboardButton("🔌 مدیریت Inboundها", callback_data="admin_manage_inbounds"),
         types.InlineKeyboardButton("🔄 تست اتصال سرورها", callback_data="admin_test_all_servers"),
         types.InlineKeyboardButton("❌ حذف سرور", callback_data="admin_delete_server"),
+        types.InlineKeyboardButton("👥 ساخت گروهی اکانت", callback_data="admin_bulk_accounts"),
         types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_main_menu")
     )
     return markup
@@ -60,6 +62,19 @@ def get_user_management_inline_menu():
     )
     return markup
 
+def get_users_page_menu(newer_cursor=None, older_cursor=None):
+    """دکمه‌های صفحه‌بندی لیست کاربران؛ cursor همان id اولین/آخرین کاربر صفحه فعلی است."""
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    nav_buttons = []
+    if newer_cursor is not None:
+        nav_buttons.append(types.InlineKeyboardButton("◀️ قبلی", callback_data=f"admin_users_newer_{newer_cursor}"))
+    if older_cursor is not None:
+        nav_buttons.append(types.InlineKeyboardButton("بعدی ▶️", callback_data=f"admin_users_older_{older_cursor}"))
+    if nav_buttons:
+        markup.add(*nav_buttons)
+    markup.add(types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_user_management"))
+    return markup
+
 def get_plan_type_selection_menu_admin():
     markup = types.InlineKeyboardMarkup(row_width=2)
     markup.add(
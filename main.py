@@ -3,6 +3,7 @@
 import telebot
 import logging
 import os
+import sys
 
 # --- تنظیمات لاگ (تغییر در این بخش) ---
 logging.basicConfig(
@@ -17,11 +18,25 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # --- ایمپورت ماژول‌های پروژه ---
-from config import BOT_TOKEN, ADMIN_IDS, REQUIRED_CHANNEL_ID, REQUIRED_CHANNEL_LINK
+from config import (
+    BOT_TOKEN, ADMIN_IDS, REQUIRED_CHANNEL_ID, REQUIRED_CHANNEL_LINK,
+    WEBHOOK_DOMAIN, TELEGRAM_WEBHOOK_ENABLED, TELEGRAM_WEBHOOK_SECRET, TELEGRAM_WEBHOOK_PORT,
+    MEMBERSHIP_TRACK_UPDATES,
+)
 from database.db_manager import DatabaseManager
 from api_client.xui_api_client import XuiAPIClient
 from handlers import admin_handlers, user_handlers
 from utils import messages, helpers
+from utils.update_dispatcher import DispatchingTeleBot
+from utils.state_store import flush_state_stores
+from utils.webhook_ingest import UpdateQueue, create_webhook_blueprint, offline_request_sender, replay_updates
+from utils.media_cache import media_cache
+from utils.health_checker import get_health_checker
+from utils.usage_sync import UsageSync
+from utils.expiry_scheduler import ExpiryScheduler
+from utils.broadcast import get_broadcast_engine
+from utils.activity_buffer import ActivityBuffer
+from utils.backup import BackupScheduler
 from keyboards import inline_keyboards
 
 # --- نمونه‌سازی (Instantiation) ---
@@ -29,8 +44,12 @@ if not BOT_TOKEN:
     logger.critical("BOT_TOKEN is not set in the environment variables. Exiting.")
     exit()
 
-bot = telebot.TeleBot(BOT_TOKEN)
+# آپدیت‌ها توسط dispatcher به صورت موازی بین کاربران و ترتیبی برای هر کاربر پردازش می‌شوند
+bot = DispatchingTeleBot(BOT_TOKEN)
 db_manager = DatabaseManager()
+# file_idهای فایل‌های آپلود شده (QR کد، بکاپ) در دیتابیس ماندگار می‌شوند
+media_cache.attach(db_manager)
+activity_buffer = ActivityBuffer(db_manager)
 # نمونه‌سازی XuiAPIClient اینجا لازم نیست چون در هر فانکشن به صورت موقت ساخته می‌شود
 
 # --- هندلر دستور /start ---
@@ -40,8 +59,8 @@ def send_welcome(message):
     first_name = message.from_user.first_name
     logger.info(f"Received /start from user ID: {user_id} ({first_name})")
 
-    # ذخیره/به‌روزرسانی کاربر در دیتابیس
-    db_manager.add_or_update_user(
+    # ذخیره/به‌روزرسانی کاربر در دیتابیس (کاربر جدید فوراً، بقیه به صورت دسته‌ای)
+    activity_buffer.record(
         telegram_id=user_id,
         first_name=first_name,
         last_name=message.from_user.last_name,
@@ -61,9 +80,45 @@ def send_welcome(message):
         welcome_text = messages.START_WELCOME.format(first_name=helpers.escape_markdown_v1(first_name))
         bot.send_message(user_id, welcome_text, parse_mode='Markdown', reply_markup=inline_keyboards.get_user_main_inline_menu())
 
+# --- به‌روزرسانی کش عضویت با ورود و خروج کاربران از کانال ---
+@bot.chat_member_handler(func=lambda update: update.chat.id == REQUIRED_CHANNEL_ID)
+def track_channel_membership(update):
+    member = update.new_chat_member
+    helpers.update_channel_membership(update.chat.id, member.user.id, member.status)
+
+# --- حالت‌های دریافت آپدیت ---
+TELEGRAM_WEBHOOK_PATH = "/telegram/webhook"
+# تلگرام آپدیت chat_member را فقط در صورت درخواست صریح ارسال می‌کند
+ALLOWED_UPDATES = telebot.util.update_types if (REQUIRED_CHANNEL_ID and MEMBERSHIP_TRACK_UPDATES) else None
+
+
+def run_webhook():
+    """آپدیت‌ها را از طریق وب‌هوک دریافت کرده و در صف محدود برای پردازش چند-threadی قرار می‌دهد."""
+    from flask import Flask
+
+    if not WEBHOOK_DOMAIN or not TELEGRAM_WEBHOOK_SECRET:
+        logger.critical("Webhook mode needs WEBHOOK_DOMAIN and TELEGRAM_WEBHOOK_SECRET in .env. Exiting.")
+        return
+    update_queue = UpdateQueue(bot.process_new_updates)
+    app = Flask(__name__)
+    app.register_blueprint(create_webhook_blueprint(update_queue, TELEGRAM_WEBHOOK_SECRET, TELEGRAM_WEBHOOK_PATH))
+
+    bot.remove_webhook()
+    bot.set_webhook(url=f"https://{WEBHOOK_DOMAIN}{TELEGRAM_WEBHOOK_PATH}", secret_token=TELEGRAM_WEBHOOK_SECRET,
+                    allowed_updates=ALLOWED_UPDATES)
+    logger.info(f"Bot is now receiving updates via webhook on port {TELEGRAM_WEBHOOK_PORT}...")
+    app.run(host='127.0.0.1', port=TELEGRAM_WEBHOOK_PORT, threaded=True)
+
+
+def run_replay(updates_path):
+    """آپدیت‌های ضبط شده را بدون تماس با تلگرام پردازش کرده و توان پردازش را گزارش می‌دهد."""
+    telebot.apihelper.CUSTOM_REQUEST_SENDER = offline_request_sender
+    count, elapsed = replay_updates(UpdateQueue(bot.process_new_updates), updates_path, drain=bot.dispatcher.join)
+    print(f"{count} updates in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.1f} updates/s)")
+
+
 # --- تابع اصلی ---
 def main():
-    bot.remove_webhook()
     logger.info("Bot is starting...")
 
     # ایجاد جداول دیتابیس در صورت عدم وجود
@@ -81,10 +136,36 @@ def main():
 
     user_handlers.register_user_handlers(bot, db_manager, XuiAPIClient)
     logger.info("User handlers registered.")
+    # وضعیت هر کاربر پس از پایان پردازش آپدیت او ذخیره می‌شود
+    bot.dispatcher.add_post_process_hook(lambda user_key, update: flush_state_stores(user_key))
 
+    # نوشتن دسته‌ای last_activity کاربران
+    activity_buffer.start()
+
+    # python main.py replay updates.jsonl
+    if len(sys.argv) == 3 and sys.argv[1] == "replay":
+        run_replay(sys.argv[2])
+        return
+
+    # تست دوره‌ای سلامت سرورها در پس‌زمینه
+    get_health_checker(db_manager).start()
+    # همگام‌سازی دوره‌ای مصرف ترافیک کلاینت‌ها از پنل‌ها
+    UsageSync(db_manager).start()
+    # غیرفعال‌سازی سرویس‌های منقضی یا تمام شده و هشدار قبل از انقضا
+    ExpiryScheduler(bot, db_manager).start()
+    # پیام‌های همگانی که با ری‌استارت نیمه‌کاره مانده‌اند ادامه می‌یابند
+    get_broadcast_engine(bot, db_manager).resume_unfinished()
+    # بکاپ دوره‌ای دیتابیس و تنظیمات با نگهداری نسخه‌های اخیر
+    BackupScheduler().start()
+
+    if TELEGRAM_WEBHOOK_ENABLED:
+        run_webhook()
+        return
+
+    bot.remove_webhook()
     logger.info("Bot is now polling for updates...")
-    bot.infinity_polling(logger_level=logging.WARNING) # برای جلوگیری از لاگ‌های زیاد خود کتابخانه
-    logger.info("Bot polling stopped.")
+    bot.infinity_polling(logger_level=logging.WARNING, allowed_updates=ALLOWED_UPDATES) # برای جلوگیری از لاگ‌های زیاد خود کتابخانه
+    logger.info(f"Bot polling stopped. Dispatcher metrics: {bot.dispatcher.get_metrics()}")
 
 @bot.message_handler(commands=['myid'])
 def send_user_id(message):
@@ -0,0 +1,106 @@
+# utils/activity_buffer.py
+
+import atexit
+import datetime
+import logging
+import threading
+
+from config import ACTIVITY_FLUSH_INTERVAL_SECONDS, ACTIVITY_FLUSH_MAX_PENDING
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityBuffer:
+    """
+    ثبت فعالیت کاربران (نام و last_activity) بدون یک commit برای هر /start.
+    کاربر جدید همچنان فوراً در جدول users ثبت می‌شود (تا جداول وابسته به users.id کار کنند)؛
+    برای کاربران موجود فقط آخرین مقدار هر telegram_id در حافظه نگه داشته و هر flush_interval ثانیه
+    یا با رسیدن به max_pending کاربر، همه در یک تراکنش executemany نوشته می‌شوند.
+    """
+
+    def __init__(self, db_manager, flush_interval=ACTIVITY_FLUSH_INTERVAL_SECONDS, max_pending=ACTIVITY_FLUSH_MAX_PENDING):
+        self.db_manager = db_manager
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}  # {telegram_id: (first_name, last_name, username, last_activity)}
+        self._known_ids = set()  # کاربرانی که وجودشان در دیتابیس قطعی است
+        self._lock = threading.Lock()
+        self._flush_now = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.recorded = 0
+        self.flushed_rows = 0
+        self.flushes = 0
+
+    def record(self, telegram_id, first_name, last_name=None, username=None):
+        """فعالیت کاربر را ثبت می‌کند؛ فقط برای کاربر جدید به دیتابیس نوشته می‌شود."""
+        with self._lock:
+            is_known = telegram_id in self._known_ids
+        if not is_known:
+            # خواندن از دیتابیس هزینه fsync ندارد؛ فقط کاربر واقعاً جدید همین‌جا insert می‌شود
+            if self.db_manager.get_user_by_telegram_id(telegram_id) is None:
+                if self.db_manager.add_or_update_user(telegram_id, first_name, last_name, username) is None:
+                    return
+                with self._lock:
+                    self._known_ids.add(telegram_id)
+                return
+            with self._lock:
+                self._known_ids.add(telegram_id)
+
+        # مانند CURRENT_TIMESTAMP در SQLite، زمان به UTC ذخیره می‌شود
+        now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            self._pending[telegram_id] = (first_name, last_name, username, now)
+            self.recorded += 1
+            if len(self._pending) >= self.max_pending:
+                self._flush_now.set()
+
+    def flush(self):
+        """همه فعالیت‌های در انتظار را در یک تراکنش می‌نویسد."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        rows = [(first, last, username, last_activity, telegram_id)
+                for telegram_id, (first, last, username, last_activity) in pending.items()]
+        if not self.db_manager.touch_users(rows):
+            # در صورت خطا، مقادیر به صف برمی‌گردند مگر اینکه مقدار جدیدتری ثبت شده باشد
+            with self._lock:
+                for telegram_id, values in pending.items():
+                    self._pending.setdefault(telegram_id, values)
+            return 0
+        with self._lock:
+            self.flushes += 1
+            self.flushed_rows += len(rows)
+        return len(rows)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run_forever, name="activity-flush", daemon=True)
+        self._thread.start()
+        # فعالیت‌های باقی‌مانده هنگام خروج عادی برنامه نوشته می‌شوند
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+        self._flush_now.set()
+        self.flush()
+
+    def _run_forever(self):
+        while not self._stop.is_set():
+            self._flush_now.wait(self.flush_interval)
+            self._flush_now.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Activity flush failed: {e}", exc_info=True)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'recorded': self.recorded,
+                'pending': len(self._pending),
+                'flushes': self.flushes,
+                'flushed_rows': self.flushed_rows,
+            }
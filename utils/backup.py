@@ -0,0 +1,195 @@
+# utils/backup.py
+
+import datetime
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+
+from config import (
+    DB_ENGINE, DATABASE_NAME, DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, BACKUP_DIR, BACKUP_INTERVAL_SECONDS, BACKUP_KEEP,
+    BACKUP_PAGES_PER_STEP, BACKUP_SPOOL_MAX_MB,
+)
+
+logger = logging.getLogger(__name__)
+
+ENV_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env')
+BACKUP_PREFIX = "alamor_backup_"
+# زمان ثابت برای ورودی‌های zip تا بکاپ محتوای یکسان، فایل یکسان بسازد (و file_id تلگرام دوباره استفاده شود)
+_ZIP_ENTRY_DATE = (1980, 1, 1, 0, 0, 0)
+_CHUNK_SIZE = 1024 * 1024
+
+
+def _snapshot_sqlite(db_path, pages_per_step):
+    """
+    یک نسخه سازگار از دیتابیس در حال استفاده با backup API خود sqlite تهیه می‌کند.
+    کپی در گام‌های pages_per_step صفحه‌ای انجام می‌شود و بین گام‌ها قفل آزاد است، پس نوشتن ربات متوقف نمی‌شود
+    (اگر در میانه کار دیتابیس تغییر کند، sqlite کپی را از نو شروع می‌کند؛ نتیجه هرگز نیمه‌کاره نیست).
+    کپی روی دیسک (پوشه موقت) ساخته می‌شود تا حجم دیتابیس در حافظه نگه داشته نشود؛ فایل باز شده برگردانده
+    و نام آن بلافاصله حذف می‌شود، پس با بسته شدن فایل فضای آن آزاد می‌شود.
+    """
+    fd, snapshot_path = tempfile.mkstemp(prefix=BACKUP_PREFIX, suffix=".db")
+    os.close(fd)
+    try:
+        source = sqlite3.connect(db_path, timeout=10)
+        target = sqlite3.connect(snapshot_path)
+        try:
+            source.backup(target, pages=pages_per_step)
+        finally:
+            target.close()
+            source.close()
+        return open(snapshot_path, 'rb')
+    finally:
+        os.remove(snapshot_path)
+
+
+def _dump_postgres():
+    """
+    خروجی pg_dump (SQL ساده) از دیتابیس postgres را در یک فایل موقت می‌نویسد و فایل باز شده را برمی‌گرداند.
+    اگر pg_dump نصب نباشد یا خطا بدهد RuntimeError ایجاد می‌شود تا بکاپ بدون دیتابیس موفق گزارش نشود.
+    """
+    dump = tempfile.TemporaryFile()
+    try:
+        result = subprocess.run(
+            ["pg_dump", "--no-owner", "--no-privileges", "-h", DB_HOST, "-p", str(DB_PORT), "-U", DB_USER, DB_NAME],
+            stdout=dump, stderr=subprocess.PIPE, env={**os.environ, "PGPASSWORD": DB_PASSWORD}, timeout=600,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        dump.close()
+        raise RuntimeError(f"pg_dump could not be run: {e}") from e
+    if result.returncode != 0:
+        dump.close()
+        raise RuntimeError(f"pg_dump failed: {result.stderr.decode(errors='replace').strip()}")
+    dump.seek(0)
+    return dump
+
+
+def create_backup_archive(db_path=DATABASE_NAME, env_path=ENV_PATH, pages_per_step=BACKUP_PAGES_PER_STEP):
+    """
+    بکاپ zip (فشرده) از دیتابیس و فایل .env در یک بافر spooled (تا BACKUP_SPOOL_MAX_MB در حافظه) می‌سازد.
+    (بافر آماده خواندن، هش sha256 محتوای بکاپ) برمی‌گرداند؛ هش برای تشخیص بکاپ بدون تغییر است.
+    اگر از دیتابیس نتوان بکاپ گرفت exception ایجاد می‌شود (بکاپ بدون دیتابیس ساخته نمی‌شود).
+    """
+    digest = hashlib.sha256()
+    archive = tempfile.SpooledTemporaryFile(max_size=BACKUP_SPOOL_MAX_MB * 1024 * 1024)
+    try:
+        with zipfile.ZipFile(archive, 'w', compression=zipfile.ZIP_DEFLATED) as zipf:
+            if DB_ENGINE == "postgres":
+                entries = [(f"{DB_NAME}.sql", _dump_postgres)]
+            elif os.path.exists(db_path):
+                entries = [(os.path.basename(db_path), lambda: _snapshot_sqlite(db_path, pages_per_step))]
+            else:
+                raise FileNotFoundError(f"Database file not found: {db_path}")
+            if os.path.exists(env_path):
+                entries.append((os.path.basename(env_path), lambda: open(env_path, 'rb')))
+            else:
+                logger.warning(f"Backup file not found: {env_path}")
+
+            for name, open_source in entries:
+                info = zipfile.ZipInfo(name, date_time=_ZIP_ENTRY_DATE)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                digest.update(name.encode())
+                with open_source() as source, zipf.open(info, 'w') as entry:
+                    while chunk := source.read(_CHUNK_SIZE):
+                        digest.update(chunk)
+                        entry.write(chunk)
+            zipf.comment = digest.hexdigest().encode()
+    except BaseException:
+        archive.close()
+        raise
+    archive.seek(0)
+    return archive, digest.hexdigest()
+
+
+def backup_filename(now=None):
+    return f"{BACKUP_PREFIX}{(now or datetime.datetime.now()).strftime('%Y-%m-%d_%H-%M-%S')}.zip"
+
+
+def _list_backups(backup_dir):
+    if not os.path.isdir(backup_dir):
+        return []
+    return sorted(os.path.join(backup_dir, name) for name in os.listdir(backup_dir)
+                  if name.startswith(BACKUP_PREFIX) and name.endswith(".zip"))
+
+
+def _archive_digest(path):
+    try:
+        with zipfile.ZipFile(path) as zipf:
+            return zipf.comment.decode() or None
+    except (OSError, zipfile.BadZipFile) as e:
+        logger.warning(f"Could not read backup {path}: {e}")
+        return None
+
+
+def write_backup(backup_dir=BACKUP_DIR, keep=BACKUP_KEEP, skip_unchanged=True):
+    """
+    یک بکاپ در backup_dir ذخیره می‌کند و فقط keep بکاپ آخر را نگه می‌دارد.
+    اگر skip_unchanged باشد و محتوا با آخرین بکاپ یکسان باشد، فایل جدیدی نوشته نمی‌شود.
+    مسیر بکاپ جدید یا None (بدون تغییر) برمی‌گرداند.
+    """
+    start = time.perf_counter()
+    archive, digest = create_backup_archive()
+    with archive:
+        existing = _list_backups(backup_dir)
+        if skip_unchanged and existing and _archive_digest(existing[-1]) == digest:
+            logger.info(f"Backup skipped, nothing changed since {os.path.basename(existing[-1])}.")
+            return None
+        os.makedirs(backup_dir, mode=0o700, exist_ok=True)
+        path = os.path.join(backup_dir, backup_filename())
+        # ابتدا در فایل موقت نوشته می‌شود تا بکاپ نیمه‌کاره هرگز با نام نهایی دیده نشود؛
+        # بکاپ شامل .env و اطلاعات کاربران است، پس فقط برای مالک قابل خواندن است
+        with os.fdopen(os.open(f"{path}.tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as output:
+            shutil.copyfileobj(archive, output, _CHUNK_SIZE)
+        os.replace(f"{path}.tmp", path)
+
+    for old in _list_backups(backup_dir)[:-keep] if keep > 0 else []:
+        os.remove(old)
+    logger.info(f"Backup written to {path} ({os.path.getsize(path) / 1024:.0f} KB) in {time.perf_counter() - start:.2f}s.")
+    return path
+
+
+class BackupScheduler:
+    """بکاپ دوره‌ای در BACKUP_DIR با نگهداری BACKUP_KEEP نسخه آخر؛ بکاپ بدون تغییر تکرار نمی‌شود."""
+
+    def __init__(self, interval=BACKUP_INTERVAL_SECONDS, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+        self.interval = interval
+        self.backup_dir = backup_dir
+        self.keep = keep
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run_forever, name="backup-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"Scheduled backups every {self.interval}s in {self.backup_dir} (keeping {self.keep}).")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run_forever(self):
+        while not self._stop.wait(self.interval):
+            try:
+                write_backup(self.backup_dir, self.keep)
+            except Exception as e:
+                logger.error(f"Scheduled backup failed: {e}", exc_info=True)
+
+
+if __name__ == "__main__":
+    # استفاده: python -m utils.backup [پوشه خروجی]  (install.sh backup همین را اجرا می‌کند)
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else os.getcwd()
+    try:
+        backup_path = write_backup(output_dir, keep=0, skip_unchanged=False)
+    except Exception as e:
+        sys.exit(f"Backup failed: {e}")
+    print(f"Backup created: {backup_path}")
@@ -0,0 +1,177 @@
+# utils/broadcast.py
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import BROADCAST_PAGE_SIZE, BROADCAST_WORKERS
+from utils import messages
+from utils.rate_limiter import RateLimitedSender, get_shared_sender
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastEngine:
+    """
+    ارسال پیام همگانی به همه کاربران.
+    کاربران صفحه به صفحه (keyset روی users.id) از دیتابیس خوانده می‌شوند، پیام‌ها با چند thread ولی
+    زیر سقف یک token bucket مشترک ارسال می‌شوند و پس از هر صفحه پیشرفت و خطاها (مثلاً ربات بلاک شده)
+    در جداول broadcasts و broadcast_failures ثبت می‌شود؛ پس از ری‌استارت ارسال از آخرین صفحه ثبت شده
+    ادامه می‌یابد (کاربران صفحه نیمه‌کاره ممکن است پیام را دوباره دریافت کنند).
+    """
+
+    def __init__(self, bot, db_manager, sender=None, page_size=BROADCAST_PAGE_SIZE, workers=BROADCAST_WORKERS,
+                 progress_interval=10):
+        self.bot = bot
+        self.db_manager = db_manager
+        self.sender = sender or get_shared_sender(bot)
+        self.page_size = page_size
+        self.workers = workers
+        self.progress_interval = progress_interval
+        self._cancelled = set()
+        self._running = {}  # {broadcast_id: thread}
+        self._lock = threading.Lock()
+
+    def start(self, admin_id, text):
+        """پیام همگانی جدید ثبت و در پس‌زمینه شروع می‌شود؛ شناسه آن را برمی‌گرداند."""
+        broadcast_id = self.db_manager.create_broadcast(admin_id, text, self.db_manager.count_users())
+        if broadcast_id:
+            self._spawn(broadcast_id)
+        return broadcast_id
+
+    def resume_unfinished(self):
+        """ارسال‌های نیمه‌کاره (مثلاً به علت ری‌استارت) را ادامه می‌دهد."""
+        for broadcast in self.db_manager.get_running_broadcasts():
+            logger.info(f"Resuming broadcast {broadcast['id']} after user {broadcast['last_user_id']}.")
+            self._spawn(broadcast['id'])
+
+    def cancel(self, broadcast_id):
+        with self._lock:
+            self._cancelled.add(broadcast_id)
+
+    def _spawn(self, broadcast_id):
+        with self._lock:
+            if broadcast_id in self._running:
+                return
+            thread = threading.Thread(target=self.run, args=(broadcast_id,), name=f"broadcast-{broadcast_id}", daemon=True)
+            self._running[broadcast_id] = thread
+        thread.start()
+
+    def _send_one(self, user, text):
+        _, error = self.sender.try_send_message(user['telegram_id'], text)
+        return None if error is None else (user['id'], user['telegram_id'], error)
+
+    def run(self, broadcast_id):
+        """ارسال را (از آخرین صفحه ثبت شده) تا پایان اجرا می‌کند و آمار نهایی را برمی‌گرداند."""
+        broadcast = self.db_manager.get_broadcast(broadcast_id)
+        if not broadcast or broadcast['status'] != 'running':
+            return broadcast
+        text = broadcast['text']
+        last_user_id = broadcast['last_user_id']
+        start = time.perf_counter()
+        sent_this_run = 0
+        last_progress = time.monotonic()
+        status = 'done'
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"broadcast-{broadcast_id}") as pool:
+                while True:
+                    with self._lock:
+                        if broadcast_id in self._cancelled:
+                            status = 'cancelled'
+                            break
+                    users = self.db_manager.get_users_page(last_user_id, self.page_size)
+                    if not users:
+                        break
+                    failures = [f for f in pool.map(lambda u: self._send_one(u, text), users) if f]
+                    last_user_id = users[-1]['id']
+                    sent = len(users) - len(failures)
+                    sent_this_run += sent
+                    self.db_manager.save_broadcast_progress(broadcast_id, last_user_id, sent, failures)
+
+                    if time.monotonic() - last_progress >= self.progress_interval:
+                        last_progress = time.monotonic()
+                        elapsed = time.perf_counter() - start
+                        logger.info(f"Broadcast {broadcast_id}: up to user {last_user_id}, "
+                                    f"{sent_this_run / elapsed:.1f} msg/s, sender {self.sender.get_stats()}")
+        finally:
+            with self._lock:
+                self._running.pop(broadcast_id, None)
+                self._cancelled.discard(broadcast_id)
+
+        self.db_manager.finish_broadcast(broadcast_id, status)
+        result = self.db_manager.get_broadcast(broadcast_id)
+        elapsed = time.perf_counter() - start
+        logger.info(f"Broadcast {broadcast_id} {status}: sent {result['sent_count']}, failed {result['failed_count']} "
+                    f"in {elapsed:.1f}s ({sent_this_run / elapsed if elapsed else 0:.1f} msg/s).")
+        try:
+            self.bot.send_message(result['created_by'], messages.BROADCAST_FINISHED.format(
+                broadcast_id=broadcast_id, sent=result['sent_count'], failed=result['failed_count'],
+                total=result['total_users']), parse_mode='Markdown')
+        except Exception as e:
+            logger.error(f"Could not report broadcast {broadcast_id} result to admin: {e}")
+        return result
+
+
+_engine: BroadcastEngine = None
+_engine_lock = threading.Lock()
+
+
+def get_broadcast_engine(bot, db_manager) -> BroadcastEngine:
+    """نمونه سراسری پروسه را برمی‌گرداند (و در اولین فراخوانی می‌سازد)."""
+    global _engine
+    with _engine_lock:
+        if _engine is None or _engine.db_manager is not db_manager:
+            _engine = BroadcastEngine(bot, db_manager)
+        return _engine
+
+
+if __name__ == "__main__":
+    # بنچمارک خشک (dry-run): ارسال به یک Bot API جعلی با تاخیر شبکه، کاربران بلاک کننده و یک پاسخ 429
+    import os
+    import random
+    import sys
+    import tempfile
+
+    from telebot.apihelper import ApiTelegramException
+
+    from database.db_manager import DatabaseManager
+
+    user_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 25
+
+    class FakeBot:
+        def __init__(self):
+            self.calls = 0
+            self._lock = threading.Lock()
+
+        def send_message(self, chat_id, text, **kwargs):
+            time.sleep(random.uniform(0.05, 0.15))  # تاخیر رفت و برگشت Bot API
+            with self._lock:
+                self.calls += 1
+                calls = self.calls
+            if calls == 100:
+                raise ApiTelegramException('sendMessage', None, {
+                    'error_code': 429, 'description': 'Too Many Requests: retry after 1', 'parameters': {'retry_after': 1}})
+            if chat_id and chat_id % 50 == 0:
+                raise ApiTelegramException('sendMessage', None, {
+                    'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'})
+            return None
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(db_path=os.path.join(tmp, "broadcast_bench.db"))
+        db.create_tables()
+        for telegram_id in range(1, user_count + 1):
+            db.add_or_update_user(telegram_id, f"user{telegram_id}")
+
+        bot = FakeBot()
+        engine = BroadcastEngine(bot, db, sender=RateLimitedSender(bot, rate_per_second=rate))
+        broadcast_id = db.create_broadcast(0, "benchmark", db.count_users())
+        bench_start = time.perf_counter()
+        result = engine.run(broadcast_id)
+        bench_elapsed = time.perf_counter() - bench_start
+        print(f"{user_count} users, limit {rate} msg/s: sent {result['sent_count']}, failed {result['failed_count']} "
+              f"in {bench_elapsed:.1f}s -> {user_count / bench_elapsed:.1f} msg/s sustained")
+        db.close_all_connections()
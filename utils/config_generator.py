@@ -5,41 +5,66 @@ import base64
 import logging
 import uuid
 import datetime
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 from urllib.parse import quote
 
+from config import PROVISIONING_MAX_WORKERS
 from utils.helpers import generate_random_string
+from api_client.client_registry import get_client_registry
+from api_client.inbound_cache import inbound_cache
 
 logger = logging.getLogger(__name__)
 
+# pool مشترک و محدود برای فراخوانی‌های پنل؛ بین تمام نمونه‌های ConfigGenerator مشترک است
+_provisioning_executor: ThreadPoolExecutor = None
+_provisioning_executor_lock = threading.Lock()
+
+
+def _get_provisioning_executor() -> ThreadPoolExecutor:
+    global _provisioning_executor
+    with _provisioning_executor_lock:
+        if _provisioning_executor is None:
+            _provisioning_executor = ThreadPoolExecutor(
+                max_workers=max(1, PROVISIONING_MAX_WORKERS), thread_name_prefix="xui-provision"
+            )
+        return _provisioning_executor
+
+
+def _format_timings(timings: dict) -> str:
+    return ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in timings.items())
+
 class ConfigGenerator:
     def __init__(self, xui_api_client, db_manager):
         self.xui_api = xui_api_client
         self.db_manager = db_manager
+        self.client_registry = get_client_registry(db_manager, xui_api_client)
+        self.last_timings = {}
         logger.info("ConfigGenerator initialized.")
 
-    def create_client_and_configs(self, user_telegram_id: int, server_id: int, total_gb: float, duration_days: int or None):
+    def create_client_and_configs(self, user_telegram_id: int, server_id: int, total_gb: float, duration_days: Optional[int]):
         """
         کلاینت را در پنل X-UI ایجاد می‌کند و لینک سابسکریپشن و کانفیگ‌های تکی را برمی‌گرداند.
+        ساخت کلاینت روی اینباندها به صورت موازی انجام می‌شود و اگر روی هر اینباندی ناموفق باشد،
+        کلاینت‌های ساخته شده روی بقیه اینباندها حذف می‌شوند (همه یا هیچ).
         """
         logger.info(f"Starting config generation for user:{user_telegram_id} on server:{server_id}")
+        timings = {}
+        total_start = stage_start = time.perf_counter()
 
         server_data = self.db_manager.get_server_by_id(server_id)
         if not server_data:
             logger.error(f"Server {server_id} not found.")
             return None, None, None
 
-        # --- بخش اصلاح شده ---
-        # فراخوانی مستقیم کلاس برای ساخت نمونه جدید، بدون استفاده از type()
-        temp_xui_client = self.xui_api(
-            panel_url=server_data['panel_url'],
-            username=server_data['username'],
-            password=server_data['password']
-        )
-        # --- پایان بخش اصلاح شده ---
-
-        if not temp_xui_client.login():
+        # کلاینت از رجیستری سراسری گرفته می‌شود تا سشن لاگین شده بین سفارش‌ها دوباره استفاده شود
+        temp_xui_client = self.client_registry.get_client(server_data)
+        if not temp_xui_client:
             logger.error(f"Failed to login to X-UI panel for server {server_data['name']}.")
             return None, None, None
+        timings['login'] = time.perf_counter() - stage_start
 
         # --- ۱. آماده‌سازی اطلاعات کلاینت ---
         master_sub_id = generate_random_string(12)
@@ -56,23 +81,12 @@ class ConfigGenerator:
             logger.error(f"No active inbounds configured for server {server_id} in bot's DB.")
             return None, None, None
 
-        all_generated_configs = []
-        representative_client_uuid = ""
-        representative_client_email = ""
-
-        # --- ۳. حلقه روی اینباندها و ساخت کلاینت در پنل ---
+        client_jobs = []
         for db_inbound in active_inbounds_from_db:
-            inbound_id_on_panel = db_inbound['inbound_id']
             client_uuid = str(uuid.uuid4())
-            client_email = f"u{user_telegram_id}.s{server_id}.{generate_random_string(4)}"
-
-            if not representative_client_uuid:
-                representative_client_uuid = client_uuid
-                representative_client_email = client_email
-
             client_settings = {
                 "id": client_uuid,
-                "email": client_email,
+                "email": f"u{user_telegram_id}.s{server_id}.{generate_random_string(4)}",
                 "flow": "",
                 "totalGB": total_traffic_bytes,
                 "expiryTime": expiry_time_ms,
@@ -80,46 +94,220 @@ class ConfigGenerator:
                 "tgId": str(user_telegram_id),
                 "subId": master_sub_id,
             }
+            client_jobs.append((db_inbound['inbound_id'], client_settings))
 
-            add_client_payload = {
-                "id": inbound_id_on_panel,
-                "settings": json.dumps({"clients": [client_settings]})
-            }
-            
-            logger.info(f"Adding client {client_email} to inbound {inbound_id_on_panel}...")
-            if not temp_xui_client.add_client(add_client_payload):
-                logger.error(f"Failed to add client to inbound {inbound_id_on_panel}. Aborting.")
-                return None, None, None
+        # --- ۳. اطلاعات اینباندها از کش (در صورت نیاز با یک فراخوانی list_inbounds) ---
+        stage_start = time.perf_counter()
+        inbounds_metadata = inbound_cache.get_many(server_id, [job[0] for job in client_jobs], temp_xui_client)
+        timings['inbound_metadata'] = time.perf_counter() - stage_start
 
-            # --- ۴. ساخت کانفیگ تکی برای کلاینت ایجاد شده ---
-            inbound_details = temp_xui_client.get_inbound(inbound_id_on_panel)
+        # --- ۴. ساخت کلاینت در پنل روی همه اینباندها به صورت موازی ---
+        stage_start = time.perf_counter()
+        results = list(_get_provisioning_executor().map(
+            lambda job: self._provision_on_inbound(temp_xui_client, job[0], job[1]), client_jobs
+        ))
+        timings['add_clients'] = time.perf_counter() - stage_start
+
+        if not all(result['created'] for result in results):
+            failed = [r['inbound_id'] for r in results if not r['created']]
+            logger.error(f"Failed to add client to inbounds {failed}. Rolling back created clients.")
+            stage_start = time.perf_counter()
+            self._rollback_clients(temp_xui_client, [r for r in results if r['created']])
+            timings['rollback'] = time.perf_counter() - stage_start
+            logger.info(f"Provisioning timings for user:{user_telegram_id} (failed): {_format_timings(timings)}")
+            self.last_timings = timings
+            return None, None, None
+
+        # --- ۵. ساخت کانفیگ تکی برای کلاینت‌های ایجاد شده ---
+        stage_start = time.perf_counter()
+        all_generated_configs = []
+        for result in results:
+            inbound_details = inbounds_metadata.get(result['inbound_id'])
             if not inbound_details:
-                logger.warning(f"Could not get details for inbound {inbound_id_on_panel}. Skipping single config.")
+                logger.warning(f"Could not get details for inbound {result['inbound_id']}. Skipping single config.")
                 continue
-
             single_config_url = self._generate_single_config_url(
-                client_uuid=client_uuid,
+                client_uuid=result['client']['id'],
                 server_data=server_data,
                 inbound_panel_details=inbound_details
             )
             if single_config_url:
                 all_generated_configs.append(single_config_url)
+        timings['build_configs'] = time.perf_counter() - stage_start
         
-        # --- ۵. ساخت لینک نهایی سابسکریپشن ---
+        # --- ۶. ساخت لینک نهایی سابسکریپشن ---
         sub_base_url = server_data['subscription_base_url'].rstrip('/')
         sub_path = server_data['subscription_path_prefix'].strip('/')
         subscription_link = f"{sub_base_url}/{sub_path}/{master_sub_id}"
         print(f"--- DEBUG LINK GENERATION ---\nBase URL: {sub_base_url}\nPath: {sub_path}\nSub ID: {master_sub_id}\nFinal Link: {subscription_link}\n-----------------------------")
 
+        representative_client = results[0]['client']
         client_details_for_db = {
-            "uuid": representative_client_uuid,
-            "email": representative_client_email,
-            "subscription_id": master_sub_id
+            "uuid": representative_client['id'],
+            "email": representative_client['email'],
+            "subscription_id": master_sub_id,
+            # برای حذف کلاینت‌ها اگر ذخیره سفارش در دیتابیس ناموفق باشد (delete_created_clients)
+            "inbound_clients": [(r['inbound_id'], r['client']['id']) for r in results],
         }
 
+        timings['total'] = time.perf_counter() - total_start
+        self.last_timings = timings
+        logger.info(f"Provisioning timings for user:{user_telegram_id} on {len(results)} inbounds: {_format_timings(timings)}")
         logger.info(f"Config generation successful. Sub link: {subscription_link}")
         return client_details_for_db, subscription_link, all_generated_configs
 
+    def create_bulk_clients(self, server_id: int, count: int, total_gb: float, duration_days: Optional[int],
+                            user_telegram_id: int = 0, use_batch: bool = True):
+        """
+        تعداد زیادی اکانت (مثلاً اکانت تست یا سفارش نماینده) را روی یک سرور می‌سازد.
+        با use_batch=True برای هر اینباند فقط یک درخواست addClient شامل همه کلاینت‌ها ارسال می‌شود؛
+        با use_batch=False هر کلاینت جداگانه ساخته می‌شود (مسیر قبلی، برای مقایسه زمان).
+        خروجی لیستی از نتایج به ازای هر اکانت است:
+        {'email', 'uuid', 'subscription_id', 'subscription_link', 'configs', 'success', 'failed_inbounds'}
+        """
+        logger.info(f"Starting bulk creation of {count} clients on server:{server_id} (batch={use_batch})")
+        timings = {}
+        total_start = stage_start = time.perf_counter()
+
+        server_data = self.db_manager.get_server_by_id(server_id)
+        if not server_data or count <= 0:
+            logger.error(f"Server {server_id} not found or invalid count {count}.")
+            return []
+        xui_client = self.client_registry.get_client(server_data)
+        if not xui_client:
+            logger.error(f"Failed to login to X-UI panel for server {server_data['name']}.")
+            return []
+        active_inbounds_from_db = self.db_manager.get_server_inbounds(server_id, only_active=True)
+        if not active_inbounds_from_db:
+            logger.error(f"No active inbounds configured for server {server_id} in bot's DB.")
+            return []
+        inbound_ids = [db_inbound['inbound_id'] for db_inbound in active_inbounds_from_db]
+        timings['login'] = time.perf_counter() - stage_start
+
+        expiry_time_ms = 0
+        if duration_days is not None and duration_days > 0:
+            expire_date = datetime.datetime.now() + datetime.timedelta(days=duration_days)
+            expiry_time_ms = int(expire_date.timestamp() * 1000)
+        total_traffic_bytes = int(total_gb * (1024**3)) if total_gb is not None else 0
+
+        # برای هر اکانت یک subId و برای هر (اکانت، اینباند) یک کلاینت با ایمیل یکتا
+        accounts = []
+        for _ in range(count):
+            sub_id = generate_random_string(12)
+            clients_by_inbound = {}
+            for inbound_id in inbound_ids:
+                clients_by_inbound[inbound_id] = {
+                    "id": str(uuid.uuid4()),
+                    "email": f"u{user_telegram_id}.s{server_id}.{generate_random_string(6)}",
+                    "flow": "",
+                    "totalGB": total_traffic_bytes,
+                    "expiryTime": expiry_time_ms,
+                    "enable": True,
+                    "tgId": str(user_telegram_id) if user_telegram_id else "",
+                    "subId": sub_id,
+                }
+            accounts.append({'subscription_id': sub_id, 'clients': clients_by_inbound, 'failed_inbounds': []})
+
+        stage_start = time.perf_counter()
+        inbounds_metadata = inbound_cache.get_many(server_id, inbound_ids, xui_client)
+        timings['inbound_metadata'] = time.perf_counter() - stage_start
+
+        def _create_on_inbound(inbound_id):
+            clients = [account['clients'][inbound_id] for account in accounts]
+            if use_batch and xui_client.add_clients(inbound_id, clients):
+                return inbound_id, [True] * len(clients)
+            # مسیر تکی: یا batch غیرفعال است یا رد شده و باید مشخص شود کدام کلاینت‌ها مشکل دارند
+            return inbound_id, [
+                xui_client.add_client({"id": inbound_id, "settings": json.dumps({"clients": [client]})})
+                for client in clients
+            ]
+
+        stage_start = time.perf_counter()
+        created_map = dict(_get_provisioning_executor().map(_create_on_inbound, inbound_ids))
+        timings['add_clients'] = time.perf_counter() - stage_start
+
+        for index, account in enumerate(accounts):
+            account['failed_inbounds'] = [inbound_id for inbound_id in inbound_ids if not created_map[inbound_id][index]]
+
+        # اکانت‌هایی که روی حداقل یک اینباند ساخته نشده‌اند، به طور کامل از پنل حذف می‌شوند
+        to_rollback = [
+            {'inbound_id': inbound_id, 'client': account['clients'][inbound_id]}
+            for index, account in enumerate(accounts) if account['failed_inbounds']
+            for inbound_id in inbound_ids if created_map[inbound_id][index]
+        ]
+        if to_rollback:
+            stage_start = time.perf_counter()
+            self._rollback_clients(xui_client, to_rollback)
+            timings['rollback'] = time.perf_counter() - stage_start
+
+        sub_base_url = server_data['subscription_base_url'].rstrip('/')
+        sub_path = server_data['subscription_path_prefix'].strip('/')
+        results = []
+        for account in accounts:
+            success = not account['failed_inbounds']
+            configs = []
+            if success:
+                for inbound_id, client in account['clients'].items():
+                    if inbounds_metadata.get(inbound_id):
+                        single_config_url = self._generate_single_config_url(client['id'], server_data, inbounds_metadata[inbound_id])
+                        if single_config_url:
+                            configs.append(single_config_url)
+            representative_client = account['clients'][inbound_ids[0]]
+            results.append({
+                'email': representative_client['email'],
+                'uuid': representative_client['id'],
+                'subscription_id': account['subscription_id'],
+                'subscription_link': f"{sub_base_url}/{sub_path}/{account['subscription_id']}" if success else None,
+                'configs': configs,
+                'success': success,
+                'failed_inbounds': account['failed_inbounds'],
+            })
+
+        timings['total'] = time.perf_counter() - total_start
+        self.last_timings = timings
+        succeeded = sum(1 for result in results if result['success'])
+        logger.info(f"Bulk creation on server:{server_id} finished: {succeeded}/{count} succeeded, "
+                    f"{len(inbound_ids)} inbounds, batch={use_batch}. Timings: {_format_timings(timings)}")
+        return results
+
+    def _provision_on_inbound(self, xui_client, inbound_id_on_panel, client_settings):
+        """یک کلاینت را روی یک اینباند می‌سازد."""
+        add_client_payload = {
+            "id": inbound_id_on_panel,
+            "settings": json.dumps({"clients": [client_settings]})
+        }
+        logger.info(f"Adding client {client_settings['email']} to inbound {inbound_id_on_panel}...")
+        result = {'inbound_id': inbound_id_on_panel, 'client': client_settings, 'created': False}
+        try:
+            result['created'] = xui_client.add_client(add_client_payload)
+        except Exception as e:
+            logger.error(f"Unexpected error while provisioning on inbound {inbound_id_on_panel}: {e}", exc_info=True)
+        return result
+
+    def delete_created_clients(self, server_id: int, client_details: dict) -> bool:
+        """
+        کلاینت‌های ساخته شده توسط create_client_and_configs را از پنل حذف می‌کند؛ برای وقتی که پس از ساخت
+        سرویس، ذخیره خرید ناموفق است و نباید کلاینت بدون صاحب در پنل بماند. True اگر همه حذف شدند.
+        """
+        server_data = self.db_manager.get_server_by_id(server_id)
+        xui_client = self.client_registry.get_client(server_data) if server_data else None
+        if not xui_client:
+            logger.error(f"Could not remove clients of sub {client_details['subscription_id']}: server {server_id} unavailable.")
+            return False
+        return self._rollback_clients(xui_client, [
+            {'inbound_id': inbound_id, 'client': {'id': client_id, 'email': client_details['email']}}
+            for inbound_id, client_id in client_details['inbound_clients']
+        ])
+
+    def _rollback_clients(self, xui_client, created_results):
+        """کلاینت‌هایی را که قبل از شکست عملیات ساخته شده‌اند، از پنل حذف می‌کند. True اگر همه حذف شدند."""
+        def _delete(result):
+            if not xui_client.delete_client(result['inbound_id'], result['client']['id']):
+                logger.error(f"Rollback failed for client {result['client']['email']} on inbound {result['inbound_id']}.")
+                return False
+            return True
+        return all(list(_get_provisioning_executor().map(_delete, created_results)))
+
     def _generate_single_config_url(self, client_uuid: str, server_data: dict, inbound_panel_details: dict) -> dict or None:
         """
         بر اساس جزئیات اینباند و کلاینت، یک کانفیگ تکی تولید می‌کند.
@@ -131,7 +319,10 @@ class ConfigGenerator:
             address = server_data['subscription_base_url'].split('//')[1].split(':')[0].split('/')[0]
             port = inbound_panel_details.get('port')
 
-            stream_settings = json.loads(inbound_panel_details.get('streamSettings', '{}'))
+            # streamSettings در کش اینباندها از قبل پارس شده است
+            stream_settings = inbound_panel_details.get('streamSettings') or {}
+            if isinstance(stream_settings, str):
+                stream_settings = json.loads(stream_settings)
             network = stream_settings.get('network', 'tcp')
             security = stream_settings.get('security', 'none')
 
@@ -184,4 +375,54 @@ class ConfigGenerator:
         except Exception as e:
             logger.error(f"Error generating single config URL: {e}", exc_info=True)
             return None
-        return None
\ No newline at end of file
+        return None
+
+
+if __name__ == "__main__":
+    # بنچمارک: ساخت گروهی اکانت روی یک پنل جعلی با تاخیر ثابت برای هر درخواست، batch در برابر تک‌تک
+    import sys
+
+    inbound_count = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    account_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    panel_latency = 0.05
+
+    class FakePanelClient:
+        def __init__(self, panel_url, username, password):
+            self.session = None
+
+        def check_login(self):
+            return True
+
+        def list_inbounds(self):
+            time.sleep(panel_latency)
+            return [{'id': i, 'protocol': 'vless', 'port': 443, 'remark': f'in{i}', 'streamSettings': '{}'}
+                    for i in range(1, inbound_count + 1)]
+
+        def add_client(self, payload):
+            time.sleep(panel_latency)
+            return True
+
+        def add_clients(self, inbound_id, clients):
+            time.sleep(panel_latency)
+            return True
+
+        def delete_client(self, inbound_id, client_id):
+            time.sleep(panel_latency)
+            return True
+
+    class FakeDatabase:
+        servers_version = 0
+
+        def get_server_by_id(self, server_id):
+            return {'id': server_id, 'name': 'bench', 'panel_url': 'http://panel', 'username': 'u', 'password': 'p',
+                    'subscription_base_url': 'https://sub.example.com:2096', 'subscription_path_prefix': 'sub'}
+
+        def get_server_inbounds(self, server_id, only_active=True):
+            return [{'inbound_id': i} for i in range(1, inbound_count + 1)]
+
+    logging.basicConfig(level=logging.WARNING)
+    generator = ConfigGenerator(FakePanelClient, FakeDatabase())
+    for use_batch in (False, True):
+        results = generator.create_bulk_clients(1, account_count, 10, 30, use_batch=use_batch)
+        print(f"batch={use_batch}: {sum(r['success'] for r in results)}/{account_count} accounts on {inbound_count} inbounds, "
+              f"timings: {_format_timings(generator.last_timings)}")
@@ -0,0 +1,174 @@
+# utils/expiry_scheduler.py
+
+import datetime
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from api_client.client_registry import get_client_registry
+from config import (
+    EXPIRY_CHECK_INTERVAL_SECONDS, EXPIRY_WARNING_HOURS, EXPIRY_SCHEDULER_WORKERS,
+)
+from utils import messages
+from utils.rate_limiter import get_shared_sender
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _client_key(protocol, client):
+    """شناسه‌ای که updateClient پنل برای هر پروتکل انتظار دارد."""
+    if protocol == 'trojan':
+        return client.get('password')
+    if protocol == 'shadowsocks':
+        return client.get('email')
+    return client.get('id')
+
+
+def _purchase_key(purchase):
+    return purchase['subscription_id'] or purchase['xui_client_email']
+
+
+class ExpiryScheduler:
+    """
+    اعمال دوره‌ای انقضا و اتمام حجم خریدها:
+    - خریدهای منقضی: کلاینت‌های اشتراک در پنل غیرفعال (enable=False) می‌شوند،
+    - خریدهای با حجم تمام شده: برای هر اینباند درگیر یک بار del_depleted_clients فراخوانی می‌شود،
+    - خریدهایی که به زودی منقضی می‌شوند: هشدار برای کاربر ارسال می‌شود.
+    کارها بر اساس سرور گروه‌بندی می‌شوند (یک لاگین و یک list_inbounds برای هر سرور، سرورها همزمان)
+    و تغییرات دیتابیس به صورت دسته‌ای اعمال می‌شوند.
+    """
+
+    def __init__(self, bot, db_manager, interval=EXPIRY_CHECK_INTERVAL_SECONDS, warning_hours=EXPIRY_WARNING_HOURS,
+                 workers=EXPIRY_SCHEDULER_WORKERS, sender=None):
+        self.bot = bot
+        self.db_manager = db_manager
+        self.registry = get_client_registry(db_manager)
+        self.interval = interval
+        self.warning_hours = warning_hours
+        self.workers = workers
+        self.sender = sender or get_shared_sender(bot)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _apply_on_server(self, server_id, expired, depleted):
+        """
+        اقدامات یک سرور را انجام می‌دهد و خریدهایی که با موفقیت اعمال شدند را برمی‌گرداند.
+        اگر پنل در دسترس نباشد، چیزی برگردانده نمی‌شود تا در دور بعد دوباره تلاش شود.
+        """
+        server = self.db_manager.get_server_by_id(server_id)
+        if not server:
+            # سرور حذف شده؛ کاری در پنل لازم نیست
+            return expired + depleted
+        client = self.registry.get_client(server)
+        if client is None:
+            logger.warning(f"Expiry scheduler: server {server_id} unreachable, {len(expired) + len(depleted)} purchases postponed.")
+            return []
+        inbounds = client.list_inbounds()
+        if not inbounds:
+            return []
+
+        expired_keys = {_purchase_key(p) for p in expired}
+        depleted_keys = {_purchase_key(p) for p in depleted}
+        failed_keys = set()
+        depleted_inbounds = set()
+        disabled = 0
+        for inbound in inbounds:
+            settings = inbound.get('settings') or '{}'
+            if isinstance(settings, str):
+                try:
+                    settings = json.loads(settings)
+                except json.JSONDecodeError:
+                    continue
+            for panel_client in settings.get('clients', []):
+                keys = {panel_client.get('subId'), panel_client.get('email')}
+                if keys & depleted_keys:
+                    depleted_inbounds.add(inbound['id'])
+                matched = keys & expired_keys
+                if not matched or panel_client.get('enable') is False:
+                    continue
+                updated = dict(panel_client, enable=False)
+                payload = {'id': inbound['id'], 'settings': json.dumps({'clients': [updated]})}
+                if client.update_client(_client_key(inbound.get('protocol'), panel_client), payload):
+                    disabled += 1
+                else:
+                    failed_keys |= matched
+
+        # یک فراخوانی برای هر اینباند، به جای حذف تک‌تک کلاینت‌ها
+        depleted_ok = all(client.del_depleted_clients(inbound_id) for inbound_id in sorted(depleted_inbounds))
+        logger.info(f"Expiry scheduler on server {server_id}: disabled {disabled} clients, "
+                    f"cleaned {len(depleted_inbounds)} inbounds of depleted clients.")
+        done = [p for p in expired if _purchase_key(p) not in failed_keys]
+        if depleted_ok:
+            done += depleted
+        return done
+
+    def run_once(self):
+        """یک دور بررسی؛ دیکشنری تعداد خریدهای منقضی، تمام شده و هشدار داده شده برمی‌گرداند."""
+        start = time.perf_counter()
+        now = datetime.datetime.now()
+        expired = self.db_manager.get_expired_active_purchases(now.strftime(DATE_FORMAT))
+        expired_ids = {p['id'] for p in expired}
+        depleted = [p for p in self.db_manager.get_depleted_active_purchases() if p['id'] not in expired_ids]
+
+        by_server = defaultdict(lambda: ([], []))
+        for p in expired:
+            by_server[p['server_id']][0].append(p)
+        for p in depleted:
+            by_server[p['server_id']][1].append(p)
+
+        done = []
+        if by_server:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(by_server)), thread_name_prefix="expiry") as pool:
+                futures = [pool.submit(self._apply_on_server, server_id, e, d) for server_id, (e, d) in by_server.items()]
+                for future in futures:
+                    try:
+                        done.extend(future.result())
+                    except Exception as e:
+                        logger.error(f"Expiry scheduler failed on a server: {e}", exc_info=True)
+
+        if done and self.db_manager.deactivate_purchases([p['id'] for p in done]):
+            for p in done:
+                template = messages.SERVICE_EXPIRED_NOTICE if p['id'] in expired_ids else messages.SERVICE_DEPLETED_NOTICE
+                self.sender.send_message(p['telegram_id'], template.format(purchase_id=p['id']), parse_mode='Markdown')
+
+        warn_until = now + datetime.timedelta(hours=self.warning_hours)
+        to_warn = self.db_manager.get_purchases_to_warn(now.strftime(DATE_FORMAT), warn_until.strftime(DATE_FORMAT))
+        for p in to_warn:
+            self.sender.send_message(
+                p['telegram_id'],
+                messages.SERVICE_EXPIRY_WARNING.format(purchase_id=p['id'], expire_date=str(p['expire_date'])[:16]),
+                parse_mode='Markdown'
+            )
+        self.db_manager.mark_expiry_warned([p['id'] for p in to_warn])
+
+        summary = {
+            'expired': sum(1 for p in done if p['id'] in expired_ids),
+            'depleted': sum(1 for p in done if p['id'] not in expired_ids),
+            'postponed': len(expired) + len(depleted) - len(done),
+            'warned': len(to_warn),
+        }
+        logger.info(f"Expiry scheduler run finished in {time.perf_counter() - start:.2f}s: {summary}, "
+                    f"sender: {self.sender.get_stats()}")
+        return summary
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run_forever, name="expiry-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"Expiry scheduler runs every {self.interval}s.")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run_forever(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Expiry scheduler run failed: {e}", exc_info=True)
@@ -0,0 +1,135 @@
+# utils/health_checker.py
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api_client.xui_api_client import XuiAPIClient
+from config import HEALTH_CHECK_INTERVAL_SECONDS, HEALTH_CHECK_WORKERS, HEALTH_HISTORY_RETENTION_DAYS
+
+logger = logging.getLogger(__name__)
+
+
+class ServerHealthChecker:
+    """
+    تست سلامت همه سرورها به صورت همزمان (با تعداد thread محدود).
+    برای هر سرور زمان لاگین، تعداد اینباندها و نوع خطا ثبت می‌شود و نتیجه در جدول
+    server_health_history ذخیره و در حافظه نگه داشته می‌شود تا مسیر خرید بدون تماس با پنل
+    از وضعیت به‌روز سرورها استفاده کند.
+    """
+
+    def __init__(self, db_manager, workers=HEALTH_CHECK_WORKERS, interval=HEALTH_CHECK_INTERVAL_SECONDS,
+                 retention_days=HEALTH_HISTORY_RETENTION_DAYS, client_class=XuiAPIClient):
+        self.db_manager = db_manager
+        self.client_class = client_class
+        self.workers = workers
+        self.interval = interval
+        self.retention_seconds = retention_days * 86400
+        self._latest = {}  # {server_id: result}
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _probe(self, server):
+        # کلاینت جداگانه (خارج از رجیستری): لاگین اجباری تست، سشن کلاینت مشترکی را که
+        # همزمان در مسیر خرید استفاده می‌شود باطل نمی‌کند
+        client = self.client_class(panel_url=server['panel_url'], username=server['username'],
+                                   password=server['password'])
+        try:
+            start = time.perf_counter()
+            is_online = client.login()
+            latency_ms = round((time.perf_counter() - start) * 1000, 1)
+            inbound_count = None
+            error_class = client.last_error
+            if is_online:
+                try:
+                    inbound_count = len(client.list_inbounds())
+                except Exception as e:
+                    error_class = type(e).__name__
+        finally:
+            client.session.close()
+        return {
+            'server_id': server['id'],
+            'checked_at': time.time(),
+            'is_online': is_online,
+            'latency_ms': latency_ms,
+            'inbound_count': inbound_count,
+            'error_class': error_class,
+        }
+
+    def check_all(self):
+        """همه سرورها را همزمان تست می‌کند و لیست نتایج را (به ترتیب سرورها) برمی‌گرداند."""
+        servers = self.db_manager.get_all_servers()
+        if not servers:
+            return []
+        # اگر دور قبلی (مثلاً زمان‌بندی شده) هنوز در حال اجراست، منتظر پایان آن می‌مانیم
+        with self._check_lock:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(servers)), thread_name_prefix="health") as pool:
+                results = list(pool.map(self._safe_probe, servers))
+            self.db_manager.record_server_health(results, self.retention_seconds)
+            with self._lock:
+                self._latest.update({r['server_id']: r for r in results})
+            online = sum(1 for r in results if r['is_online'])
+            logger.info(f"Health check of {len(results)} servers finished in {time.perf_counter() - start:.2f}s "
+                        f"({online} online).")
+        return results
+
+    def _safe_probe(self, server):
+        try:
+            return self._probe(server)
+        except Exception as e:
+            logger.error(f"Health check of server {server['id']} failed: {e}", exc_info=True)
+            return {'server_id': server['id'], 'checked_at': time.time(), 'is_online': False,
+                    'latency_ms': None, 'inbound_count': None, 'error_class': type(e).__name__}
+
+    def get_status(self, server_id):
+        """آخرین نتیجه تست سرور یا None."""
+        with self._lock:
+            return self._latest.get(server_id)
+
+    def is_online(self, server):
+        """
+        وضعیت سرور بر اساس آخرین تست؛ اگر تست تازه‌ای (حداکثر سه دوره زمان‌بندی) وجود نداشته باشد،
+        به فلگ is_online دیتابیس برمی‌گردد.
+        """
+        status = self.get_status(server['id'])
+        max_age = self.interval * 3 if self.interval > 0 else None
+        if status and (max_age is None or time.time() - status['checked_at'] <= max_age):
+            return bool(status['is_online'])
+        return bool(server['is_online'])
+
+    def start(self):
+        """نتایج قبلی را از دیتابیس بارگذاری و تست دوره‌ای را در پس‌زمینه شروع می‌کند."""
+        with self._lock:
+            self._latest.update(self.db_manager.get_latest_server_health())
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run_forever, name="server-health", daemon=True)
+        self._thread.start()
+        logger.info(f"Server health checks scheduled every {self.interval}s with {self.workers} workers.")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run_forever(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check_all()
+            except Exception as e:
+                logger.error(f"Scheduled health check failed: {e}", exc_info=True)
+
+
+_checker: ServerHealthChecker = None
+_checker_lock = threading.Lock()
+
+
+def get_health_checker(db_manager) -> ServerHealthChecker:
+    """نمونه سراسری پروسه را برمی‌گرداند (و در اولین فراخوانی می‌سازد)."""
+    global _checker
+    with _checker_lock:
+        if _checker is None or _checker.db_manager is not db_manager:
+            _checker = ServerHealthChecker(db_manager)
+        return _checker
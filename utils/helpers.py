@@ -4,9 +4,13 @@ import telebot
 import logging
 import random
 import string
+import threading
+import time
+from collections import OrderedDict
 
 # این خط برای دسترسی به لیست ادمین‌ها اضافه شده است
 from config import ADMIN_IDS
+from config import MEMBERSHIP_CACHE_TTL_SECONDS, MEMBERSHIP_NEGATIVE_TTL_SECONDS, MEMBERSHIP_CACHE_MAX_ENTRIES
 
 logger = logging.getLogger(__name__)
 
@@ -17,20 +21,104 @@ def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_IDS
 
 
+_MEMBER_STATUSES = ('member', 'creator', 'administrator')
+
+
+class _MembershipCache:
+    """
+    کش نتیجه get_chat_member با TTL جداگانه برای عضو (طولانی) و غیر عضو (کوتاه، تا پس از عضویت
+    زود دوباره بررسی شود). درخواست‌های همزمان یک کاربر منتظر همان یک درخواست به تلگرام می‌مانند.
+    """
+
+    def __init__(self, positive_ttl, negative_ttl, max_entries):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # {(channel_id, user_id): (expires_at, is_member)}
+        self._inflight = {}  # {(channel_id, user_id): threading.Event}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, is_member, ttl=None):
+        if ttl is None:
+            ttl = self.positive_ttl if is_member else self.negative_ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, is_member)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, key, fetch):
+        """مقدار کش شده یا نتیجه fetch()؛ در هر لحظه فقط یک fetch برای هر کلید اجرا می‌شود."""
+        while True:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+            with self._lock:
+                event = self._inflight.get(key)
+                is_leader = event is None
+                if is_leader:
+                    event = self._inflight[key] = threading.Event()
+                    self.misses += 1
+            if not is_leader:
+                # اگر درخواست اول بیش از حد طول بکشد، خودمان دوباره تلاش می‌کنیم
+                event.wait(timeout=15)
+                continue
+            try:
+                is_member, ttl = fetch()
+                self.set(key, is_member, ttl)
+                return is_member
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                event.set()
+
+    def get_stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+_membership_cache = _MembershipCache(MEMBERSHIP_CACHE_TTL_SECONDS, MEMBERSHIP_NEGATIVE_TTL_SECONDS, MEMBERSHIP_CACHE_MAX_ENTRIES)
+
+
 def is_user_member_of_channel(bot: telebot.TeleBot, channel_id: int, user_id: int) -> bool:
     """
     بررسی می‌کند که آیا کاربر در کانال مورد نظر عضو است یا خیر.
+    نتیجه کش می‌شود تا /start کاربران قبلی منتظر پاسخ API تلگرام نماند.
     """
     if channel_id is None:
         return True
 
-    try:
-        chat_member = bot.get_chat_member(channel_id, user_id)
-        return chat_member.status in ['member', 'creator', 'administrator']
-    except Exception as e:
-        logger.error(f"Error checking user {user_id} membership in channel {channel_id}: {e}")
-        # در صورت بروز خطا (مثلا اگر ربات از کانال حذف شده باشد)، دسترسی را مجاز می‌دانیم تا ربات متوقف نشود
-        return True
+    def _fetch():
+        try:
+            chat_member = bot.get_chat_member(channel_id, user_id)
+            return chat_member.status in _MEMBER_STATUSES, None
+        except Exception as e:
+            logger.error(f"Error checking user {user_id} membership in channel {channel_id}: {e}")
+            # در صورت بروز خطا (مثلا اگر ربات از کانال حذف شده باشد)، دسترسی را مجاز می‌دانیم تا ربات متوقف نشود؛
+            # این نتیجه فقط به مدت TTL منفی کش می‌شود تا پس از رفع مشکل دوباره بررسی شود
+            return True, _membership_cache.negative_ttl
+
+    return _membership_cache.lookup((channel_id, user_id), _fetch)
+
+
+def update_channel_membership(channel_id: int, user_id: int, status: str):
+    """با آپدیت chat_member (عضویت یا خروج کاربر از کانال) کش را فوراً به‌روز می‌کند."""
+    _membership_cache.set((channel_id, user_id), status in _MEMBER_STATUSES)
+
+
+def get_membership_cache_stats():
+    return _membership_cache.get_stats()
 
 
 def is_float_or_int(value) -> bool:
@@ -0,0 +1,110 @@
+# utils/job_queue.py
+
+import logging
+import random
+import threading
+import time
+
+from config import (
+    JOB_WORKERS, JOB_POLL_INTERVAL_SECONDS, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_METRICS_INTERVAL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 3)
+
+
+class JobQueue:
+    """
+    صف کارهای پس‌زمینه روی جدول jobs دیتابیس (ماندگار پس از ری‌استارت).
+    workerها کارها را به صورت اتمیک رزرو می‌کنند؛ در صورت خطا با تاخیر نمایی دوباره تلاش می‌شود
+    و پس از آخرین تلاش ناموفق، on_final_failure آن نوع کار فراخوانی می‌شود.
+    """
+
+    def __init__(self, db_manager, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL_SECONDS,
+                 lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS, metrics_interval=JOB_METRICS_INTERVAL_SECONDS):
+        self.db_manager = db_manager
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.metrics_interval = metrics_interval
+        self._handlers = {}  # {job_type: (handler, on_final_failure)}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def register(self, job_type, handler, on_final_failure=None):
+        """handler(payload) کار را انجام می‌دهد و برای تلاش مجدد باید exception ایجاد کند."""
+        self._handlers[job_type] = (handler, on_final_failure)
+
+    def enqueue(self, job_type, payload: dict, idempotency_key=None):
+        job_id = self.db_manager.enqueue_job(job_type, payload, idempotency_key, self.max_attempts)
+        if job_id:
+            self._wakeup.set()
+        return job_id
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.metrics_interval > 0:
+            threading.Thread(target=self._log_metrics_forever, name="job-metrics", daemon=True).start()
+        logger.info(f"Job queue started with {self.workers} workers for {list(self._handlers)}.")
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def _retry_delay(self, attempts):
+        return min(300, 5 * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+
+    def _worker(self):
+        while not self._stop.is_set():
+            job = self.db_manager.claim_next_job(list(self._handlers), self.lease_seconds)
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run_job(job)
+
+    def _run_job(self, job):
+        handler, on_final_failure = self._handlers[job['job_type']]
+        start = time.perf_counter()
+        try:
+            handler(job['payload'])
+        except Exception as e:
+            logger.error(f"Job {job['id']} ({job['job_type']}) failed on attempt {job['attempts']}: {e}", exc_info=True)
+            gave_up = self.db_manager.fail_job(job['id'], str(e), self._retry_delay(job['attempts']))
+            if gave_up and on_final_failure:
+                try:
+                    on_final_failure(job['payload'], e)
+                except Exception as callback_error:
+                    logger.error(f"on_final_failure for job {job['id']} failed: {callback_error}")
+            return
+        self.db_manager.complete_job(job['id'])
+        logger.info(f"Job {job['id']} ({job['job_type']}) done in {time.perf_counter() - start:.2f}s "
+                    f"(queued {job['started_at'] - job['created_at']:.2f}s, attempt {job['attempts']}).")
+
+    def _log_metrics_forever(self):
+        while not self._stop.wait(self.metrics_interval):
+            logger.info(f"Job queue metrics: {self.get_metrics()}")
+
+    def get_metrics(self):
+        """تعداد کارها بر اساس وضعیت و صدک‌های زمان انتظار و زمان کل (ثانیه) برای کارهای اخیر."""
+        stats = self.db_manager.get_job_stats()
+        waits = [row['wait_seconds'] for row in stats['recent_latencies'] if row['wait_seconds'] is not None]
+        totals = [row['total_seconds'] for row in stats['recent_latencies'] if row['total_seconds'] is not None]
+        return {
+            'counts': stats['counts'],
+            'wait_p50': _percentile(waits, 0.5),
+            'wait_p95': _percentile(waits, 0.95),
+            'total_p50': _percentile(totals, 0.5),
+            'total_p95': _percentile(totals, 0.95),
+        }
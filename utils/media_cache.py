@@ -0,0 +1,119 @@
+# utils/media_cache.py
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from telebot.apihelper import ApiTelegramException
+
+from config import MEDIA_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+
+class MediaFileCache:
+    """
+    کش file_id فایل‌هایی که ربات در تلگرام آپلود کرده، بر اساس هش محتوای فایل.
+    فایلی با محتوای تکراری (QR کد، بکاپ بدون تغییر و ...) به جای آپلود دوباره، با file_id ارسال می‌شود.
+    file_idها در جدول media_file_ids ماندگار هستند و یک LRU در حافظه جلوی دیتابیس قرار دارد.
+    """
+
+    def __init__(self, db_manager=None, max_entries=MEDIA_CACHE_MAX_ENTRIES):
+        self.db_manager = db_manager
+        self.max_entries = max_entries
+        self._file_ids = OrderedDict()  # {content_hash: file_id}
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.reuses = 0
+
+    def attach(self, db_manager):
+        """پس از ساخت DatabaseManager فراخوانی می‌شود تا file_idها ماندگار شوند."""
+        self.db_manager = db_manager
+
+    @staticmethod
+    def content_hash(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def _get(self, key):
+        with self._lock:
+            file_id = self._file_ids.get(key)
+            if file_id:
+                self._file_ids.move_to_end(key)
+                return file_id
+        file_id = self.db_manager.get_media_file_id(key) if self.db_manager else None
+        if file_id:
+            self._remember(key, file_id)
+        return file_id
+
+    def _remember(self, key, file_id):
+        with self._lock:
+            self._file_ids[key] = file_id
+            self._file_ids.move_to_end(key)
+            while len(self._file_ids) > self.max_entries:
+                self._file_ids.popitem(last=False)
+
+    def _forget(self, key):
+        with self._lock:
+            self._file_ids.pop(key, None)
+        if self.db_manager:
+            self.db_manager.delete_media_file_id(key)
+
+    def _send(self, send_method, media_type, chat_id, content: bytes, filename, **kwargs):
+        key = self.content_hash(content)
+        file_id = self._get(key)
+        if file_id:
+            try:
+                sent_msg = send_method(chat_id, file_id, **kwargs)
+                with self._lock:
+                    self.reuses += 1
+                return sent_msg
+            except ApiTelegramException as e:
+                # فقط اگر تلگرام خود file_id را نپذیرد (متعلق به توکن دیگر یا منقضی) دوباره آپلود می‌کنیم؛
+                # خطاهای دیگر (بلاک شدن، 429، timeout) ربطی به file_id ندارند و ارسال دوباره ممکن است تکراری باشد
+                if not self._is_invalid_file_id_error(e):
+                    raise
+                logger.warning(f"Cached {media_type} file_id rejected, uploading again: {e.description}")
+                self._forget(key)
+
+        bio = BytesIO(content)
+        bio.name = filename
+        sent_msg = send_method(chat_id, bio, **kwargs)
+        with self._lock:
+            self.uploads += 1
+        new_file_id = self._extract_file_id(sent_msg, media_type)
+        if new_file_id:
+            self._remember(key, new_file_id)
+            if self.db_manager:
+                self.db_manager.save_media_file_id(key, media_type, new_file_id, len(content))
+        return sent_msg
+
+    @staticmethod
+    def _is_invalid_file_id_error(error: ApiTelegramException) -> bool:
+        description = (error.description or "").lower()
+        return error.error_code == 400 and ("file identifier" in description or "file_id" in description)
+
+    @staticmethod
+    def _extract_file_id(sent_msg, media_type):
+        if sent_msg is None:
+            return None
+        if media_type == 'photo':
+            photos = getattr(sent_msg, 'photo', None)
+            # بزرگ‌ترین اندازه آخرین عضو لیست است
+            return photos[-1].file_id if photos else None
+        document = getattr(sent_msg, 'document', None)
+        return document.file_id if document else None
+
+    def send_photo(self, bot, chat_id, content: bytes, filename='photo.png', **kwargs):
+        return self._send(bot.send_photo, 'photo', chat_id, content, filename, **kwargs)
+
+    def send_document(self, bot, chat_id, content: bytes, filename, **kwargs):
+        return self._send(bot.send_document, 'document', chat_id, content, filename, **kwargs)
+
+    def get_stats(self):
+        with self._lock:
+            return {'uploads': self.uploads, 'reuses': self.reuses, 'cached': len(self._file_ids)}
+
+
+media_cache = MediaFileCache()
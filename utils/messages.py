@@ -48,6 +48,14 @@ SERVER_DELETED_ERROR = "❌ حذف سرور ناموفق بود."
 SERVER_NOT_FOUND = "سروری با ID وارد شده یافت نشد."
 TESTING_ALL_SERVERS = "⏳ در حال تست اتصال به تمام سرورها..."
 TEST_RESULTS_HEADER = "📊 نتایج تست اتصال سرورها:\n\n"
+BULK_ACCOUNTS_PROMPT = (
+    "👥 برای ساخت گروهی اکانت، مقادیر زیر را با فاصله ارسال کنید:\n"
+    "`ID_سرور تعداد حجم_گیگ تعداد_روز`\n"
+    "مثال: `1 20 10 30` (تعداد روز 0 = نامحدود، حداکثر تعداد: {max_count})"
+)
+BULK_ACCOUNTS_INVALID = "❌ ورودی نامعتبر است."
+BULK_ACCOUNTS_IN_PROGRESS = "⏳ در حال ساخت {count} اکانت روی سرور {server_name}..."
+BULK_ACCOUNTS_RESULT = "✅ {succeeded} از {count} اکانت ساخته شد. لینک‌های سابسکریپشن در فایل پیوست است."
 
 # --- مدیریت Inbound ---
 SELECT_SERVER_FOR_INBOUNDS_PROMPT = "لطفاً سروری که می‌خواهید Inboundهای آن را مدیریت کنید، انتخاب نمایید:"
@@ -91,6 +99,30 @@ GATEWAY_STATUS_TOGGLED_ERROR = "❌ خطایی در تغییر وضعیت درگ
 # --- مدیریت کاربران ---
 LIST_USERS_HEADER = "👥 **لیست کاربران ربات:**\n\n"
 NO_USERS_FOUND = "هیچ کاربری در ربات ثبت‌نام نکرده است."
+LIST_USERS_PAGE_FOOTER = "\n👥 کل کاربران: {total}"
+SEARCH_USER_PROMPT = "🔎 عبارت جستجو را وارد کنید:\n- آیدی عددی تلگرام (یا ID داخلی)\n- نام کاربری با @ در ابتدا (مثلاً `@ali`)\n- یا بخشی از نام کاربر"
+SEARCH_USER_RESULTS_HEADER = "🔎 **نتایج جستجو برای:** {query}\n\n"
+SEARCH_USER_NO_RESULTS = "کاربری با این مشخصات یافت نشد."
+
+# --- داشبورد ---
+DASHBOARD_HEADER = "📊 **داشبورد ربات**\n\n"
+DASHBOARD_TOTALS = (
+    "👥 کل کاربران: {users:,}\n"
+    "💰 کل درآمد: {revenue:,.0f} تومان\n"
+    "✅ پرداخت‌های تایید شده: {confirmed:,} | ⏳ در انتظار: {pending:,} | ❌ رد شده: {rejected:,}\n"
+    "🎁 تست رایگان: {free_tests:,} | تبدیل به خرید: {conversions:,} ({conversion_rate:.1f}٪)\n"
+)
+DASHBOARD_DAYS_HEADER = "\n📅 **{days} روز اخیر:**\n"
+DASHBOARD_DAY_LINE = "`{day}` 💰 {revenue:,.0f} | ✅ {confirmed} | 🛒 {purchases} | 👤 {new_users}\n"
+DASHBOARD_NO_ACTIVITY = "فعالیتی ثبت نشده است.\n"
+DASHBOARD_SERVERS_HEADER = "\n🖥 **سرویس‌های فعال هر سرور:**\n"
+DASHBOARD_SERVER_LINE = "{name}: {active:,} فعال از {total:,}\n"
+
+# --- پیام همگانی ---
+BROADCAST_PROMPT_TEXT = "📢 متن پیام همگانی را ارسال کنید.\nاین پیام برای همه کاربران ربات فرستاده می‌شود."
+BROADCAST_CONFIRM = "پیش‌نمایش پیام بالا است. ارسال برای **{total}** کاربر تایید می‌شود؟"
+BROADCAST_STARTED = "🚀 ارسال پیام همگانی (ID: `{broadcast_id}`) در پس‌زمینه شروع شد. پس از پایان، گزارش آن ارسال می‌شود."
+BROADCAST_FINISHED = "📢 پیام همگانی `{broadcast_id}` به پایان رسید.\n✅ ارسال شده: {sent}\n❌ ناموفق (مثلاً بلاک کرده): {failed}\n👥 کل کاربران: {total}"
 
 # --- نوتیفیکیشن ادمین ---
 ADMIN_NEW_PAYMENT_NOTIFICATION_HEADER = "🔔 **درخواست پرداخت جدید** 🔔\n\n"
@@ -148,6 +180,8 @@ QR_CODE_CAPTION = "می‌توانید با اسکن کد بالا، لینک ر
 GET_SINGLE_CONFIGS_BUTTON = "📄 دریافت کانفیگ‌های تکی"
 NO_SINGLE_CONFIGS_AVAILABLE = "کانفیگ تکی برای این سرویس موجود نیست."
 SINGLE_CONFIG_HEADER = "📄 **کانفیگ‌های تکی شما:**\n\n"
+SERVICE_USAGE_DETAILS = "\n\n📊 **مصرف:** `{used_gb:.2f}` از `{total_gb}` گیگابایت\n_(آخرین به‌روزرسانی: {synced_at})_"
+SERVICE_USAGE_UNLIMITED = "\n\n📊 **مصرف:** `{used_gb:.2f}` گیگابایت (نامحدود)\n_(آخرین به‌روزرسانی: {synced_at})_"
 GET_FREE_TEST_SUCCESS = "✅ اکانت تست رایگان شما با موفقیت ساخته شد!\nحجم: **100 مگابایت**\nمدت زمان: **۲۴ ساعت**"
 FREE_TEST_ALREADY_USED = "😔 شما قبلاً از اکانت تست رایگان خود استفاده کرده‌اید.\n\nهر کاربر فقط یک بار مجاز به دریافت اکانت تست می‌باشد."
 PAYMENT_REJECTED_USER = "❌ پرداخت شما توسط مدیریت تأیید نشد. لطفاً جهت پیگیری با پشتیبانی ({support_link}) در ارتباط باشید."
@@ -164,6 +198,9 @@ MY_SERVICES_ITEM = (
     "--------------------\n"
 )
 NO_SERVICES_FOUND = "شما در حال حاضر هیچ سرویس فعالی ندارید."
+SERVICE_EXPIRY_WARNING = "⏳ سرویس شما (ID: `{purchase_id}`) در تاریخ `{expire_date}` منقضی می‌شود.\nبرای جلوگیری از قطع شدن، از منوی «خرید سرویس» اقدام کنید."
+SERVICE_EXPIRED_NOTICE = "⌛️ مدت زمان سرویس شما (ID: `{purchase_id}`) به پایان رسید و غیرفعال شد."
+SERVICE_DEPLETED_NOTICE = "📉 حجم سرویس شما (ID: `{purchase_id}`) به پایان رسید و غیرفعال شد."
 
 
 # --- مدیریت درگاه پرداخت ---
@@ -0,0 +1,119 @@
+# utils/rate_limiter.py
+
+import logging
+import threading
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+from config import TELEGRAM_SEND_RATE_PER_SECOND, TELEGRAM_SEND_MAX_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """سطل توکن thread-safe: حداکثر rate درخواست در ثانیه با امکان انفجار کوتاه تا capacity."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """تا در دسترس بودن یک توکن صبر می‌کند."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        پس از پاسخ 429 تلگرام، صدور توکن را برای همه ارسال‌کننده‌ها متوقف می‌کند.
+        چند 429 همزمان روی هم جمع نمی‌شوند: توقف برابر بیشترین مقدار (توقف باقیمانده یا retry_after جدید) است.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+class RateLimitedSender:
+    """
+    ارسال پیام‌های انبوه (اعلان انقضا، پیام همگانی) با رعایت محدودیت تلگرام (حدود ۳۰ پیام در ثانیه).
+    در صورت خطای 429، به اندازه retry_after اعلام شده صبر و دوباره تلاش می‌کند.
+    """
+
+    def __init__(self, bot, rate_per_second=TELEGRAM_SEND_RATE_PER_SECOND, max_retries=TELEGRAM_SEND_MAX_RETRIES):
+        self.bot = bot
+        self.bucket = TokenBucket(rate_per_second)
+        self.max_retries = max_retries
+        self.sent = 0
+        self.failed = 0
+        self.throttled = 0
+        self._stats_lock = threading.Lock()
+
+    def _call(self, method, chat_id, *args, **kwargs):
+        """(نتیجه، None) در صورت موفقیت یا (None، توضیح خطا)."""
+        for attempt in range(1, self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                result = method(chat_id, *args, **kwargs)
+                with self._stats_lock:
+                    self.sent += 1
+                return result, None
+            except ApiTelegramException as e:
+                if e.error_code == 429 and attempt < self.max_retries:
+                    retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                    with self._stats_lock:
+                        self.throttled += 1
+                    logger.warning(f"Telegram rate limit hit, retrying after {retry_after}s (attempt {attempt}).")
+                    self.bucket.pause(retry_after)
+                    continue
+                with self._stats_lock:
+                    self.failed += 1
+                # کاربر ربات را بلاک کرده یا چت وجود ندارد؛ تلاش دوباره فایده‌ای ندارد
+                logger.info(f"Could not send to {chat_id}: {e.description}")
+                return None, f"{e.error_code}: {e.description}"
+            except Exception as e:
+                with self._stats_lock:
+                    self.failed += 1
+                logger.error(f"Error sending to {chat_id}: {e}")
+                return None, type(e).__name__
+        return None, "rate limited"
+
+    def send_message(self, chat_id, text, **kwargs):
+        """پیام ارسال شده یا None در صورت عدم موفقیت."""
+        return self._call(self.bot.send_message, chat_id, text, **kwargs)[0]
+
+    def try_send_message(self, chat_id, text, **kwargs):
+        """مانند send_message ولی (پیام، خطا) برمی‌گرداند تا علت عدم ارسال ثبت شود."""
+        return self._call(self.bot.send_message, chat_id, text, **kwargs)
+
+    def get_stats(self):
+        with self._stats_lock:
+            return {'sent': self.sent, 'failed': self.failed, 'throttled': self.throttled}
+
+
+_sender: RateLimitedSender = None
+_sender_lock = threading.Lock()
+
+
+def get_shared_sender(bot) -> RateLimitedSender:
+    """
+    ارسال‌کننده سراسری پروسه را برمی‌گرداند (و در اولین فراخوانی می‌سازد).
+    محدودیت تلگرام برای کل ربات است، پس پیام همگانی و اعلان‌های انقضا باید از یک سطل توکن استفاده کنند.
+    """
+    global _sender
+    with _sender_lock:
+        if _sender is None or _sender.bot is not bot:
+            _sender = RateLimitedSender(bot)
+        return _sender
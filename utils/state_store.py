@@ -0,0 +1,220 @@
+# utils/state_store.py
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import STATE_STORE_BACKEND, STATE_TTL_SECONDS, STATE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# ذخیره‌ساز وضعیت کاربران (جایگزین دیکشنری‌های _user_states / _admin_states).
+# هر دو پیاده‌سازی رابطی مانند dict دارند (get، []، in، del، pop) و وضعیت‌هایی که
+# بیش از ttl_seconds بدون تغییر مانده باشند (مثلاً خریدهای نیمه‌کاره) منقضی می‌شوند.
+# =============================================================================
+
+_MISSING = object()
+
+
+class MemoryStateStore:
+    """ذخیره در حافظه همین پروسه با LRU (حداکثر max_entries) و انقضای TTL."""
+
+    def __init__(self, namespace, ttl_seconds=STATE_TTL_SECONDS, max_entries=STATE_MAX_ENTRIES):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # {key: (updated_at, value)}
+        self._lock = threading.Lock()
+
+    def _get_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        if time.monotonic() - entry[0] > self.ttl_seconds:
+            del self._entries[key]
+            return _MISSING
+        # هر دسترسی، عمر وضعیت را تمدید می‌کند
+        self._entries[key] = (time.monotonic(), entry[1])
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._get_entry(key)
+        return default if value is _MISSING else value
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._get_entry(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._get_entry(key) is not _MISSING
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                logger.info(f"State store '{self.namespace}' evicted state of {evicted_key} (LRU).")
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._entries[key]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def flush(self, key=None):
+        """در حافظه چیزی برای نوشتن وجود ندارد."""
+
+
+class DatabaseStateStore:
+    """
+    ذخیره در جدول user_states تا وضعیت‌ها پس از ری‌استارت باقی بمانند و بین چند پروسه ربات مشترک باشند.
+    مقدار خوانده شده در طول پردازش یک آپدیت در حافظه نگه داشته می‌شود (تا تغییرات درجا مثل
+    state['data']['x'] = y کار کنند) و با flush(key) پس از پایان آپدیت در دیتابیس نوشته می‌شود.
+    """
+
+    def __init__(self, namespace, db_manager, ttl_seconds=STATE_TTL_SECONDS, purge_interval=300):
+        self.namespace = namespace
+        self.db_manager = db_manager
+        self.ttl_seconds = ttl_seconds
+        self.purge_interval = purge_interval
+        self._pending = {}  # {key: (json_as_loaded, value)}
+        self._lock = threading.Lock()
+        self._last_purge = 0
+
+    def _load(self, key):
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key][1]
+        conn = None
+        try:
+            conn = self.db_manager._get_connection()
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT state_json FROM user_states WHERE namespace = ? AND user_id = ? AND updated_at > ?",
+                (self.namespace, key, time.time() - self.ttl_seconds)
+            )
+            row = cursor.fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Error loading state '{self.namespace}' for {key}: {e}")
+            return _MISSING
+        finally:
+            if conn: conn.close()
+        if row is None:
+            return _MISSING
+        value = json.loads(row['state_json'])
+        with self._lock:
+            self._pending[key] = (row['state_json'], value)
+        return value
+
+    def get(self, key, default=None):
+        value = self._load(key)
+        return default if value is _MISSING else value
+
+    def __getitem__(self, key):
+        value = self._load(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self._load(key) is not _MISSING
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._pending[key] = (None, value)
+
+    def __delitem__(self, key):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def pop(self, key, default=None):
+        value = self._load(key)
+        with self._lock:
+            self._pending.pop(key, None)
+        conn = None
+        try:
+            conn = self.db_manager._get_connection()
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM user_states WHERE namespace = ? AND user_id = ?", (self.namespace, key))
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error deleting state '{self.namespace}' for {key}: {e}")
+        finally:
+            if conn: conn.close()
+        return default if value is _MISSING else value
+
+    def flush(self, key=None):
+        """وضعیت‌های تغییر کرده (یک کلید یا همه) را در دیتابیس می‌نویسد و از حافظه خارج می‌کند."""
+        with self._lock:
+            keys = list(self._pending) if key is None else [key] if key in self._pending else []
+            entries = [(k, self._pending.pop(k)) for k in keys]
+
+        now = time.time()
+        rows = []
+        for k, (loaded_json, value) in entries:
+            state_json = json.dumps(value, ensure_ascii=False)
+            if state_json != loaded_json:
+                rows.append((self.namespace, k, state_json, now))
+        purge = now - self._last_purge > self.purge_interval
+        if not rows and not purge:
+            return
+
+        conn = None
+        try:
+            conn = self.db_manager._get_connection()
+            cursor = conn.cursor()
+            if rows:
+                cursor.executemany("""
+                    INSERT INTO user_states (namespace, user_id, state_json, updated_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(namespace, user_id) DO UPDATE SET
+                        state_json = excluded.state_json,
+                        updated_at = excluded.updated_at
+                """, rows)
+            if purge:
+                # حذف وضعیت‌های رها شده (مثلاً خریدهایی که کاربر نیمه‌کاره گذاشته)
+                cursor.execute("DELETE FROM user_states WHERE updated_at < ?", (now - self.ttl_seconds,))
+                if cursor.rowcount:
+                    logger.info(f"Expired {cursor.rowcount} abandoned user states.")
+                self._last_purge = now
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error flushing state store '{self.namespace}': {e}")
+        finally:
+            if conn: conn.close()
+
+
+_stores = []
+
+
+def create_state_store(namespace, db_manager=None):
+    """ذخیره‌ساز وضعیت را بر اساس STATE_STORE_BACKEND در .env می‌سازد."""
+    if STATE_STORE_BACKEND == "database" and db_manager is not None:
+        store = DatabaseStateStore(namespace, db_manager)
+    else:
+        store = MemoryStateStore(namespace)
+    _stores.append(store)
+    return store
+
+
+def flush_state_stores(key=None):
+    """پس از پردازش هر آپدیت فراخوانی می‌شود تا وضعیت آن کاربر ذخیره شود."""
+    for store in _stores:
+        store.flush(key)
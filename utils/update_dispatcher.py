@@ -0,0 +1,180 @@
+# utils/update_dispatcher.py
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import telebot
+
+from config import (
+    DISPATCHER_FAST_WORKERS, DISPATCHER_SLOW_WORKERS, DISPATCHER_SLOW_CALLBACKS,
+    DISPATCHER_METRICS_INTERVAL_SECONDS, DISPATCHER_MAX_PENDING,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _Lane:
+    def __init__(self, name, workers):
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"dispatch-{name}")
+        self.queue_depth = 0  # آپدیت‌های منتظر در این lane
+        self.in_flight = 0
+        self.processed = 0
+        self.max_queue_depth = 0
+
+
+class UpdateDispatcher:
+    """
+    آپدیت‌های کاربران مختلف را به صورت موازی پردازش می‌کند، ولی آپدیت‌های یک کاربر (from_user.id)
+    دقیقاً به ترتیب دریافت و یکی پس از دیگری اجرا می‌شوند تا وضعیت‌های _user_states سازگار بمانند.
+    هر کاربر یک صندوق (mailbox) دارد که در هر لحظه حداکثر روی یک thread اجرا می‌شود؛
+    کال‌بک‌های کند (عملیات روی پنل) در lane جداگانه اجرا می‌شوند تا بقیه کاربران معطل نشوند.
+    تعداد آپدیت‌های در انتظار به max_pending محدود است و submit تا خالی شدن جا منتظر می‌ماند،
+    تا فشار به صف وب‌هوک برسد و آنجا با 503 رد شود.
+    """
+
+    def __init__(self, process_updates, fast_workers=DISPATCHER_FAST_WORKERS, slow_workers=DISPATCHER_SLOW_WORKERS,
+                 slow_callbacks=DISPATCHER_SLOW_CALLBACKS, metrics_interval=DISPATCHER_METRICS_INTERVAL_SECONDS,
+                 max_pending=DISPATCHER_MAX_PENDING):
+        self.process_updates = process_updates
+        self.slow_callbacks = tuple(slow_callbacks)
+        self.lanes = {'fast': _Lane('fast', fast_workers), 'slow': _Lane('slow', slow_workers)}
+        self._mailboxes = {}  # {user_key: deque[(update, lane)]}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._has_room = threading.Condition(self._lock)
+        self._pending = 0
+        self.max_pending = max_pending
+        self.blocked_submits = 0
+        self._post_process_hooks = []
+        if metrics_interval > 0:
+            threading.Thread(target=self._log_metrics_forever, args=(metrics_interval,),
+                             name="dispatch-metrics", daemon=True).start()
+
+    def add_post_process_hook(self, hook):
+        """hook(user_key, update) پس از پردازش هر آپدیت در همان thread فراخوانی می‌شود."""
+        self._post_process_hooks.append(hook)
+
+    @staticmethod
+    def _get_user_key(update):
+        for field in ('message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+                      'shipping_query', 'pre_checkout_query', 'poll_answer', 'my_chat_member', 'chat_member',
+                      'chat_join_request'):
+            event = getattr(update, field, None)
+            if event is not None:
+                user = getattr(event, 'from_user', None) or getattr(event, 'user', None)
+                if user is not None:
+                    return user.id
+        # آپدیت‌های بدون کاربر (مثل پست کانال) ترتیب وابسته‌ای ندارند
+        return ('update', update.update_id)
+
+    def _get_lane(self, update):
+        callback = update.callback_query
+        if callback is not None and callback.data and callback.data.startswith(self.slow_callbacks):
+            return self.lanes['slow']
+        return self.lanes['fast']
+
+    def submit(self, update):
+        user_key = self._get_user_key(update)
+        lane = self._get_lane(update)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.blocked_submits += 1
+                self._has_room.wait_for(lambda: self._pending < self.max_pending)
+            self._pending += 1
+            lane.queue_depth += 1
+            lane.max_queue_depth = max(lane.max_queue_depth, lane.queue_depth)
+            mailbox = self._mailboxes.get(user_key)
+            if mailbox is not None:
+                # صندوق این کاربر در حال اجراست؛ آپدیت بعد از آپدیت‌های قبلی اجرا می‌شود
+                mailbox.append((update, lane))
+                return
+            self._mailboxes[user_key] = deque([(update, lane)])
+        lane.executor.submit(self._run_next, user_key)
+
+    def submit_many(self, updates):
+        for update in updates:
+            self.submit(update)
+
+    def _run_next(self, user_key):
+        with self._lock:
+            update, lane = self._mailboxes[user_key][0]
+            lane.queue_depth -= 1
+            lane.in_flight += 1
+        try:
+            self.process_updates([update])
+        except Exception as e:
+            logger.error(f"Error processing update {update.update_id} for {user_key}: {e}", exc_info=True)
+        finally:
+            for hook in self._post_process_hooks:
+                try:
+                    hook(user_key, update)
+                except Exception as e:
+                    logger.error(f"Post-process hook failed for update {update.update_id}: {e}")
+
+        with self._lock:
+            lane.in_flight -= 1
+            lane.processed += 1
+            self._pending -= 1
+            self._has_room.notify()
+            mailbox = self._mailboxes[user_key]
+            mailbox.popleft()
+            if not mailbox:
+                del self._mailboxes[user_key]
+                if self._pending == 0:
+                    self._idle.notify_all()
+                return
+            next_lane = mailbox[0][1]
+        # هر بار فقط یک آپدیت اجرا می‌شود تا کاربران دیگر هم نوبت بگیرند
+        next_lane.executor.submit(self._run_next, user_key)
+
+    def join(self, timeout=None):
+        """تا خالی شدن همه صندوق‌ها منتظر می‌ماند."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+    def get_metrics(self):
+        with self._lock:
+            metrics = {
+                name: {
+                    'queue_depth': lane.queue_depth,
+                    'in_flight': lane.in_flight,
+                    'processed': lane.processed,
+                    'max_queue_depth': lane.max_queue_depth,
+                }
+                for name, lane in self.lanes.items()
+            }
+            metrics['active_users'] = len(self._mailboxes)
+            metrics['pending'] = self._pending
+            metrics['blocked_submits'] = self.blocked_submits
+        return metrics
+
+    def _log_metrics_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            logger.info(f"Dispatcher metrics: {self.get_metrics()}")
+
+    def shutdown(self):
+        for lane in self.lanes.values():
+            lane.executor.shutdown(wait=True)
+
+
+class DispatchingTeleBot(telebot.TeleBot):
+    """
+    TeleBot که آپدیت‌های دریافتی (polling یا وب‌هوک) را به UpdateDispatcher می‌سپارد.
+    باید با threaded=False ساخته شود تا هندلرها مستقیماً روی threadهای dispatcher اجرا شوند.
+    """
+
+    def __init__(self, token, **kwargs):
+        kwargs.setdefault('threaded', False)
+        super().__init__(token, **kwargs)
+        self.dispatcher = UpdateDispatcher(self.process_updates_now)
+
+    def process_updates_now(self, updates):
+        super().process_new_updates(updates)
+
+    def process_new_updates(self, updates):
+        self.dispatcher.submit_many(updates)
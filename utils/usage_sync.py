@@ -0,0 +1,112 @@
+# utils/usage_sync.py
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api_client.client_registry import get_client_registry
+from config import USAGE_SYNC_INTERVAL_SECONDS, USAGE_SYNC_WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+def extract_client_usage(server_id, inbounds):
+    """
+    از خروجی list_inbounds پنل (که clientStats هر اینباند را هم دارد) ردیف‌های مصرف کلاینت‌ها را می‌سازد.
+    subId کلاینت از settings اینباند خوانده می‌شود تا مصرف یک اشتراک روی چند اینباند قابل جمع زدن باشد.
+    """
+    rows = []
+    for inbound in inbounds:
+        settings = inbound.get('settings') or '{}'
+        if isinstance(settings, str):
+            try:
+                settings = json.loads(settings)
+            except json.JSONDecodeError:
+                logger.warning(f"Invalid settings JSON for inbound {inbound.get('id')} on server {server_id}.")
+                settings = {}
+        sub_ids = {c.get('email'): c.get('subId') for c in settings.get('clients', []) if c.get('email')}
+        for stat in inbound.get('clientStats') or []:
+            email = stat.get('email')
+            if not email:
+                continue
+            rows.append((
+                server_id, email, sub_ids.get(email) or None,
+                int(stat.get('up') or 0), int(stat.get('down') or 0),
+                stat.get('total'), stat.get('expiryTime'), stat.get('enable'),
+            ))
+    return rows
+
+
+class UsageSync:
+    """
+    همگام‌سازی دوره‌ای مصرف ترافیک از پنل‌ها در جدول purchase_usage.
+    از هر سرور فقط یک درخواست list_inbounds در هر دوره ارسال می‌شود (سرورها همزمان) و نتیجه همه سرورها
+    در یک تراکنش نوشته می‌شود؛ نمایش جزئیات سرویس فقط جدول محلی را می‌خواند.
+    """
+
+    def __init__(self, db_manager, interval=USAGE_SYNC_INTERVAL_SECONDS, workers=USAGE_SYNC_WORKERS):
+        self.db_manager = db_manager
+        self.registry = get_client_registry(db_manager)
+        self.interval = interval
+        self.workers = workers
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _fetch_server(self, server):
+        client = self.registry.get_client(server)
+        if client is None:
+            return None
+        inbounds = client.list_inbounds()
+        # list_inbounds در صورت خطا لیست خالی برمی‌گرداند؛ در این حالت داده‌های قبلی دست نمی‌خورند
+        if not inbounds:
+            return None
+        return extract_client_usage(server['id'], inbounds)
+
+    def _safe_fetch(self, server):
+        try:
+            return self._fetch_server(server)
+        except Exception as e:
+            logger.error(f"Usage sync of server {server['id']} failed: {e}", exc_info=True)
+            return None
+
+    def sync_all(self):
+        """یک دور همگام‌سازی؛ (تعداد سرورهای موفق، تعداد ردیف‌ها) برمی‌گرداند."""
+        servers = [s for s in self.db_manager.get_all_servers() if s['is_active']]
+        if not servers:
+            return 0, 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(servers)), thread_name_prefix="usage-sync") as pool:
+            results = list(pool.map(self._safe_fetch, servers))
+
+        rows, synced_server_ids = [], []
+        for server, server_rows in zip(servers, results):
+            if server_rows is not None:
+                rows.extend(server_rows)
+                synced_server_ids.append(server['id'])
+        if synced_server_ids:
+            self.db_manager.upsert_purchase_usage(rows, synced_server_ids)
+        logger.info(f"Usage sync: {len(rows)} clients from {len(synced_server_ids)}/{len(servers)} servers "
+                    f"in {time.perf_counter() - start:.2f}s.")
+        return len(synced_server_ids), len(rows)
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run_forever, name="usage-sync", daemon=True)
+        self._thread.start()
+        logger.info(f"Usage sync scheduled every {self.interval}s.")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run_forever(self):
+        # اولین دور بلافاصله اجرا می‌شود تا پس از ری‌استارت داده‌ها زودتر تازه شوند
+        while True:
+            try:
+                self.sync_all()
+            except Exception as e:
+                logger.error(f"Scheduled usage sync failed: {e}", exc_info=True)
+            if self._stop.wait(self.interval):
+                return
@@ -13,11 +13,14 @@ project_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, project_path)
 
 # وارد کردن ماژول‌های پروژه
-from config import BOT_TOKEN, BOT_USERNAME_ALAMOR # <-- اصلاح شد
+from config import BOT_TOKEN, BOT_USERNAME_ALAMOR, PAYMENT_CLAIM_LEASE_SECONDS # <-- اصلاح شد
 from database.db_manager import DatabaseManager
 from utils.bot_helpers import send_subscription_info
 from utils.config_generator import ConfigGenerator
 from api_client.xui_api_client import XuiAPIClient
+from api_client.zarinpal_client import get_zarinpal_client
+from utils.job_queue import JobQueue
+from utils.media_cache import media_cache
 import telebot
 
 # تنظیمات اولیه
@@ -26,13 +29,92 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 db_manager = DatabaseManager()
+# این پروسه ممکن است پیش از ربات اجرا شود؛ جدول jobs و مایگریشن‌ها باید قبل از شروع صف کارها آماده باشند
+db_manager.create_tables()
+# file_idهای فایل‌های آپلود شده (QR کد، بکاپ) در دیتابیس ماندگار می‌شوند
+media_cache.attach(db_manager)
 bot = telebot.TeleBot(BOT_TOKEN)
 config_gen = ConfigGenerator(XuiAPIClient, db_manager)
 
-# آدرس API واقعی زرین‌پال
-ZARINPAL_VERIFY_URL = "https://api.zarinpal.com/pg/v4/payment/verify.json"
+# کلاینت زرین‌پال با سشن keep-alive و تلاش مجدد
+zarinpal = get_zarinpal_client()
 BOT_USERNAME = BOT_USERNAME_ALAMOR # <-- اصلاح شد
 
+# --- فعال‌سازی سرویس در پس‌زمینه ---
+ACTIVATION_JOB = "activate_online_payment"
+
+
+def activate_online_payment(payload):
+    """سرویس یک پرداخت آنلاین تایید شده را در پنل می‌سازد؛ در صورت خطا exception ایجاد می‌شود تا دوباره تلاش شود."""
+    payment = db_manager.get_payment_by_id(payload['payment_id'])
+    if not payment:
+        logger.error(f"Activation job: payment {payload['payment_id']} not found.")
+        return
+    user_telegram_id = db_manager.get_user_by_id(payment['user_id'])['telegram_id']
+    order_details = json.loads(payment['order_details_json'])
+
+    if order_details['plan_type'] == 'fixed_monthly':
+        plan = order_details['plan_details']
+        total_gb, duration_days = plan['volume_gb'], plan['duration_days']
+    else:
+        gb_plan = order_details['gb_plan_details']
+        total_gb, duration_days = order_details['requested_gb'], gb_plan.get('duration_days', 0)
+
+    # کار ممکن است دوباره اجرا شود (تلاش مجدد یا lease منقضی)؛ رزرو پرداخت از ساخت سرویس تکراری جلوگیری می‌کند
+    if not db_manager.claim_payment_provisioning(payment['id'], PAYMENT_CLAIM_LEASE_SECONDS):
+        if db_manager.get_payment_by_id(payment['id'])['provision_state'] == 'done':
+            logger.info(f"Activation job: payment {payment['id']} is already provisioned.")
+            return
+        raise RuntimeError(f"Payment {payment['id']} is being provisioned by another worker")
+
+    client_details, sub_link, single_configs = config_gen.create_client_and_configs(user_telegram_id, order_details['server_id'], total_gb, duration_days)
+    if not sub_link:
+        db_manager.release_payment_claim(payment['id'])
+        raise RuntimeError(f"Provisioning failed for payment {payment['id']}")
+
+    expire_date = (datetime.datetime.now() + datetime.timedelta(days=duration_days)) if duration_days and duration_days > 0 else None
+    plan_id = order_details.get('plan_details', {}).get('id') or order_details.get('gb_plan_details', {}).get('id')
+
+    purchase_id = db_manager.add_purchase(
+        user_id=payment['user_id'], server_id=order_details['server_id'], plan_id=plan_id,
+        expire_date=expire_date.strftime("%Y-%m-%d %H:%M:%S") if expire_date else None,
+        initial_volume_gb=total_gb, client_uuid=client_details['uuid'],
+        client_email=client_details['email'], sub_id=client_details['subscription_id'],
+        single_configs=single_configs
+    )
+    if not purchase_id:
+        # کلاینت ساخته شده حذف می‌شود تا تلاش بعدی کار سرویس دوم نسازد
+        config_gen.delete_created_clients(order_details['server_id'], client_details)
+        db_manager.release_payment_claim(payment['id'])
+        raise RuntimeError(f"Could not save purchase for payment {payment['id']}")
+    db_manager.complete_payment_provisioning(payment['id'])
+
+    bot.send_message(user_telegram_id, "✅ پرداخت شما با موفقیت تایید و سرویس شما فعال گردید.")
+    send_subscription_info(bot, user_telegram_id, sub_link)
+
+
+def notify_activation_failed(payload, error):
+    payment = db_manager.get_payment_by_id(payload['payment_id'])
+    user_db_info = db_manager.get_user_by_id(payment['user_id']) if payment else None
+    if user_db_info:
+        bot.send_message(user_db_info['telegram_id'], "❌ در فعال‌سازی سرویس شما خطایی رخ داد. لطفاً با پشتیبانی تماس بگیرید.")
+
+
+job_queue = JobQueue(db_manager)
+job_queue.register(ACTIVATION_JOB, activate_online_payment, on_final_failure=notify_activation_failed)
+job_queue.start()
+
+
+ACTIVATION_QUEUE_ERROR = "پرداخت شما انجام شد ولی ثبت درخواست فعال‌سازی با خطا مواجه شد. لطفاً چند لحظه دیگر همین صفحه را دوباره باز کنید یا با پشتیبانی تماس بگیرید."
+
+
+def _enqueue_activation(payment_id, authority):
+    job_id = job_queue.enqueue(ACTIVATION_JOB, {'payment_id': payment_id}, idempotency_key=f"activate:{authority}")
+    if not job_id:
+        logger.error(f"Could not enqueue activation job for payment {payment_id} (Authority: {authority}).")
+    return job_id
+
+
 @app.route('/', methods=['GET'])
 def index():
     return "AlamorVPN Bot Webhook Server is running."
@@ -57,50 +139,29 @@ def handle_zarinpal_callback():
 
     if payment['is_confirmed']:
         logger.warning(f"Payment ID {payment['id']} has already been confirmed.")
+        # اگر پروسه بین تایید و ثبت کار از کار افتاده باشد، کار فعال‌سازی اینجا دوباره ثبت می‌شود (با همان کلید، بدون تکرار)
+        if payment.get('provision_state') != 'done' and not _enqueue_activation(payment['id'], authority):
+            return render_template('payment_status.html', status='error', message=ACTIVATION_QUEUE_ERROR, bot_username=BOT_USERNAME)
         return render_template('payment_status.html', status='success', ref_id=payment.get('ref_id'), bot_username=BOT_USERNAME)
 
     if status == 'OK':
         order_details = json.loads(payment['order_details_json'])
         gateway = db_manager.get_payment_gateway_by_id(order_details['gateway_details']['id'])
         
-        payload = {"merchant_id": gateway['merchant_id'], "amount": int(payment['amount']) * 10, "authority": authority}
-        
         try:
-            response = requests.post(ZARINPAL_VERIFY_URL, json=payload, timeout=20)
-            response.raise_for_status()
-            result = response.json()
+            result = zarinpal.verify_payment(gateway['merchant_id'], int(payment['amount']) * 10, authority)
 
             if result.get("data") and result.get("data", {}).get("code") in [100, 101]:
                 ref_id = result.get("data", {}).get("ref_id", "N/A")
                 logger.info(f"Payment {payment['id']} verified successfully. Ref ID: {ref_id}")
-                
-                if order_details['plan_type'] == 'fixed_monthly':
-                    plan = order_details['plan_details']
-                    total_gb, duration_days = plan['volume_gb'], plan['duration_days']
-                else:
-                    gb_plan = order_details['gb_plan_details']
-                    total_gb, duration_days = order_details['requested_gb'], gb_plan.get('duration_days', 0)
-                
-                client_details, sub_link, single_configs = config_gen.create_client_and_configs(user_telegram_id, order_details['server_id'], total_gb, duration_days)
-                
-                if sub_link:
-                    expire_date = (datetime.datetime.now() + datetime.timedelta(days=duration_days)) if duration_days and duration_days > 0 else None
-                    plan_id = order_details.get('plan_details', {}).get('id') or order_details.get('gb_plan_details', {}).get('id')
-                    
-                    db_manager.add_purchase(
-                        user_id=payment['user_id'], server_id=order_details['server_id'], plan_id=plan_id,
-                        expire_date=expire_date.strftime("%Y-%m-%d %H:%M:%S") if expire_date else None,
-                        initial_volume_gb=total_gb, client_uuid=client_details['uuid'],
-                        client_email=client_details['email'], sub_id=client_details['subscription_id'],
-                        single_configs=single_configs
-                    )
-                    
-                    db_manager.confirm_online_payment(payment['id'], str(ref_id))
-                    bot.send_message(user_telegram_id, "✅ پرداخت شما با موفقیت تایید و سرویس شما فعال گردید.")
-                    send_subscription_info(bot, user_telegram_id, sub_link)
-                else:
-                    bot.send_message(user_telegram_id, "❌ در فعال‌سازی سرویس شما خطایی رخ داد. لطفاً با پشتیبانی تماس بگیرید.")
-                
+
+                # پرداخت همین‌جا تایید می‌شود و ساخت سرویس در پس‌زمینه انجام می‌شود تا کاربر منتظر پنل نماند
+                if not db_manager.confirm_online_payment(payment['id'], str(ref_id)):
+                    logger.error(f"Payment {payment['id']} was verified (Ref ID: {ref_id}) but could not be saved as confirmed.")
+                    return render_template('payment_status.html', status='error', message=ACTIVATION_QUEUE_ERROR, bot_username=BOT_USERNAME)
+                if not _enqueue_activation(payment['id'], authority):
+                    return render_template('payment_status.html', status='error', message=ACTIVATION_QUEUE_ERROR, bot_username=BOT_USERNAME)
+
                 return render_template('payment_status.html', status='success', ref_id=ref_id, bot_username=BOT_USERNAME)
             else:
                 error_message = result.get("errors", {}).get("message", "خطای نامشخص")